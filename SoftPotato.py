@@ -1,9 +1,10 @@
-from PyQt5 import QtWidgets, uic
+from PyQt5 import QtCore, QtWidgets, uic
 from pyqtgraph import PlotWidget
 import pyqtgraph as pg
 import sys
 import icon_rc
 
+import contextlib
 import numpy as np
 import webbrowser
 
@@ -19,6 +20,14 @@ global wf_params
 wf_params = [-0.5, 0.5, 1, 0.01, 2, "CV"]
 mech_params = [0, 1, 1e-5, 1e-5, 0, 1e-6, 1e8, 0.5, "QR"]
 Ageo = 1
+snap = None # Concentration profiles stored, see sp.snapshot_steps
+solver = "Explicit" # "Explicit", "Implicit" or "CN"
+lamb = 0.45 # dT/dX^2, <= 0.5 for the explicit solver
+grid = "Exp" # "Equal" or "Exp", spacing in x. Exp meets Randles-Sevcik within 1 % at dE = 0.01 (see sp.Convergence)
+tgrid = "lin" # "lin" or "log", spacing in t for chronoamperometry
+dtype = "float64" # "float64" or "float32", precision of the profiles (see sp.E_mec)
+steady = None # Tolerance to stop chronoamperometry at steady state, None runs all the time steps (see sp.Steady_state)
+cache = Sim_cache() # Finished runs, repeated runs are not solved again
 
 # Creat objects for default simulation
 #wf = Sweep()
@@ -42,22 +51,40 @@ class MainWindow(QtWidgets.QMainWindow):
         self.action_R.triggered.connect(self.save_R)
         self.action_x.triggered.connect(self.save_x)
         self.action_Save_all.triggered.connect(self.open_saveAll)
+        self.action_results.triggered.connect(self.save_binary)
+        self.actionOpen.triggered.connect(self.open_binary)
         
         # Connect Technique menu:
         self.actionCyclic_voltammetry.triggered.connect(self.openCV)
         self.actionChronoamperometry.triggered.connect(self.openCA)
+        self.actionDPV.triggered.connect(self.openDPV)
+        self.actionSWV.triggered.connect(self.openSWV)
         
         # Connect Simulation menu:
         self.actionMechanism.triggered.connect(self.openEmech)
         self.actionSimulate.triggered.connect(self.simulate)
         self.actionArea.triggered.connect(self.openArea)
+        self.actionStorage.triggered.connect(self.openStorage)
+        self.actionConvergence.triggered.connect(self.openConvergence)
+        self.actionPrecision.triggered.connect(self.checkPrecision)
+        # actionProfiling is checkable, runs started while it is checked are timed
 
         # Connect Help menu:
         self.actionHelp.triggered.connect(lambda: webbrowser.open('https://oliverrdz.xyz/soft-potato'))
         self.actionAbout.triggered.connect(self.openAbout)
         
-        # Connect slider for plotting:
+        # Connect slider for plotting, updates are coalesced to the display rate:
         self.slider_plots.valueChanged[int].connect(self.changeValue)
+        self.plotTimer = QtCore.QTimer(self)
+        self.plotTimer.setSingleShot(True)
+        self.plotTimer.setInterval(16) # ms, about 60 frames per second
+        self.plotTimer.timeout.connect(self.updatePlots)
+        self.init_plots()
+
+        # Simulations run in a background thread, runs requested meanwhile are queued:
+        self.btn_cancel.clicked.connect(self.cancel)
+        self.thread = None
+        self.queue = []
 
         self.header_save = "# Data simulated with Soft Potato 2.0, for more information visit https://oliverrdz.xyz/soft-potato\n"
 
@@ -68,33 +95,72 @@ class MainWindow(QtWidgets.QMainWindow):
         return fileName
 
     def save_tEi(self):
-        header = self.header_save + "# t/s, E/V, i/A"
+        header = self.header_save + "# t/s, E/V, i/A" + steady_note(self.sim)
         fileName = self.save_dialog()
         if fileName:
-            data = np.array([self.sim.t, self.sim.E, self.sim.i]).T
-            np.savetxt(fileName, data, delimiter=",", header=header)
+            with timed(self.sim, "export"):
+                data = np.array([self.sim.t, self.sim.E, self.sim.i]).T
+                np.savetxt(fileName, data, delimiter=",", header=header)
+            self.show_timings()
 
 
     def save_O(self):
         header = self.header_save + "# [O] / mol cm^-3"
         fileName = self.save_dialog()
         if fileName:
-            data = self.sim.cO.T
-            np.savetxt(fileName, data, delimiter=",", header=header)
+            with timed(self.sim, "export"):
+                data = self.sim.cO.T
+                np.savetxt(fileName, data, delimiter=",", header=header)
+            self.show_timings()
 
     def save_R(self):
         header = self.header_save + "# [R] / mol cm^-3"
         fileName = self.save_dialog()
         if fileName:
-            data = self.sim.cR.T
-            np.savetxt(fileName, data, delimiter=",", header=header)
+            with timed(self.sim, "export"):
+                data = self.sim.cR.T
+                np.savetxt(fileName, data, delimiter=",", header=header)
+            self.show_timings()
 
     def save_x(self):
         header = self.header_save + "# x / cm"
         fileName = self.save_dialog()
         if fileName:
-            data = self.sim.x
-            np.savetxt(fileName, data, delimiter=",", header=header)
+            with timed(self.sim, "export"):
+                data = self.sim.x
+                np.savetxt(fileName, data, delimiter=",", header=header)
+            self.show_timings()
+
+    def save_binary(self):
+        options = QtWidgets.QFileDialog.Options()
+        options |= QtWidgets.QFileDialog.DontUseNativeDialog
+        fileName, _ = QtWidgets.QFileDialog.getSaveFileName(self,"Save results","fileName.npz",
+                "Compressed NumPy (*.npz);;HDF5 (*.h5)", options=options)
+        if fileName:
+            try:
+                with timed(self.sim, "export"):
+                    save_results(self.sim, fileName)
+            except ImportError: # HDF5 needs h5py
+                self.statusBar().showMessage("Install h5py to save HDF5 files")
+            else:
+                self.show_timings()
+
+    def open_binary(self):
+        options = QtWidgets.QFileDialog.Options()
+        options |= QtWidgets.QFileDialog.DontUseNativeDialog
+        fileName, _ = QtWidgets.QFileDialog.getOpenFileName(self,"Open results","",
+                "Results (*.npz *.h5 *.hdf5)", options=options)
+        if fileName:
+            try:
+                res = load_results(fileName)
+            except (ImportError, OSError, KeyError, ValueError) as e:
+                self.statusBar().showMessage("Could not open %s: %s" %(fileName, e))
+                return
+            self.sim = res
+            self.slider_plots.setEnabled(True)
+            self.slider_plots.setValue(100)
+            self.plot(self.sim,-1)
+            self.statusBar().showMessage("Opened " + fileName)
 
     def open_saveAll(self, sim):
         self.saveAll = SaveAll_dialog(self.sim)
@@ -108,6 +174,14 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ca = CA_dialog()
         self.ca.exec_()
         
+    def openDPV(self):
+        self.dpv = DPV_dialog()
+        self.dpv.exec_()
+
+    def openSWV(self):
+        self.swv = SWV_dialog()
+        self.swv.exec_()
+
     def openEmech(self):
         self.mech_diag = Emech_dialog()
         self.mech_diag.exec_()
@@ -116,6 +190,80 @@ class MainWindow(QtWidgets.QMainWindow):
         self.area_diag = Area_dialog()
         self.area_diag.exec_()
 
+    def openStorage(self):
+        global snap
+        if snap is None:
+            text = "all"
+        elif isinstance(snap, str) or np.ndim(snap) == 0:
+            text = str(snap)
+        else:
+            text = ", ".join(str(ts) for ts in snap)
+        text, ok = QtWidgets.QInputDialog.getText(self, "Storage",
+                "Concentration profiles to store:\n"
+                "all (the samples for DPV and SWV), samples, last, N (every Nth step,\n"
+                "1 for every step of DPV and SWV) or times in s (0.1, 0.5, 1)", text=text)
+        if ok:
+            text = text.strip()
+            try:
+                if text == "all":
+                    snap = None
+                elif text in ("last", "samples"):
+                    snap = text
+                elif text.isdigit():
+                    snap = snap_every(int(text))
+                else: # Times, or a single time
+                    times = [float(ts) for ts in text.split(",")]
+                    if min(times) < 0:
+                        raise ValueError("Negative time")
+                    snap = times
+            except ValueError:
+                self.statusBar().showMessage("Invalid storage: " + text)
+
+    def openConvergence(self):
+        tol, ok = QtWidgets.QInputDialog.getDouble(self, "Convergence",
+                "Coarsest discretisation within (%) of the analytical limit:", 1, 0.01, 50, 2)
+        if not ok:
+            return
+        try:
+            study = Convergence(wf_params, mech_params, Ageo, solver, tol/100)
+        except ValueError as e: # No analytical limit for these parameters
+            self.statusBar().showMessage(str(e))
+            return
+        self.conv_thread = Convergence_thread(study)
+        self.conv_thread.message.connect(self.statusBar().showMessage)
+        self.conv_thread.done.connect(self.converged)
+        self.conv_thread.failed.connect(self.statusBar().showMessage)
+        self.conv_thread.start()
+
+    def converged(self, study):
+        global wf_params, lamb, grid
+        text = "Errors against %s:\n" %study.reference
+        text += "\n".join("%s: %.2f %% (%d x %d)" %(describe_setting(row["setting"]),
+                100*row["error"], row["nT"], row["nX"]) for row in study.rows)
+        if study.best is None:
+            self.statusBar().showMessage("No discretisation within %g %%" %(100*study.tol))
+            QtWidgets.QMessageBox.information(self, "Convergence", text)
+            return
+        self.statusBar().showMessage("Convergence: " + describe_setting(study.best))
+        answer = QtWidgets.QMessageBox.question(self, "Convergence", text +
+                "\n\nUse %s for the next runs?" %describe_setting(study.best))
+        if answer == QtWidgets.QMessageBox.Yes:
+            params = study.params(study.best)
+            wf_params = params["wf_params"]
+            lamb = params["lamb"]
+            grid = params["grid"]
+
+    def checkPrecision(self): # Deviation of a float32 run from float64, see sp.Simulate.deviation
+        sim = getattr(self, "sim", None)
+        if sim is None or getattr(getattr(sim, "mec", None), "dtype", np.float64) == np.float64:
+            self.statusBar().showMessage("Only float32 runs are compared with float64")
+            return
+        self.statusBar().showMessage("Comparing with float64")
+        self.precision_thread = Precision_thread(sim)
+        self.precision_thread.done.connect(self.statusBar().showMessage)
+        self.precision_thread.failed.connect(self.statusBar().showMessage)
+        self.precision_thread.start()
+
     def openHelp(self):
         QtCore.QUrl("https://oliverrdz.xyz/soft-potato")
 
@@ -124,47 +272,327 @@ class MainWindow(QtWidgets.QMainWindow):
         self.about_diag.exec_()
         
     def changeValue(self,value):
+        self.value = value
+        if not self.plotTimer.isActive():
+            self.plotTimer.start()
+
+    def updatePlots(self):
         sim = self.sim
         nMax = np.size(sim.t)
-        n = int(value*nMax/100)
+        n = int(self.value*nMax/100)
         self.plot(self.sim,n)
 
     def simulate(self):
+        # Parameters are copied so later changes in the dialogs don't affect this run
+        params = (list(wf_params), list(mech_params), Ageo, solver, lamb, run_grid(wf_params), tgrid, snap,
+                  "auto", dtype, steady if wf_params[-1] == "CA" else None)
+        if self.thread is not None and self.thread.isRunning():
+            self.queue.append(params)
+            self.statusBar().showMessage("Simulating, %d run(s) queued" %len(self.queue))
+            return
+        self.start(params)
+
+    def start(self, params):
+        key = run_key(*params)
+        sim = cache.get(key)
+        if sim is not None:
+            self.finished(sim, "Simulation finished (cached)")
+            self.next()
+            return
+        est = Estimate(*params, timed=False)
+        budget = memory_budget()
+        if budget is not None and est.memory > budget: # Would swap or be killed
+            self.statusBar().showMessage("Not run, it needs %s of memory and %s are available "
+                    "(see Simulation > Storage)" %(format_bytes(est.memory), format_bytes(available_memory())))
+            self.next()
+            return
         self.statusBar().showMessage("Simulating")
+        try:
+            sim = make_sim(*params)
+        except ValueError as e: # Unstable settings
+            self.statusBar().showMessage(str(e))
+            self.next()
+            return
+        if cache.rescale(sim): # Same dimensionless problem, e.g. another area
+            cache.put(key, sim)
+            self.finished(sim, "Simulation finished (rescaled)")
+            self.next()
+            return
+        if self.actionProfiling.isChecked():
+            sim.timings = Timings()
+        if self.thread is not None: # Ended, but it may still be returning from run()
+            self.thread.wait()
+        self.thread = Sim_thread(sim)
+        self.thread.done.connect(lambda sim: cache.put(key, sim))
+        self.thread.progress.connect(self.progressBar.setValue)
+        self.thread.message.connect(self.statusBar().showMessage)
+        self.thread.done.connect(self.finished)
+        self.thread.failed.connect(self.failed)
+        # The next queued run only replaces this thread once run() returned:
+        self.thread.finished.connect(lambda thread=self.thread: self.thread_finished(thread))
+        self.btn_cancel.setEnabled(True)
+        self.thread.start()
 
-        # Select the technique
-        global wf_params
-        if wf_params[-1] == "CV":
-            self.wf = Sweep(wf_params)
-        else:
-            self.wf = Step(wf_params)
+    def thread_finished(self, thread):
+        thread.wait()
+        if thread is self.thread:
+            self.next()
+
+    def next(self): # Starts the next queued run, if any
+        self.btn_cancel.setEnabled(False)
+        if self.queue:
+            self.start(self.queue.pop(0))
 
-        self.space = Equal_spc(self.wf)
-        self.mech = E_mec(self.wf, self.space, mech_params)
-        self.sim = Simulate(self.wf, self.space, self.mech, Ageo)
-        self.sim.fd(self.progressBar)
+    def cancel(self):
+        if self.thread is not None:
+            self.thread.cancel()
+
+    def finished(self, sim, message="Simulation finished"):
+        self.sim = sim
         self.slider_plots.setEnabled(True)
         self.statusBar().showMessage("Simulation finished.")
         self.slider_plots.setValue(100)
         self.plot(self.sim,-1)
         self.progressBar.setValue(100)
-        self.statusBar().showMessage("Simulation finished")
+        if getattr(sim, "tSteady", None) is not None:
+            message += ", steady state at %.3g s" %sim.tSteady
+        timings = getattr(sim, "timings", None)
+        if timings is not None:
+            message += ", " + timings.summary()
+        self.statusBar().showMessage(message)
 
-    def plot(self, sim,n):
+    def failed(self, message):
+        self.progressBar.setValue(0)
+        self.statusBar().showMessage(message)
+
+    def closeEvent(self, event):
+        self.queue = []
+        self.cancel()
+        if self.thread is not None:
+            self.thread.wait()
+        event.accept()
+
+    def init_plots(self):
+        # Curves are created once and updated with setData, long traces are
+        # drawn peak-downsampled and, when x is monotonic, clipped to the view
         self.plot1.setLabel('left', 'Potential', units='V')
         self.plot1.setLabel('bottom', 'Time', units='s')
-        self.plot1.plot(sim.t[0:n], sim.E[0:n], pen=pg.mkPen('k', width=3), clear=True)
+        self.curve_tE = self.plot1.plot(pen=pg.mkPen('k', width=3))
         self.plot2.setLabel('left', 'Current', units='A')
         self.plot2.setLabel('bottom', 'Potential', units='V')
-        self.plot2.plot(sim.E[0:n], sim.i[0:n], pen=pg.mkPen('k', width=3), clear=True)
+        self.curve_Ei = self.plot2.plot(pen=pg.mkPen('k', width=3))
         self.plot3.setLabel('left', 'Current', units='A')
         self.plot3.setLabel('bottom', 'Time', units='s')
-        self.plot3.plot(sim.t[0:n], sim.i[0:n], pen=pg.mkPen('k', width=3), clear=True)
+        self.curve_ti = self.plot3.plot(pen=pg.mkPen('k', width=3))
         self.plot4.addLegend()
         self.plot4.setLabel('left', 'Concentration', units='M')
         self.plot4.setLabel('bottom', 'Distance', units='m')
-        self.plot4.plot(sim.x*1e-2, sim.cR[n,:]*1e3, pen=pg.mkPen('k', width=3), name='[R]', clear=True)
-        self.plot4.plot(sim.x*1e-2, sim.cO[n,:]*1e3, pen=pg.mkPen('r', width=3), name='[O]')
+        # Profiles are plotted in mol/cm3 vs cm, the axes show M and m:
+        self.plot4.getAxis('left').setScale(1e3)
+        self.plot4.getAxis('bottom').setScale(1e-2)
+        self.curve_R = self.plot4.plot(pen=pg.mkPen('k', width=3), name='[R]')
+        self.curve_O = self.plot4.plot(pen=pg.mkPen('r', width=3), name='[O]')
+        for curve in (self.curve_tE, self.curve_Ei, self.curve_ti):
+            curve.setDownsampling(auto=True, method='peak')
+        for curve in (self.curve_tE, self.curve_ti):
+            curve.setClipToView(True)
+
+    def plot(self, sim,n):
+        with timed(sim, "plot"):
+            m = sim.profile(n) # Last stored concentration profile
+            # Slices are views, no data is copied:
+            self.curve_tE.setData(sim.t[0:n], sim.E[0:n])
+            if hasattr(getattr(sim, "wf", None), "net"): # Pulse techniques
+                self.curve_Ei.setData(*sim.wf.net(sim.i[0:n]))
+            else:
+                self.curve_Ei.setData(sim.E[0:n], sim.i[0:n])
+            self.curve_ti.setData(sim.t[0:n], sim.i[0:n])
+            self.curve_R.setData(sim.x, sim.cR[m,:])
+            self.curve_O.setData(sim.x, sim.cO[m,:])
+
+    def show_timings(self): # Summary of the timed phases of the run, see sp.Timings
+        timings = getattr(self.sim, "timings", None)
+        if timings is not None:
+            self.statusBar().showMessage("Timings, " + timings.summary())
+
+######################################################################################
+
+class Sim_thread(QtCore.QThread):
+    """
+    Runs sim.fd in a background thread, reporting the progress through
+    signals. A cancelled run stops at the next progress check.
+    """
+    progress = QtCore.pyqtSignal(int)
+    message = QtCore.pyqtSignal(str)
+    done = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, sim):
+        super(Sim_thread, self).__init__()
+        self.sim = sim
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def report(self, k, nT, elapsed, eta): # Called by Simulate.fd from the thread
+        self.progress.emit(int(100*k/nT))
+        self.message.emit("Simulating, %.0f s left" %eta)
+        return self.cancelled
+
+    def run(self):
+        try:
+            self.sim.fd(Progress(self.report))
+        except Exception as e:
+            self.failed.emit("Simulation failed: %s" %e)
+        else:
+            if self.sim.aborted:
+                self.failed.emit("Simulation cancelled")
+            else:
+                self.done.emit(self.sim)
+
+def run_grid(wf_params): # Grid of a run, pulse techniques always use the expanding one
+    return "Exp" if wf_params[-1] in ("DPV", "SWV") else grid
+
+def run_estimate(wf_params, **kwargs): # sp.Estimate of a run with the current settings
+    # Timed only once this machine is calibrated, see show_cost
+    settings = dict(mech_params=mech_params, Ageo=Ageo, solver=solver, lamb=lamb,
+                    grid=run_grid(wf_params), tgrid=tgrid, snap=snap, dtype=dtype, timed=None)
+    settings.update(kwargs)
+    return Estimate(wf_params, **settings)
+
+class Calibration_thread(QtCore.QThread):
+    """
+    Times the solver on this machine (sp.calibrate, a few short runs and
+    the Numba compilation) in a background thread, see show_cost.
+    """
+    done = QtCore.pyqtSignal()
+
+    def __init__(self, key):
+        super(Calibration_thread, self).__init__()
+        self.key = key
+        self.dialogs = set() # Refreshed when done
+
+    def run(self):
+        try:
+            calibrate(*self.key)
+        except Exception:
+            return # The estimates stay without a run time
+        self.done.emit()
+
+calibrations = {} # calibration_key: running Calibration_thread
+
+def show_cost(dialog, est):
+    # Shows est in the label_cost of dialog. Without a calibration the run
+    # time is added by dialog.update_cost once it is timed in the background
+    dialog.label_cost.setText(cost_text(est))
+    key = est.calibration_key
+    if est.time is not None or key in calibration:
+        return
+    if key not in calibrations:
+        thread = Calibration_thread(key)
+        thread.finished.connect(lambda: calibrations.pop(key).wait())
+        calibrations[key] = thread
+        thread.start()
+    thread = calibrations[key]
+    if dialog not in thread.dialogs:
+        thread.dialogs.add(dialog)
+        thread.done.connect(dialog.update_cost)
+
+def memory_budget(): # bytes a run may use, None if unknown
+    available = available_memory()
+    return None if available is None else 0.8*available
+
+def cost_text(est):
+    text = "Estimated: " + est.summary()
+    budget = memory_budget()
+    if budget is not None and est.memory > budget:
+        text = '<span style="color:red">%s, more than the %s available</span>' %(
+                text, format_bytes(available_memory()))
+    return text
+
+def steady_note(sim): # Header line of the t, E, i files of runs stopped at steady state
+    tSteady = getattr(sim, "tSteady", None)
+    if tSteady is None:
+        return ""
+    return "\n# Steady state at t = %g s, the later values are held" %tSteady
+
+def describe_snap(snap):
+    if snap == "last":
+        return "the last concentration profile only"
+    return "a concentration profile every %d time steps" %snap
+
+def check_memory(parent, est):
+    # Returns True if the run fits in memory, otherwise offers to store
+    # fewer concentration profiles
+    global snap
+    budget = memory_budget()
+    if budget is None or est.memory <= budget:
+        return True
+    fit = est.snap_for(budget)
+    text = "This run needs %s of memory and %s are available." %(format_bytes(est.memory),
+            format_bytes(available_memory()))
+    if fit is None:
+        QtWidgets.QMessageBox.warning(parent, "Memory", text + "\n\nUse a larger "
+                "step or the expanding grid (Simulation > Mechanism).")
+        return False
+    answer = QtWidgets.QMessageBox.question(parent, "Memory", text +
+            "\n\nStore %s instead?" %describe_snap(fit))
+    if answer != QtWidgets.QMessageBox.Yes:
+        return False
+    snap = fit
+    return True
+
+def timed(sim, name): # Times a phase in the Timings of sim, if it is being timed
+    timings = getattr(sim, "timings", None)
+    return contextlib.nullcontext() if timings is None else timings.phase(name)
+
+def describe_setting(setting):
+    return ", ".join("%s = %s" %(name, value) for name, value in setting.items())
+
+class Convergence_thread(QtCore.QThread):
+    """
+    Runs a Convergence study in a background thread, see Sim_thread.
+    """
+    message = QtCore.pyqtSignal(str)
+    done = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, study):
+        super(Convergence_thread, self).__init__()
+        self.study = study
+
+    def report(self, row):
+        self.message.emit("Convergence, %s: %.2f %%" %(describe_setting(row["setting"]), 100*row["error"]))
+
+    def run(self):
+        try:
+            self.study.run(self.report)
+        except Exception as e:
+            self.failed.emit("Convergence failed: %s" %e)
+        else:
+            self.done.emit(self.study)
+
+class Precision_thread(QtCore.QThread):
+    """
+    Runs the float64 reference of a float32 run in a background thread and
+    reports the deviation, see Sim_thread.
+    """
+    done = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, sim):
+        super(Precision_thread, self).__init__()
+        self.sim = sim
+
+    def run(self):
+        try:
+            dev = self.sim.deviation()
+        except Exception as e:
+            self.failed.emit("Comparison failed: %s" %e)
+        else:
+            self.done.emit("float32 vs float64: i within %.2g %%, [R] %.2g %%, [O] %.2g %% "
+                           "of bulk" %(100*dev["i"], 100*dev["cR"], 100*dev["cO"]))
 
 ######################################################################################
 
@@ -191,6 +619,16 @@ class CV_dialog(QtWidgets.QDialog):
             self.txt_dE.setText(str(wf_params[3]))
             self.txt_ns.setText(str(wf_params[4]))
 
+        # Size, memory and run time, updated as the values are typed:
+        for txt in (self.txt_Eini, self.txt_Efin, self.txt_sr, self.txt_dE, self.txt_ns):
+            txt.textChanged.connect(self.update_cost)
+        self.update_cost()
+
+    def update_cost(self):
+        try:
+            show_cost(self, run_estimate(self.get_values()))
+        except (ValueError, ZeroDivisionError, OverflowError):
+            self.label_cost.setText("")
             
     def get_values(self):
         self.Eini = float(self.txt_Eini.text())
@@ -202,7 +640,10 @@ class CV_dialog(QtWidgets.QDialog):
     
     def fun_ok(self):
         global wf_params
-        wf_params = self.get_values()
+        params = self.get_values()
+        if not check_memory(self, run_estimate(params, timed=False)):
+            return
+        wf_params = params
         self.reject()
 
     def fun_cancel(self):
@@ -267,16 +708,47 @@ class CA_dialog(QtWidgets.QDialog):
             self.txt_Es.setText(str(wf_params[0]))
             self.txt_ttot.setText(str(wf_params[1]))
             self.txt_dt.setText(str(wf_params[2]))
+        self.chk_log.setChecked(tgrid == "log")
+        if solver == "Explicit": # Unstable with the growing time steps
+            self.chk_log.setChecked(False)
+            self.chk_log.setEnabled(False)
+            self.chk_log.setToolTip("Log time steps need the implicit or Crank-Nicolson "
+                                    "solver (Simulation > Mechanism)")
+        self.chk_steady.setChecked(steady is not None)
+        if steady is not None:
+            self.txt_steady.setText(str(steady))
+        self.txt_steady.setEnabled(self.chk_steady.isChecked())
+        self.chk_steady.toggled.connect(self.txt_steady.setEnabled)
+
+        # Size, memory and run time, updated as the values are typed:
+        for txt in (self.txt_Es, self.txt_ttot, self.txt_dt):
+            txt.textChanged.connect(self.update_cost)
+        self.chk_log.toggled.connect(self.update_cost)
+        self.update_cost()
+
+    def update_cost(self):
+        try:
+            params = self.get_values()
+            show_cost(self, run_estimate(params, tgrid=self.tgrid))
+        except (ValueError, ZeroDivisionError, OverflowError):
+            self.label_cost.setText("")
             
     def get_values(self):
         self.Es = float(self.txt_Es.text())
         self.ttot = float(self.txt_ttot.text())
         self.dt = float(self.txt_dt.text())
+        self.tgrid = "log" if self.chk_log.isChecked() else "lin"
+        self.steady = float(self.txt_steady.text()) if self.chk_steady.isChecked() else None
         return [self.Es, self.ttot, self.dt, "CA"]
     
     def fun_ok(self):
-        global wf_params
-        wf_params = self.get_values()
+        global wf_params, tgrid, steady
+        params = self.get_values()
+        if not check_memory(self, run_estimate(params, tgrid=self.tgrid, timed=False)):
+            return
+        wf_params = params
+        tgrid = self.tgrid
+        steady = self.steady
         self.reject()
     
     def fun_cancel(self):
@@ -285,13 +757,89 @@ class CA_dialog(QtWidgets.QDialog):
     def fun_plot(self):
         ############ Plot can't be saved because window is a dialog
         params = self.get_values()
-        self.wf = Step(params)
+        self.wf = Step(params, self.tgrid)
         self.cv_plot.setLabel('left', 'Potential', units='V')
         self.cv_plot.setLabel('bottom', 'Time', units='s')
         self.cv_plot.plot(self.wf.t, self.wf.E, pen=pg.mkPen('k', width=3), clear=True)
 
 
 
+######################################################################################
+class Pulse_dialog(QtWidgets.QDialog):
+    # Base of DPV_dialog and SWV_dialog, fields are the waveform parameters
+    technique = None
+    fields = []
+    defaults = []
+
+    def __init__(self, uiFile):
+        super(Pulse_dialog, self).__init__()
+        uic.loadUi(uiFile, self)
+
+        # Connect buttons
+        self.btn_ok.clicked.connect(self.fun_ok)
+        self.btn_cancel.clicked.connect(self.fun_cancel)
+        self.btn_plot.clicked.connect(self.fun_plot)
+
+        # Recover the last used values
+        global wf_params
+        if wf_params[-1] != self.technique:
+            wf_params = self.defaults + [self.technique]
+        else:
+            for field, value in zip(self.fields, wf_params):
+                getattr(self, "txt_" + field).setText(str(value))
+
+        # Size, memory and run time, updated as the values are typed:
+        for field in self.fields:
+            getattr(self, "txt_" + field).textChanged.connect(self.update_cost)
+        self.update_cost()
+
+    def update_cost(self):
+        try:
+            show_cost(self, run_estimate(self.get_values()))
+        except (ValueError, ZeroDivisionError, OverflowError):
+            self.label_cost.setText("")
+
+    def get_values(self):
+        return [float(getattr(self, "txt_" + field).text()) for field in self.fields] + [self.technique]
+
+    def fun_ok(self):
+        global wf_params
+        params = self.get_values()
+        if not check_memory(self, run_estimate(params, timed=False)):
+            return
+        wf_params = params
+        self.reject()
+
+    def fun_cancel(self):
+        self.reject()
+
+    def fun_plot(self):
+        # The first periods only, pulse trains have many time steps
+        params = self.get_values()
+        self.wf = make_wf(params)
+        k = np.arange(min(self.wf.nT, 5*self.wf.nTau + 1))
+        self.cv_plot.setLabel('left', 'Potential', units='V')
+        self.cv_plot.setLabel('bottom', 'Time', units='s')
+        self.cv_plot.plot(self.wf.t[k], self.wf.E[k], pen=pg.mkPen('k', width=3), clear=True)
+
+class DPV_dialog(Pulse_dialog):
+    technique = "DPV"
+    fields = ["Eini", "Efin", "dEs", "Ep", "tp", "tau", "dt"]
+    defaults = [-0.5, 0.5, 0.005, 0.05, 0.01, 0.1, 1e-4]
+
+    def __init__(self):
+        super(DPV_dialog, self).__init__('DPV.ui')
+
+class SWV_dialog(Pulse_dialog):
+    technique = "SWV"
+    fields = ["Eini", "Efin", "dEs", "Esw", "f", "dt"]
+    defaults = [-0.5, 0.5, 0.005, 0.025, 25, 1e-4]
+
+    def __init__(self):
+        super(SWV_dialog, self).__init__('SWV.ui')
+
+
+
 ######################################################################################
 class Emech_dialog(QtWidgets.QDialog):
     def __init__(self):
@@ -307,6 +855,15 @@ class Emech_dialog(QtWidgets.QDialog):
         self.btn_ok.clicked.connect(self.fun_ok)
         self.btn_cancel.clicked.connect(self.fun_cancel)
         
+        # Recover the last used solver
+        self.txt_lamb.setText(str(lamb))
+        self.rBtn_implicit.setChecked(solver == "Implicit")
+        self.rBtn_CN.setChecked(solver == "CN")
+        self.rBtn_explicit.setChecked(solver == "Explicit")
+        self.chk_exp.setChecked(grid == "Exp")
+        self.chk_exp.setToolTip("For CV and CA, DPV and SWV always use the expanding grid")
+        self.chk_float32.setChecked(dtype == "float32")
+
         # Recover the last used values
         global mech_params
         try:
@@ -374,7 +931,28 @@ class Emech_dialog(QtWidgets.QDialog):
     def fun_ok(self):
         #params = self.get_values()
         #self.rBtn_kinetics()
-        global mech_params
+        global mech_params, solver, lamb, grid, tgrid, dtype
+        if self.rBtn_implicit.isChecked():
+            new_solver = "Implicit"
+        elif self.rBtn_CN.isChecked():
+            new_solver = "CN"
+        else:
+            new_solver = "Explicit"
+        new_lamb = float(self.txt_lamb.text())
+        if new_solver == "Explicit" and new_lamb > 0.5:
+            QtWidgets.QMessageBox.warning(self, "Solver",
+                    "The explicit solver is unstable for lambda > 0.5, "
+                    "use the implicit or Crank-Nicolson solver.")
+            return
+        if new_solver == "Explicit" and tgrid == "log":
+            QtWidgets.QMessageBox.information(self, "Solver",
+                    "The explicit solver is unstable with log time steps, "
+                    "chronoamperometry is set back to equal time steps.")
+            tgrid = "lin"
+        solver = new_solver
+        lamb = new_lamb
+        grid = "Exp" if self.chk_exp.isChecked() else "Equal"
+        dtype = "float32" if self.chk_float32.isChecked() else "float64"
         mech_params = self.get_values()
         self.reject()
         
@@ -425,21 +1003,22 @@ class SaveAll_dialog(QtWidgets.QDialog):
         if pathName:
             fileName = pathName + "/" + self.txt_fileName.text()
             
-            header = self.header_save + "# t/s, E/V, i/A"
-            data = np.array([self.sim.t, self.sim.E, self.sim.i]).T
-            np.savetxt(fileName + "_tEi.txt", data, delimiter=",", header=header)
+            with timed(self.sim, "export"):
+                header = self.header_save + "# t/s, E/V, i/A" + steady_note(self.sim)
+                data = np.array([self.sim.t, self.sim.E, self.sim.i]).T
+                np.savetxt(fileName + "_tEi.txt", data, delimiter=",", header=header)
 
-            header = self.header_save + "# [O] / mol cm^-3"
-            data = self.sim.cO.T
-            np.savetxt(fileName + "_[O].txt", data, delimiter=",", header=header)
+                header = self.header_save + "# [O] / mol cm^-3"
+                data = self.sim.cO.T
+                np.savetxt(fileName + "_[O].txt", data, delimiter=",", header=header)
 
-            header = self.header_save + "# [R] / mol cm^-3"
-            data = self.sim.cR.T
-            np.savetxt(fileName + "_[R].txt", data, delimiter=",", header=header)
+                header = self.header_save + "# [R] / mol cm^-3"
+                data = self.sim.cR.T
+                np.savetxt(fileName + "_[R].txt", data, delimiter=",", header=header)
 
-            header = self.header_save + "# x / cm"
-            data = self.sim.x
-            np.savetxt(fileName + "_x.txt", data, delimiter=",", header=header)
+                header = self.header_save + "# x / cm"
+                data = self.sim.x
+                np.savetxt(fileName + "_x.txt", data, delimiter=",", header=header)
 
             self.reject()
 
@@ -1,7 +1,14 @@
 #!/usr/bin/python
 
+import os
+import threading
+import time
+
 import numpy as np
-import matplotlib.pyplot as plt
+
+# Only numpy is imported with the module, so it can be used headless and
+# starts quickly. scipy, matplotlib and multiprocessing are imported by the
+# classes that need them.
 
 
 ## Electrochemistry constants
@@ -12,13 +19,73 @@ FRT = F/(R*T)
 
 ########## Potential Waveforms
 
+class Lazy_array:
+    """
+
+    Read-only 1-D array whose elements are computed when indexed, used for
+    t and E of waveforms created with lazy=True.
+
+    Parameters
+    ----------
+    fun:    vectorised function returning the elements at an array of
+            indices
+    n:      length
+
+    Indexing with an int, a slice or an index array only computes those
+    elements, iter_chunks reads it in blocks and np.asarray builds the
+    whole array.
+    """
+
+    ndim = 1
+
+    def __init__(self, fun, n):
+        self.fun = fun
+        self.n = n
+        self.size = n
+        self.shape = (n,)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return self.fun(np.arange(*k.indices(self.n)))
+        k = np.asarray(k)
+        if np.any((k >= self.n) | (k < -self.n)):
+            raise IndexError("index out of range for length %d" %self.n)
+        return self.fun(np.where(k < 0, k + self.n, k))[()]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.fun(np.arange(self.n)), dtype)
+
+def iter_chunks(a, size=2**16):
+    """
+    Yields (k0, a[k0:k0+size]) for an array or a Lazy_array.
+    """
+    for k0 in range(0, len(a), size):
+        yield k0, a[k0:k0+size]
+
+def chunked(fun, a):
+    """
+    Returns fun(a) for elementwise fun, computed in blocks for a Lazy_array.
+    """
+    if not isinstance(a, Lazy_array):
+        return fun(a)
+    out = np.empty(len(a))
+    for k0, chunk in iter_chunks(a):
+        out[k0:k0+len(chunk)] = fun(chunk)
+    return out
+
 class Sweep:
     """
     Returns t and E for a sweep potential waveform.
     All the parameters are given a default value.
+
+    t and E are built in one vectorised pass, with lazy=True they are
+    Lazy_arrays computed as they are read.
     """
 
-    def __init__(self, params):
+    def __init__(self, params, lazy=False):
         self.Eini = params[0]
         self.Efin = params[1]
         self.sr = params[2]
@@ -26,17 +93,27 @@ class Sweep:
         self.ns = params[4]
 
         Ewin = abs(self.Efin-self.Eini)
-        tsw = Ewin/self.sr # total time for one sweep
-        nt = int(Ewin/self.dE)
+        self.tsw = Ewin/self.sr # total time for one sweep
+        self.nt = int(Ewin/self.dE)
+        self.nT = self.nt*self.ns
 
-        self.E = np.array([])
-        self.t = np.linspace(0, tsw*self.ns, nt*self.ns)
+        # One forward and one backward sweep, repeated:
+        self.up = np.linspace(self.Eini, self.Efin, self.nt)
+        self.down = np.linspace(self.Efin, self.Eini, self.nt)
 
-        for n in range(1, self.ns+1):
-            if (n%2 == 1):
-                self.E = np.append(self.E, np.linspace(self.Eini, self.Efin, nt))
-            else:
-                self.E = np.append(self.E, np.linspace(self.Efin, self.Eini, nt))
+        self.t = Lazy_array(self.time, self.nT)
+        self.E = Lazy_array(self.potential, self.nT)
+        if not lazy:
+            self.t = np.asarray(self.t)
+            self.E = np.asarray(self.E)
+
+    def time(self, k): # t[k], as np.linspace(0, tsw*ns, nT)
+        ttot = self.tsw*self.ns
+        return np.where(k == self.nT-1, ttot, k*(ttot/(self.nT-1)))
+
+    def potential(self, k): # E[k]
+        i = k%self.nt
+        return np.where((k//self.nt)%2 == 0, self.up[i], self.down[i])
 
 
 
@@ -44,17 +121,187 @@ class Step:
     """
     Returns t and E for a step potential waveform.
     All the parameters are given a default value.
+
+    With tgrid="log" the time steps start at dt and grow by a factor
+    gamma, resolving the transient after the step with few points.
+    With lazy=True t and E are Lazy_arrays, see Sweep.
     """
 
-    def __init__(self, params):
+    def __init__(self, params, tgrid="lin", gamma=1.05, lazy=False):
 
         self.Es = params[0]
         self.ttot = params[1]
         self.dt = params[2]
-        self.nt = int(self.ttot/self.dt)
+        self.tgrid = tgrid
+        self.gamma = gamma
+
+        if tgrid == "log":
+            n = int(np.ceil(np.log(1 + self.ttot*(gamma-1)/self.dt)/np.log(gamma)))
+            self.nt = n + 1
+        else:
+            self.nt = int(self.ttot/self.dt)
+        self.nT = self.nt
 
-        self.E = np.ones([self.nt])*self.Es
-        self.t = np.linspace(0, self.ttot, self.nt)
+        self.t = Lazy_array(self.time, self.nt)
+        self.E = Lazy_array(self.potential, self.nt)
+        if not lazy:
+            self.t = np.asarray(self.t)
+            self.E = np.asarray(self.E)
+
+    def time(self, k): # t[k]
+        if self.tgrid == "log":
+            t = self.dt*(self.gamma**k - 1)/(self.gamma - 1)
+        else: # As np.linspace(0, ttot, nt)
+            t = k*(self.ttot/(self.nt-1))
+        return np.where(k == self.nt-1, self.ttot, t)
+
+    def potential(self, k): # E[k]
+        return np.ones(np.shape(k))*self.Es
+
+
+
+class Pulse:
+    """
+
+    Returns t and E for differential pulse voltammetry (DPV): each period
+    tau the base potential moves by dEs, and a pulse of Ep lasts for the
+    last tp of the period. The current is only kept at the end of the base
+    and at the end of the pulse (kSample), see Simulate.
+
+    Parameters
+    ----------
+    params: [Eini, Efin, dEs, Ep, tp, tau, dt]
+            V, V, V, V, s, s, s
+    lazy:   if True (default), t and E are Lazy_arrays, see Sweep
+
+    Returns
+    -------
+    t:          s, time array
+    E:          V, potential array
+    kSample:    time indices of the sampled currents, base and pulse of
+                each period in turn
+    Eb:         V, base potential of each period
+
+    Examples
+    --------
+    >>> wf = sp.Pulse([-0.5, 0.5, 0.005, 0.05, 0.01, 0.1, 1e-4])
+    >>> sim.fd()
+    >>> Eb, di = wf.net(sim.i) # Differential current
+    """
+
+    def __init__(self, params, lazy=True):
+        self.Eini = params[0]
+        self.Efin = params[1]
+        self.dEs = params[2]
+        self.Ep = params[3]
+        self.tp = params[4]
+        self.tau = params[5]
+        self.dt = params[6]
+
+        sgn = 1 if self.Efin >= self.Eini else -1
+        self.nP = int(round(abs(self.Efin-self.Eini)/self.dEs)) + 1 # periods
+        self.nTau = int(round(self.tau/self.dt)) # time steps per period
+        self.nPulse = int(round(self.tp/self.dt)) # time steps per pulse
+        self.nT = self.nP*self.nTau + 1
+        self.Eb = self.Eini + sgn*self.dEs*np.arange(self.nP)
+
+        pulseEnd = self.nTau*np.arange(1, self.nP+1)
+        self.kSample = np.stack([pulseEnd - self.nPulse, pulseEnd], axis=1).ravel()
+
+        self.t = Lazy_array(self.time, self.nT)
+        self.E = Lazy_array(self.potential, self.nT)
+        if not lazy:
+            self.t = np.asarray(self.t)
+            self.E = np.asarray(self.E)
+
+    def time(self, k): # t[k]
+        return k*self.dt
+
+    def potential(self, k): # E[k], applied from t[k-1] to t[k]
+        p = np.maximum(k-1, 0)//self.nTau # period
+        q = np.maximum(k-1, 0)%self.nTau # time step within the period
+        pulse = (q >= self.nTau - self.nPulse) & (k > 0)
+        return self.Eb[p] + np.where(pulse, self.Ep, 0.0)
+
+    def net(self, i):
+        """
+        Returns the base potentials and the differential current, pulse
+        minus base, for the currents sampled at kSample.
+        """
+        i = np.asarray(i)
+        return self.Eb[:len(i)//2], i[1::2] - i[:-1:2]
+
+
+
+class Square_wave:
+    """
+
+    Returns t and E for square-wave voltammetry (SWV): each period 1/f the
+    base potential moves by dEs, the first half is at Eb + Esw and the second
+    at Eb - Esw (in the direction of the scan). The current is only kept at
+    the end of each half period (kSample), see Simulate.
+
+    Parameters
+    ----------
+    params: [Eini, Efin, dEs, Esw, f, dt]
+            V, V, V, V, Hz, s
+    lazy:   if True (default), t and E are Lazy_arrays, see Sweep
+
+    Returns
+    -------
+    t:          s, time array
+    E:          V, potential array
+    kSample:    time indices of the sampled currents, forward and reverse
+                of each period in turn
+    Eb:         V, base potential of each period
+
+    Examples
+    --------
+    >>> wf = sp.Square_wave([-0.5, 0.5, 0.005, 0.025, 25, 1e-4])
+    >>> sim.fd()
+    >>> Eb, di = wf.net(sim.i) # Net current, forward minus reverse
+    """
+
+    def __init__(self, params, lazy=True):
+        self.Eini = params[0]
+        self.Efin = params[1]
+        self.dEs = params[2]
+        self.Esw = params[3]
+        self.f = params[4]
+        self.dt = params[5]
+
+        self.sgn = 1 if self.Efin >= self.Eini else -1
+        self.nP = int(round(abs(self.Efin-self.Eini)/self.dEs)) + 1 # periods
+        self.nHalf = max(1, int(round(0.5/(self.f*self.dt)))) # time steps per half period
+        self.nTau = 2*self.nHalf
+        self.nT = self.nP*self.nTau + 1
+        self.Eb = self.Eini + self.sgn*self.dEs*np.arange(self.nP)
+
+        periodEnd = self.nTau*np.arange(1, self.nP+1)
+        self.kSample = np.stack([periodEnd - self.nHalf, periodEnd], axis=1).ravel()
+
+        self.t = Lazy_array(self.time, self.nT)
+        self.E = Lazy_array(self.potential, self.nT)
+        if not lazy:
+            self.t = np.asarray(self.t)
+            self.E = np.asarray(self.E)
+
+    def time(self, k): # t[k]
+        return k*self.dt
+
+    def potential(self, k): # E[k], applied from t[k-1] to t[k]
+        p = np.maximum(k-1, 0)//self.nTau # period
+        q = np.maximum(k-1, 0)%self.nTau # time step within the period
+        E = self.Eb[p] + np.where(q < self.nHalf, 1, -1)*self.sgn*self.Esw
+        return np.where(k > 0, E, self.Eini)
+
+    def net(self, i):
+        """
+        Returns the base potentials and the net current, forward minus
+        reverse, for the currents sampled at kSample.
+        """
+        i = np.asarray(i)
+        return self.Eb[:len(i)//2], i[:-1:2] - i[1::2]
 
 
 
@@ -66,6 +313,7 @@ class Construct_wf:
     Parameters
     ----------
     wf:     list containing the waveform object
+    lazy:   if True, t and E are Lazy_arrays, see Sweep
 
     Returns
     -------
@@ -82,22 +330,58 @@ class Construct_wf:
     Returns t and E calculated with the parameters given
     """
 
-    def __init__(self, wf):
-        n = len(wf)
-        t = np.array([0])
-        E = np.array([0])
+    def __init__(self, wf, lazy=False):
+        self.wf = wf
+        # Each waveform starts at the last time of the previous one:
+        n = np.array([len(w.t) for w in wf])
+        self.start = np.concatenate([[0], np.cumsum(n)])
+        self.offset = [0]
+        for i in range(len(wf)-1):
+            self.offset.append(wf[i].t[-1] + self.offset[-1])
+        self.nT = int(self.start[-1])
+
+        self.t = Lazy_array(self.time, self.nT)
+        self.E = Lazy_array(self.potential, self.nT)
+        if not lazy:
+            self.t = np.asarray(self.t)
+            self.E = np.asarray(self.E)
+
+    def pieces(self, k): # Yields the waveform index, mask and local indices of k
+        i = np.searchsorted(self.start, k, side="right") - 1
+        for j in np.unique(i):
+            mask = i == j
+            yield j, mask, k[mask] - self.start[j]
+
+    def time(self, k): # t[k]
+        t = np.empty(np.shape(k))
+        for j, mask, kj in self.pieces(k):
+            t[mask] = self.wf[j].t[kj] + self.offset[j]
+        return t
+
+    def potential(self, k): # E[k]
+        E = np.empty(np.shape(k))
+        for j, mask, kj in self.pieces(k):
+            E[mask] = self.wf[j].E[kj]
+        return E
 
-        for i in range(n):
-            t = np.concatenate([t,wf[i].t+t[-1]])
-            E = np.concatenate([E,wf[i].E])
 
-        # Remove first data point to prevent repeating time
-        self.t = t[1:]
-        self.E = E[1:]
 
+########## Spacing:
 
+def min_dT(t):
+    """
+    Returns the smallest normalised time step in t, which is 1/nT for
+    equally spaced time. t is read in blocks (see iter_chunks).
+    """
+    dtMin = np.inf
+    last = None
+    for k0, c in iter_chunks(t):
+        dt = np.diff(c if last is None else np.concatenate([[last], c]))
+        if np.any(dt > 0):
+            dtMin = min(dtMin, np.min(dt[dt > 0]))
+        last = c[-1]
+    return min(1/len(t), dtMin/t[-1])
 
-########## Spacing:
 
 class Equal_spc:
     """
@@ -133,8 +417,8 @@ class Equal_spc:
         self.lamb = lamb
 
         #%% Simulation parameters
-        nT = np.size(t) # number of time elements
-        dT = 1/nT # adimensional step time
+        nT = len(t) # number of time elements
+        dT = min_dT(t) # adimensional step time
         Xmax = 6*np.sqrt(nT*lamb) # Infinite distance
         dX = np.sqrt(dT/lamb) # distance increment
         nX = int(Xmax/dX) # number of distance elements
@@ -142,16 +426,150 @@ class Equal_spc:
 
         self.lamb = lamb
         self.nT = nT
+        self.dT = dT
         self.nX = nX
         self.dX = dX
         self.X = X
+        self.uniform = True
+
+
+
+class Exp_spc:
+    """
+
+    Creates equal spacing in T and an exponentially expanding grid in X,
+    fine at the electrode and coarse towards bulk.
+
+    Parameters
+    ----------
+    wf:     waveform object
+    lamb:   dT/dX^2 at the electrode (0.45)
+    gamma:  ratio between consecutive distance increments (1.1)
+    Xmax:   normalised infinite distance, in diffusion layer thicknesses (6)
+
+    Returns
+    -------
+    lamb:   dT/dX^2 at the electrode
+    nT:     normalised time, nT = t/tMax
+    dX:     first distance increment, dX = np.sqrt(dT/lamb)
+    nX:     number of distance elements
+    X:      normalised distance, X[i] = dX*(gamma^i - 1)/(gamma - 1)
+    lambL:  dT/dX^2 towards the electrode for the interior nodes
+    lambR:  dT/dX^2 towards bulk for the interior nodes
+
+    Examples
+    --------
+    >>> import softpotato as sp
+    >>> wf = sp.Sweep([Eini, Efin, sr, dE, ns])
+    >>> space = sp.Exp_spc(wf, lamb=0.45, gamma=1.1)
+    """
+
+    def __init__(self, wf, lamb=0.45, gamma=1.1, Xmax=6):
+        t = wf.t
+
+        #%% Simulation parameters
+        nT = len(t) # number of time elements
+        dT = min_dT(t) # adimensional step time
+        dX = np.sqrt(dT/lamb) # distance increment at the electrode
+        nX = int(np.ceil(np.log(1 + Xmax*(gamma-1)/dX)/np.log(gamma))) + 1
+        h = dX*gamma**np.arange(nX-1) # distance increments
+        X = np.concatenate([[0], np.cumsum(h)]) # Discretisation of distance
+
+        self.lamb = lamb
+        self.gamma = gamma
+        self.nT = nT
+        self.dT = dT
+        self.nX = nX
+        self.dX = dX
+        self.X = X
+        self.uniform = False
+        # Three point stencil for the interior nodes:
+        self.lambL = 2*dT/(h[:-1]*(h[:-1] + h[1:]))
+        self.lambR = 2*dT/(h[1:]*(h[:-1] + h[1:]))
+
+
+########## Storage:
+
+def snap_every(snap):
+    """
+    Returns N of a schedule storing every Nth time step, raises ValueError
+    unless it is a whole number >= 1.
+    """
+    if isinstance(snap, (bool, np.bool_)) or int(snap) != snap or snap < 1:
+        raise ValueError("Profiles are stored every N >= 1 time steps, got %s" %snap)
+    return int(snap)
+
+def snapshot_steps(t, snap=None, kSample=None):
+    """
+
+    Returns the time indices at which concentration profiles are stored.
+
+    Parameters
+    ----------
+    t:          s, time array
+    snap:       None, stores every time step (full nT x nX matrices), or
+                the samples for sampled waveforms
+                int N, stores every Nth time step and the last one (1 for
+                every time step of a sampled waveform)
+                "last", stores the last time step only
+                "samples", stores the sampled time steps kSample
+                list of times in s, stores the closest time step to each one
+    kSample:    sampled time steps of Pulse and Square_wave, whose full
+                history (millions of time steps) is only stored on request
+
+    Returns
+    -------
+    kSnap:  sorted array of time indices
+
+    Examples
+    --------
+    >>> kSnap = snapshot_steps(wf.t, 100)
+    >>> kSnap = snapshot_steps(wf.t, [0.1, 0.5, 1])
+    """
+    nT = len(t)
+    if snap is None and kSample is not None:
+        snap = "samples"
+    if snap is None:
+        return np.arange(nT)
+    if isinstance(snap, str):
+        if snap == "last":
+            return np.array([nT-1])
+        if snap == "samples" and kSample is not None:
+            return np.asarray(kSample)
+        raise ValueError("Unknown snapshot schedule: " + snap)
+    if np.ndim(snap) == 0:
+        return np.union1d(np.arange(0, nT, snap_every(snap)), [nT-1])
+    # Closest time index to each requested time:
+    t = np.asarray(t)
+    k = np.clip(np.searchsorted(t, snap), 1, nT-1)
+    k = k - ((np.asarray(snap) - t[k-1]) < (t[k] - np.asarray(snap)))
+    return np.unique(k)
+
 
 
 ########## Mechanisms:
 
 class E_mec:
+    """
+
+    Single electron transfer, O + ne <=> R.
+
+    Parameters
+    ----------
+    wf:     waveform object
+    space:  spacing object
+    params: [E0, n, DO, DR, cOb, cRb, ks, alpha, BV]
+    snap:   snapshot schedule, see snapshot_steps. If None, CR and CO hold
+            the full nT x nX history, otherwise only two working rows are
+            kept and the profiles at kSnap are copied to CRs and COs.
+            Sampled waveforms (Pulse, Square_wave) store their samples by
+            default, snap=1 stores every time step.
+    dtype:  precision of CR, CO and the stored profiles, "float64" or
+            "float32" (half the memory, for screening runs; the current is
+            always accumulated in float64, see Simulate.deviation)
+    """
 
-    def __init__(self, wf, space, params):
+    def __init__(self, wf, space, params, snap=None, dtype="float64"):
 
         self.nT = space.nT
         self.nX = space.nX
@@ -172,33 +590,619 @@ class E_mec:
         self.K0 = self.ks*self.delta/self.DR # Normalised standard rate constant
         self.DOR = self.DO/self.DR
 
+        ## Storage of the profiles
+        kSample = getattr(wf, "kSample", None)
+        if snap is None and kSample is not None: # Not the history of every time step
+            snap = "samples"
+        self.kSnap = snapshot_steps(wf.t, snap, kSample)
+        if snap is None: # Full history
+            self.nRows = self.nT
+        else: # Rolling window of the last two time steps
+            self.nRows = 2
+
         ## Discretisation of variables and initialisation
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float64, np.float32):
+            raise ValueError("dtype must be float64 or float32, not " + str(dtype))
         if self.cRb == 0: # In case only O present in solution
-            CR = np.zeros([self.nT,self.nX])
-            CO = np.ones([self.nT,self.nX])
+            CR = np.zeros([self.nRows,self.nX], self.dtype)
+            CO = np.ones([self.nRows,self.nX], self.dtype)
         else:
-            CR = np.ones([self.nT,self.nX])
-            CO = np.ones([self.nT,self.nX])*self.cOb/self.cRb
+            CR = np.ones([self.nRows,self.nX], self.dtype)
+            CO = np.full([self.nRows,self.nX], self.cOb/self.cRb, self.dtype)
 
         self.CR = CR
         self.CO = CO
+        if snap is None: # Profiles are the history itself
+            self.CRs = CR
+            self.COs = CO
+        else:
+            self.CRs = np.zeros([np.size(self.kSnap),self.nX], self.dtype)
+            self.COs = np.zeros([np.size(self.kSnap),self.nX], self.dtype)
+
+
+class Multi_mec:
+    """
+
+    Mechanism with any number of species, electron transfers and first or
+    second order homogeneous reactions, solved by Simulate_multi. All the
+    species are stored in one stacked array (species x nodes), each with
+    its own diffusion coefficient. make_mec builds the EC, CE, ECE and EC'
+    mechanisms.
+
+    Parameters
+    ----------
+    wf:         waveform object
+    space:      spacing object
+    species:    names, e.g. ["O", "R", "Z"]
+    D:          cm2/s, diffusion coefficient of each species
+    c:          mol/cm3, bulk concentration of each species
+    transfers:  electron transfers [ox, red, E0, n, ks, alpha, BV], ox + ne <-> red,
+                BV is "QR", "RO" or "OR" as in E_mec
+    reactions:  homogeneous reactions [reactants, products, kf, kb], one or two
+                species each; kf and kb in s^-1 (one species) or
+                cm3 mol^-1 s^-1 (two)
+    snap:       snapshot schedule, see E_mec
+    dtype:      precision of C and the stored profiles, see E_mec
+    name:       printed by Simulate_multi
+
+    Examples
+    --------
+    >>> mec = sp.Multi_mec(wf, space, ["O", "R", "Z"], [1e-5, 1e-5, 1e-5], [1e-6, 0, 0],
+    ...                    [["O", "R", 0, 1, 1e8, 0.5, "QR"]], [[["R"], ["Z"], 10, 0]])
+    >>> sim = sp.Simulate_multi(wf, space, mec)
+    """
+
+    def __init__(self, wf, space, species, D, c, transfers, reactions=(), snap=None,
+                 dtype="float64", name="Multi"):
+
+        self.nT = space.nT
+        self.nX = space.nX
+        self.dX = space.dX
+        self.lamb = space.lamb
+        self.name = name
+
+        self.species = list(species)
+        self.nS = len(self.species)
+        index = {s: i for i, s in enumerate(self.species)}
+        self.D = np.asarray(D, dtype=float)
+        self.c = np.asarray(c, dtype=float)
+        # Distance is normalised with the fastest species and concentrations
+        # with the largest bulk one:
+        self.Dref = np.max(self.D)
+        self.cRef = np.max(self.c)
+        if not self.cRef > 0:
+            raise ValueError("At least one species must be in solution")
+        ttot = wf.t[-1]
+        self.delta = np.sqrt(self.Dref*ttot) # cm, diffusion layer thickness
+        self.d = self.D/self.Dref # Diffusion ratios, <= 1
+
+        ## Electron transfers, A is the flux of each species into the
+        ## electrode per unit reduction rate of each transfer
+        self.transfers = [list(p) for p in transfers]
+        nJ = len(self.transfers)
+        self.ox = np.array([index[p[0]] for p in self.transfers], dtype=int)
+        self.red = np.array([index[p[1]] for p in self.transfers], dtype=int)
+        self.E0 = np.array([p[2] for p in self.transfers], dtype=float)
+        self.n = np.array([p[3] for p in self.transfers], dtype=float)
+        self.ks = np.array([p[4] for p in self.transfers], dtype=float)
+        self.alpha = np.array([p[5] for p in self.transfers], dtype=float)
+        self.BV = [p[6] for p in self.transfers]
+        self.K0 = self.ks*self.delta/self.Dref # Normalised standard rate constants
+        self.A = np.zeros([self.nS, nJ])
+        self.A[self.ox, np.arange(nJ)] = 1
+        self.A[self.red, np.arange(nJ)] = -1
+
+        ## Homogeneous reactions, S is the stoichiometry (products -
+        ## reactants). Each side is two species indices, the second one only
+        ## counts for second order (s = 1):
+        self.reactions = [[[p[0]] if isinstance(p[0], str) else list(p[0]),
+                           [p[1]] if isinstance(p[1], str) else list(p[1])] + list(p[2:])
+                          for p in reactions]
+        nR = len(self.reactions)
+        self.S = np.zeros([self.nS, nR])
+        sides = []
+        for r, (reactants, products, kf, kb) in enumerate(self.reactions):
+            for x in reactants:
+                self.S[index[x], r] -= 1
+            for x in products:
+                self.S[index[x], r] += 1
+            for names, k in ((reactants, kf), (products, kb)):
+                if len(names) not in (1, 2):
+                    raise ValueError("Reactions must be first or second order")
+                # Normalised rate constant, k*ttot (*cRef for second order):
+                sides.append((index[names[0]], index[names[-1]], len(names) - 1,
+                              k*ttot*self.cRef**(len(names) - 1)))
+        sides = np.array(sides, dtype=float).reshape(-1, 4)
+        self.F1, self.F2 = sides[0::2,0].astype(int), sides[0::2,1].astype(int)
+        self.B1, self.B2 = sides[1::2,0].astype(int), sides[1::2,1].astype(int)
+        self.sF, self.sB = sides[0::2,2], sides[1::2,2]
+        self.kf, self.kb = sides[0::2,3], sides[1::2,3]
+
+        ## Storage of the profiles, as E_mec
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float64, np.float32):
+            raise ValueError("dtype must be float64 or float32, not " + str(dtype))
+        kSample = getattr(wf, "kSample", None)
+        if snap is None and kSample is not None: # As E_mec
+            snap = "samples"
+        self.kSnap = snapshot_steps(wf.t, snap, kSample)
+        self.nRows = self.nT if snap is None else 2
+        self.C = np.empty([self.nRows, self.nS, self.nX], self.dtype)
+        self.C[:] = (self.c/self.cRef)[:,None]
+        if snap is None: # Profiles are the history itself
+            self.Cs = self.C
+        else:
+            self.Cs = np.zeros([np.size(self.kSnap), self.nS, self.nX], self.dtype)
+
+    def dimless(self): # Dimensionless parameters, see dimless_key
+        values = [self.d, self.c/self.cRef, self.n, self.E0*FRT, self.K0, self.alpha,
+                  self.kf, self.kb, self.S.ravel(), self.F1, self.F2, self.B1, self.B2]
+        return " ".join(" ".join("%.12g" %v for v in a) for a in values) + " " + " ".join(self.BV)
+
+# Mechanisms of make_mec, named by the last parameter, and their number of species:
+mechanisms = {"EC": 3, "CE": 3, "ECE": 4, "EC'": 4}
+
+def make_mec(wf, space, params, snap=None, dtype="float64"):
+    """
+    Returns the Multi_mec of the mechanism named by the last parameter:
+
+    "EC":   [E0, n, DO, DR, cOb, cRb, ks, alpha, kf, kb, "EC"]
+            O + ne <-> R, R <-> Z (kf, kb in s^-1), Z diffuses as R and is in
+            equilibrium with R in solution
+    "CE":   [E0, n, DO, DR, cOb, cRb, ks, alpha, kf, kb, "CE"]
+            Y <-> O (kf, kb in s^-1), O + ne <-> R, Y diffuses as O and is in
+            equilibrium with O in solution
+    "ECE":  [E0, E02, n, D, cOb, ks, alpha, kf, kb, "ECE"]
+            O + ne <-> R, R <-> O2 (kf, kb in s^-1), O2 + ne <-> R2, all with the
+            same D, ks and alpha, only O in solution
+    "EC'":  [E0, n, DO, DR, cOb, cRb, ks, alpha, kcat, cZ, "EC'"]
+            O + ne <-> R, R + Z -> O + Y (kcat in cm3 mol^-1 s^-1), Z is in
+            solution at cZ, Z and Y diffuse as O
+    """
+    kind = params[-1]
+    if kind == "ECE":
+        E0, E02, n, D, cOb, ks, alpha, kf, kb = params[:9]
+        return Multi_mec(wf, space, ["O", "R", "O2", "R2"], [D]*4, [cOb, 0, 0, 0],
+                         [["O", "R", E0, n, ks, alpha, "QR"], ["O2", "R2", E02, n, ks, alpha, "QR"]],
+                         [[["R"], ["O2"], kf, kb]], snap, dtype, kind)
+    E0, n, DO, DR, cOb, cRb, ks, alpha, k1, k2 = params[:10]
+    transfer = ["O", "R", E0, n, ks, alpha, "QR"]
+    if kind == "EC":
+        return Multi_mec(wf, space, ["O", "R", "Z"], [DO, DR, DR],
+                         [cOb, cRb, cRb*k1/k2 if k2 else 0], [transfer],
+                         [[["R"], ["Z"], k1, k2]], snap, dtype, kind)
+    if kind == "CE":
+        return Multi_mec(wf, space, ["Y", "O", "R"], [DO, DO, DR],
+                         [cOb*k2/k1 if k1 else 0, cOb, cRb], [transfer],
+                         [[["Y"], ["O"], k1, k2]], snap, dtype, kind)
+    if kind == "EC'":
+        return Multi_mec(wf, space, ["O", "R", "Z", "Y"], [DO, DR, DO, DO],
+                         [cOb, cRb, k2, 0], [transfer],
+                         [[["R", "Z"], ["O", "Y"], k1, 0]], snap, dtype, kind)
+    raise ValueError("Unknown mechanism: " + str(kind))
 
 
 
 ########## Simulation:
 
+def current_weights(space):
+    """
+    Returns the weights (w0, w1, w2) of the three point derivative at x = 0,
+    scaled by 2*dX: 2*dX*dC/dX = -(w0*C[0] + w1*C[1] + w2*C[2]).
+    """
+    if space.uniform:
+        return (3, -4, 1)
+    h0 = space.X[1] - space.X[0]
+    h1 = space.X[2] - space.X[1]
+    return (2*(2*h0 + h1)/(h0 + h1), -2*(h0 + h1)/h1, 2*h0**2/(h1*(h0 + h1)))
+
+def step_ratio(t, dT):
+    """
+    Returns the normalised time steps relative to dT, or None for equally
+    spaced time. t is read in blocks until a different step is found.
+    """
+    dt0 = t[1] - t[0]
+    last = None
+    for k0, c in iter_chunks(t):
+        dt = np.diff(c if last is None else np.concatenate([[last], c]))
+        if not np.allclose(dt, dt0):
+            t = np.asarray(t)
+            return np.concatenate([[0], np.diff(t)/t[-1]/dT])
+        last = c[-1]
+    return None
+
+def check_stability(space, r=None, kMax=0):
+    """
+    Raises ValueError if explicit finite differences are unstable on space
+    with the time step ratios r (see step_ratio) and homogeneous reactions
+    with normalised rate constants (k*ttot) up to kMax.
+    """
+    rMax = 1 if r is None else np.max(r)
+    if space.uniform:
+        lambMax = rMax*space.lamb
+    else:
+        lambMax = rMax*np.max(space.lambL + space.lambR)/2
+    if lambMax > 0.5:
+        raise ValueError("Explicit finite differences are unstable for "
+                "dT/dX^2 = %g > 0.5, use Simulate_implicit%s" %(lambMax,
+                "" if r is None else " (the CN solver for log time grids)"))
+    kdT = kMax*rMax*space.dT
+    if 2*lambMax + kdT > 1:
+        raise ValueError("Explicit finite differences are unstable for "
+                "k*dt = %g > %g, use a smaller time step or lamb" %(kdT, 1 - 2*lambMax))
+
+def check_reaction_layer(space, mec):
+    """
+    Checks that the reaction layers sqrt(D/k) of the homogeneous reactions
+    of mec (a Multi_mec) are resolved by the first distance step dX. The
+    error of catalytic currents is about 0.3*(dX/layer)^2: ValueError if a
+    layer is thinner than dX, RuntimeWarning if thinner than 5 dX (about
+    1 %). Second order rates are taken at the largest bulk concentration.
+    """
+    for r in range(mec.S.shape[1]):
+        k = mec.kf[r] + mec.kb[r] # Normalised, k*ttot (*cRef for second order)
+        if not k > 0:
+            continue
+        layer = np.sqrt(np.min(mec.d[mec.S[:,r] != 0])/k)
+        if layer >= 5*space.dX:
+            continue
+        text = ("The reaction layer of %s, %.3g um, is %.2g distance steps (%.3g um)"
+                %(" + ".join(mec.reactions[r][0]) + " -> " + " + ".join(mec.reactions[r][1]),
+                  1e4*layer*mec.delta, layer/space.dX, 1e4*space.dX*mec.delta))
+        if layer < space.dX:
+            raise ValueError(text + ", use a smaller time step (dE or dt)")
+        import warnings
+        warnings.warn(text + ", the current can be off by about %.0f %%, use a smaller "
+                      "time step (dE or dt)" %(30*(space.dX/layer)**2), RuntimeWarning)
+
+def dimless_key(eps, t, space, mec, theta=None, kSample=None, steady=None):
+    """
+    Returns a hash of the dimensionless problem solved by fd: potential
+    eps, normalised time, grid, K0, DOR, alpha, kinetics, initial
+    concentration ratio, stored time steps, sampled time steps, solver
+    (theta, None for explicit), precision and Steady_state. Runs with the
+    same key only differ in the scaling done by denorm (n*F*Ageo*D*c/delta,
+    bulk concentrations), so they share the solution. Values are rounded
+    to about 12 digits.
+    """
+    import hashlib
+
+    h = hashlib.sha256()
+    if isinstance(mec, Multi_mec):
+        desc = mec.dimless()
+    else:
+        init = "O" if not mec.cRb else "%.12g" %(mec.cOb/mec.cRb)
+        desc = "%.12g %.12g %.12g %s %s" %(mec.K0, mec.DOR, mec.alpha, mec.BV, init)
+    h.update(("%s %s %.12g %d %s" %(type(space).__name__, theta, space.lamb,
+              space.nX, desc)).encode())
+    if mec.dtype != np.float64: # Keys of float64 runs are unchanged
+        h.update(str(mec.dtype).encode())
+    if steady is not None: # Held after the stop, not shared with full runs
+        h.update(("steady " + steady.describe()).encode())
+    for a in (np.round(space.X, 12), mec.kSnap, [] if kSample is None else kSample):
+        h.update((np.asarray(a, dtype=float) + 0.0).tobytes()) # -0.0 as 0.0
+    for k0, c in iter_chunks(eps):
+        h.update((np.round(c, 9) + 0.0).tobytes())
+    for k0, c in iter_chunks(t):
+        h.update((np.round(c/t[-1], 12) + 0.0).tobytes())
+    return h.hexdigest()
+
+class Progress:
+    """
+
+    Throttled progress reporting and cancellation for Simulate.fd.
+
+    Parameters
+    ----------
+    callback:   function called as callback(k, nT, elapsed, eta), with the
+                number of time steps done, the total, and the elapsed and
+                estimated remaining wall time in s. Returning True aborts
+                the run.
+    interval:   s, minimum wall time between calls (0.1)
+    every:      number of time steps between checks of the clock (100)
+
+    Examples
+    --------
+    >>> def report(k, nT, elapsed, eta):
+    ...     print("%d/%d, %.0f s left" %(k, nT, eta))
+    >>> sim.fd(sp.Progress(report, interval=1))
+    """
+
+    def __init__(self, callback, interval=0.1, every=100):
+        self.callback = callback
+        self.interval = interval
+        self.every = every
+
+    def start(self, nT):
+        self.nT = nT
+        self.t0 = time.perf_counter()
+        self.tLast = self.t0 - self.interval
+
+    def update(self, k, force=False): # Returns True to abort
+        t = time.perf_counter()
+        if t - self.tLast < self.interval and not force:
+            return False
+        self.tLast = t
+        elapsed = t - self.t0
+        eta = elapsed*(self.nT - k)/k if k else float("inf")
+        return bool(self.callback(k, self.nT, elapsed, eta))
+
+def as_progress(progress):
+    """
+    Returns a Progress for the progress argument of fd: None/False, a
+    Progress, a callback function, or a progress bar with setValue(percent).
+    """
+    if not progress or isinstance(progress, Progress):
+        return progress or None
+    if hasattr(progress, "setValue"): # e.g. QProgressBar
+        return Progress(lambda k, nT, elapsed, eta: progress.setValue(int(100*k/nT)))
+    return Progress(progress)
+
+class Timings:
+    """
+
+    Wall time and number of calls of the phases of a run, and optionally a
+    Chrome trace of them (chrome://tracing or https://ui.perfetto.dev).
+    Each phase only counts its own time, not the one of nested phases.
+
+    Phases of Simulate.fd: fd, advance (the time loop and the current, with
+    the numba backend also bc and interior, which run in one compiled
+    call), bc, interior (rest of step), snapshot, sink and denorm. Other
+    phases (plot, export) are timed with phase(name).
+
+    Parameters
+    ----------
+    trace:  keep the trace events. bc and interior run once per time step
+            and are only accumulated.
+
+    Examples
+    --------
+    >>> sim.timings = sp.Timings(trace=True)
+    >>> sim.fd()
+    >>> print(sim.timings.summary())
+    >>> sim.timings.save_trace("run_trace.json")
+
+    Without a Timings (sim.timings = None, default) fd is not instrumented.
+    """
+
+    def __init__(self, trace=False):
+        self.phases = {} # name: [s, calls]
+        self.events = [] if trace else None
+        self.stacks = {} # Open phases of each thread
+        self.wrapped = []
+        self.origin = time.perf_counter()
+
+    def begin(self, name):
+        stack = self.stacks.setdefault(threading.get_ident(), [])
+        stack.append([name, time.perf_counter(), 0.0])
+
+    def end(self, trace=True):
+        tid = threading.get_ident()
+        stack = self.stacks[tid]
+        name, t0, nested = stack.pop()
+        dt = time.perf_counter() - t0
+        phase = self.phases.setdefault(name, [0.0, 0])
+        phase[0] += dt - nested
+        phase[1] += 1
+        if stack:
+            stack[-1][2] += dt
+        if trace and self.events is not None:
+            self.events.append(dict(name=name, ph="X", pid=os.getpid(), tid=tid,
+                                    ts=1e6*(t0 - self.origin), dur=1e6*dt))
+
+    def phase(self, name, trace=True):
+        """
+        Returns a context manager that times its block as phase name.
+        """
+        import contextlib
+
+        @contextlib.contextmanager
+        def timed():
+            self.begin(name)
+            try:
+                yield
+            finally:
+                self.end(trace)
+        return timed()
+
+    def wrap(self, obj, attr, name, trace=True):
+        """
+        Times the method attr of obj as phase name until unwrap.
+        """
+        fun = getattr(obj, attr)
+        def timed(*args, **kwargs):
+            self.begin(name)
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                self.end(trace)
+        setattr(obj, attr, timed)
+        self.wrapped.append((obj, attr))
+
+    def unwrap(self):
+        while self.wrapped:
+            delattr(*self.wrapped.pop())
+
+    def total(self):
+        return sum(t for t, calls in self.phases.values())
+
+    def summary(self):
+        """
+        Returns the phases sorted by time, e.g. "1.23 s: interior 61 %,
+        bc 30 % ...".
+        """
+        total = self.total()
+        phases = sorted(self.phases.items(), key=lambda p: -p[1][0])
+        return "%.3g s: " %total + ", ".join("%s %.0f %%" %(name, 100*t/max(total, 1e-12))
+                                            for name, (t, calls) in phases)
+
+    def table(self):
+        """
+        Returns a text table with the time, share and calls of each phase.
+        """
+        total = self.total()
+        lines = ["%-10s %10s %6s %10s" %("phase", "s", "%", "calls")]
+        for name, (t, calls) in sorted(self.phases.items(), key=lambda p: -p[1][0]):
+            lines.append("%-10s %10.4f %6.1f %10d" %(name, t, 100*t/max(total, 1e-12), calls))
+        return "\n".join(lines)
+
+    def save_trace(self, fileName):
+        """
+        Saves the trace events in the Chrome trace JSON format, with the
+        totals of each phase in its metadata.
+        """
+        import json
+        with open(fileName, "w") as f:
+            json.dump(dict(traceEvents=self.events or [], displayTimeUnit="ms",
+                           otherData=dict((name, dict(s=t, calls=calls)) for name, (t, calls)
+                                          in self.phases.items())), f)
+
+class Steady_state:
+    """
+
+    Stops Simulate.fd once the current and the concentrations at the
+    electrode no longer change, e.g. chronoamperometry limited by the
+    kinetics or by a catalytic reaction. The remaining time steps hold the
+    last current and concentration profile, and sim.kSteady and
+    sim.tSteady give the time step and time (s) of the stop (None if fd
+    ran to the end).
+
+    The change over the window is extrapolated linearly over the time
+    left, and fd only stops if that stays within tol. The held values are
+    then within about tol of a full run as long as the drift slows down
+    (approach to a steady state), this is not checked. Very small currents
+    (slow kinetics) also carry rounding noise, about 1e-4 of the current,
+    that no tol below it can remove.
+
+    Parameters
+    ----------
+    tol:        allowed change until the end of the run, relative to the
+                current and absolute for the normalised concentrations at
+                x = 0
+    window:     fraction of the total time over which the drift is measured
+    every:      number of time steps between checks (100)
+
+    Only the time steps after the last change of the potential can be
+    held. Sampled waveforms (DPV, SWV) are not supported.
+
+    Examples
+    --------
+    >>> sim.steady = sp.Steady_state(tol=1e-5)
+    >>> sim.fd()
+    >>> sim.tSteady
+    """
+
+    def __init__(self, tol=1e-4, window=0.05, every=100):
+        self.tol = tol
+        self.window = window
+        self.every = every
+
+    def start(self, sim):
+        from collections import deque
+
+        if sim.kSample is not None:
+            raise ValueError("Steady state detection needs the potential of every "
+                             "time step, not a sampled waveform (DPV, SWV)")
+        # First time step of the final, constant potential (read by blocks):
+        E = sim.wf.E
+        self.kHeld = 0
+        last = E[len(E)-1]
+        for k0, c in iter_chunks(E):
+            changes = np.flatnonzero(c != last)
+            if np.size(changes):
+                self.kHeld = k0 + changes[-1] + 1
+        self.tEnd = float(sim.wf.t[len(sim.wf.t)-1])
+        self.span = self.window*self.tEnd
+        self.history = deque() # (t, I, concentrations at x = 0)
+
+    def update(self, sim, k): # True once time steps up to k-1 are stationary
+        t = float(sim.wf.t[k-1])
+        I = float(sim.Ik[k-1-sim.kOff])
+        C0 = sim.surface((k-1)%sim.mec.nRows)
+        self.history.append((t, I, C0))
+        if k-1 < self.kHeld:
+            return False
+        while len(self.history) > 1 and self.history[1][0] <= t - self.span:
+            self.history.popleft()
+        if self.history[0][0] > t - self.span: # The window is not covered yet
+            return False
+        tol = self.tol/max(1.0, (self.tEnd - t)/self.span) # Drift until the end
+        return all(abs(Ih - I) <= tol*abs(I) and np.max(np.abs(Ch - C0)) <= tol
+                   for th, Ih, Ch in self.history)
+
+    def describe(self): # Text hashed by dimless_key and run_key
+        return "%.12g %.12g %d" %(self.tol, self.window, self.every)
+
+numba_work = 1e8 # nT*(nX + 1000) above which backend="auto" uses the compiled kernels
+
+def explicit_backend(backend, nT, nX):
+    """
+    Returns the backend of an explicit run of nT time steps and nX nodes,
+    "numba" or "numpy". "auto" only imports sp_kernels (Numba and the
+    compiled kernel, about 1 s) for runs of more than numba_work
+    node-steps, each time step counting as 1000 nodes for the overhead of
+    a NumPy step, which take about as long with NumPy.
+    """
+    if backend not in ("auto", "numba", "numpy"):
+        raise ValueError("Unknown backend: " + str(backend))
+    if backend == "numpy" or backend == "auto" and nT*(nX + 1000.0) < numba_work:
+        return "numpy"
+    import sp_kernels
+    return sp_kernels.select_backend(backend)
+
 class Simulate:
 
-    def __init__(self, wf, space, mec, Ageo=1):
+    explicit = True # Stable only for dT/dX^2 <= 0.5
+
+    def __init__(self, wf, space, mec, Ageo=1, backend="auto", verbose=True):
         self.wf = wf
         self.space = space
         self.mec = mec
         self.Ageo = Ageo
-        self.eps = (wf.E-mec.E0)*mec.n*FRT # adimensional potential waveform
+        self.attach(mec)
+        # The adimensional potential (eps) is calculated by fd for each
+        # block of time steps, eps[k-kOff] is step k. Waveforms with kSample
+        # (Pulse, Square_wave) only keep the current at those time steps:
+        self.kSample = getattr(wf, "kSample", None)
+        self.kOff = 0
+        self.eps = None
+        if self.kSample is None:
+            self.I = np.zeros(space.nT) # normalised current, filled in by fd
+        else:
+            self.I = np.zeros(np.size(self.kSample))
+        self.w = current_weights(space)
+        self.r = step_ratio(wf.t, space.dT)
+        if self.explicit:
+            check_stability(space, self.r, self.rate_max())
+        # The stencil is evaluated in the precision of the profiles, the
+        # current (I) is always accumulated in float64:
+        self.dtype = mec.dtype
+        self.lamb = self.dtype.type(mec.lamb)
+        if not space.uniform:
+            self.lambL = space.lambL.astype(self.dtype)
+            self.lambR = space.lambR.astype(self.dtype)
+        if self.r is not None and self.dtype != np.float64:
+            self.r = self.r.astype(self.dtype)
+        # Compiled kernels (sp_kernels) are only available for the explicit solver:
+        self.backend = explicit_backend(backend, space.nT, space.nX) if self.explicit else "numpy"
+        self._cR = None
+        self._cO = None
+        self.sink = None
+        self.timings = None # Timings of fd, not measured by default
+        self.steady = None # Steady_state that stops fd early, runs all the time steps by default
+        self.kSteady = None
+        self.tSteady = None
+        if verbose:
+            print('Simulate ' + self.BV)
+
+    def attach(self, mec): # Working rows of mec and the name printed
         self.CO = mec.CO
         self.CR = mec.CR
         self.BV = mec.BV
-        print('Simulate ' + self.BV)
+
+    def rate_max(self): # Fastest homogeneous reaction, for check_stability
+        return 0
 
     ## Set boundary conditions:
     def bc(self, CR1kb, CO1kb, eps):
@@ -234,54 +1238,2193 @@ class Simulate:
 
         return CR, CO
 
-    def fd(self, progressBar=False): # Finite Differences
-        for k in range(1,self.space.nT):
-
-            if progressBar: # Active only when using GUI, updates progress bar
-                progressBar.setValue(int(100*k/self.space.nT))
-
-            # Boundary condition, Butler-Volmer:
-            self.CR[k,0], self.CO[k,0] = self.bc(self.CR[k-1,1], self.CO[k-1,1], self.eps[k])
-            # Apply finite-differenc
-            self.CR[k,1:-1] = self.CR[k-1,1:-1] + self.mec.lamb*(self.CR[k-1,2:]\
-                            - 2*self.CR[k-1,1:-1] + self.CR[k-1,:-2])
-            self.CO[k,1:-1] = self.CO[k-1,1:-1] + self.mec.lamb*(self.CO[k-1, 2:]\
-                            - 2*self.CO[k-1, 1:-1] + self.CO[k-1,:-2])
-
-            self.denorm()
+    def fd(self, progress=None, sink=None): # Finite Differences
+        """
+        Runs the simulation. progress is reported through a Progress, a
+        callback(k, nT, elapsed, eta) or a progress bar (see as_progress),
+        the run stops early if it returns True and self.aborted is set.
+        With a Profile_sink the stored profiles are written to its file
+        instead of memory, and cR and cO are read from it. With
+        self.timings set the phases are timed, see Timings.
+        """
+        timings = self.timings
+        if timings is None:
+            return self.march(progress, sink)
+        # Timed copies of the phases, only for this run:
+        timings.wrap(self, "bc", "bc", trace=False)
+        timings.wrap(self, "step", "interior", trace=False)
+        timings.wrap(self, "advance", "advance")
+        timings.wrap(self, "snapshot", "snapshot")
+        timings.wrap(self, "denorm", "denorm")
+        if sink is not None:
+            timings.wrap(sink, "write", "sink")
+            timings.wrap(sink, "close", "sink")
+        timings.begin("fd")
+        try:
+            self.march(progress, sink)
+        finally:
+            timings.end()
+            timings.unwrap()
+
+    def march(self, progress=None, sink=None): # Time loop of fd
+        progress = as_progress(progress)
+        if sink is not None and self.full_history():
+            raise ValueError("Streaming the profiles needs a snapshot schedule, e.g. snap=1")
+        self.sink = sink
+        I0 = self.current(0)
+        kSample = self.kSample
+        block = 2**14 # Time steps of eps (and the sampled current) at once
+        if kSample is None:
+            self.I[0] = I0
+        else: # Sampled current, see __init__
+            self.Ik = np.zeros(block)
+            self.I[:] = 0
+            if kSample[0] == 0:
+                self.I[0] = I0
+
+        # Rows k-1 and k are k-1 % nRows and k % nRows, for the full history
+        # this is just k-1 and k:
+        nT = self.space.nT
+        nRows = self.mec.nRows
+        kSnap = self.mec.kSnap
+        nSnap = np.size(kSnap)
+        if sink is not None:
+            sink.open(self)
+        if self.full_history(): # Nothing to copy
+            j = nSnap
+        else:
+            j = 0
+            if kSnap[0] == 0:
+                self.snapshot(0, 0)
+                j = 1
+        kNext = kSnap[j] if j < nSnap else -1
+
+        # Time steps are run in blocks up to the next stored profile,
+        # progress or steady state check:
+        if progress:
+            progress.start(nT)
+        steady = self.steady
+        if steady is not None:
+            steady.start(self)
+        self.aborted = False
+        self.kSteady = None
+        self.tSteady = None
+        k = 1
+        while k < nT:
+            kEnd = nT if kNext < 0 else kNext + 1
+            if progress:
+                kEnd = min(kEnd, k + progress.every)
+            if steady is not None:
+                kEnd = min(kEnd, k + steady.every)
+            kEnd = min(kEnd, k + block)
+            self.kOff = k
+            self.eps = self.potential(self.wf.E[k:kEnd])
+            if kSample is None: # Current of the time steps being calculated
+                self.Ik = self.I[k:kEnd]
+            self.advance(k, kEnd)
+            if kSample is not None: # Keep the samples of this block
+                s0, s1 = np.searchsorted(kSample, [k, kEnd])
+                self.I[s0:s1] = self.Ik[kSample[s0:s1] - k]
+            k = kEnd
+
+            if k-1 == kNext: # Store the profile
+                self.snapshot(j, (k-1)%nRows)
+                j += 1
+                kNext = kSnap[j] if j < nSnap else -1
+
+            if steady is not None and k < nT and steady.update(self, k):
+                self.kSteady = k-1
+                self.tSteady = float(self.wf.t[k-1])
+                self.hold(k, j)
+                k = nT
+                if progress:
+                    progress.update(k, force=True)
+                break
+
+            if progress and progress.update(k, force=(k == nT)):
+                self.aborted = k < nT
+                break
+
+        self.nDone = k # Time steps calculated (or held), nT unless aborted
+        self.denorm()
+        if sink is not None:
+            sink.close(self)
+            self._cR = sink.cR
+            self._cO = sink.cO
+
+    def potential(self, E): # Normalised potential of the time steps at E
+        return (E - self.mec.E0)*self.mec.n*FRT
+
+    def current(self, b): # Normalised current of working row b
+        # The current is calculated from the species present in solution:
+        if self.mec.cRb:
+            C, sgn = self.CR, -1
+        else: # In case only O present in solution
+            C, sgn = self.CO, 1
+        w0, w1, w2 = self.w
+        return sgn*(w2*C[b,2] + w1*C[b,1] + w0*C[b,0])
+
+    def full_history(self): # True if the working rows are the stored profiles
+        return self.CR is self.mec.CRs
+
+    def surface(self, b): # Normalised concentrations at x = 0 of working row b
+        return np.array([self.CR[b,0], self.CO[b,0]], dtype=float)
+
+    def working(self): # Working rows of all the species
+        return self.CR, self.CO
+
+    def hold(self, k, j): # Time steps k.. and profiles j.. keep time step k-1 (Steady_state)
+        b = (k-1)%self.mec.nRows
+        self.I[k:] = self.I[k-1]
+        if self.full_history():
+            for C in self.working():
+                C[k:] = C[k-1]
+            return
+        for jj in range(j, np.size(self.mec.kSnap)):
+            self.snapshot(jj, b)
+
+    def advance(self, k0, k1): # Time steps k0 <= k < k1
+        if self.mec.cRb:
+            C, sgn = self.CR, -1
+        else: # In case only O present in solution
+            C, sgn = self.CO, 1
+        w0, w1, w2 = self.w
+        nRows = self.mec.nRows
+
+        if self.backend == "numba":
+            import sp_kernels
+            space = self.space
+            uniform = space.uniform
+            sp_kernels.explicit_block(self.CR, self.CO, self.Ik, self.eps, self.kOff, k0, k1, nRows,
+                    uniform, self.lamb,
+                    np.zeros(0, self.dtype) if uniform else self.lambL,
+                    np.zeros(0, self.dtype) if uniform else self.lambR,
+                    np.zeros(0, self.dtype) if self.r is None else self.r,
+                    sp_kernels.kinetics.get(self.BV, 2), float(self.mec.dX), float(self.mec.K0),
+                    float(self.mec.alpha), float(self.mec.DOR), float(w0), float(w1), float(w2),
+                    float(sgn), C is self.CR)
+            return
+
+        for k in range(k0, k1):
+            a = (k-1)%nRows
+            b = k%nRows
+
+            self.step(a, b, k)
+
+            # Normalised current from the three nodes closest to the electrode,
+            # calculated as soon as the time step is finished:
+            self.Ik[k-self.kOff] = sgn*(w2*C[b,2] + w1*C[b,1] + w0*C[b,0])
+
+    def step(self, a, b, k): # Explicit time step from row a to row b
+        # Boundary condition, Butler-Volmer:
+        self.CR[b,0], self.CO[b,0] = self.bc(self.CR[a,1], self.CO[a,1], self.eps[k-self.kOff])
+        # Apply finite-differenc
+        if self.space.uniform:
+            lamb = self.lamb if self.r is None else self.lamb*self.r[k]
+            self.CR[b,1:-1] = self.CR[a,1:-1] + lamb*(self.CR[a,2:]\
+                            - 2*self.CR[a,1:-1] + self.CR[a,:-2])
+            self.CO[b,1:-1] = self.CO[a,1:-1] + lamb*(self.CO[a, 2:]\
+                            - 2*self.CO[a, 1:-1] + self.CO[a,:-2])
+        else: # Expanding grid
+            lambL = self.lambL
+            lambR = self.lambR
+            if self.r is not None:
+                lambL = lambL*self.r[k]
+                lambR = lambR*self.r[k]
+            self.CR[b,1:-1] = self.CR[a,1:-1] + lambL*(self.CR[a,:-2] - self.CR[a,1:-1])\
+                            + lambR*(self.CR[a,2:] - self.CR[a,1:-1])
+            self.CO[b,1:-1] = self.CO[a,1:-1] + lambL*(self.CO[a,:-2] - self.CO[a,1:-1])\
+                            + lambR*(self.CO[a,2:] - self.CO[a,1:-1])
+
+    def snapshot(self, j, b): # Copies working row b to stored profile j
+        if self.sink is not None: # CRs and COs are left untouched
+            self.sink.write(j, *self.concentrations(self.CR[b], self.CO[b]))
+            return
+        self.mec.CRs[j] = self.CR[b]
+        self.mec.COs[j] = self.CO[b]
+
+    def profile(self, n):
+        """
+        Returns the index in cR and cO of the last stored profile at or
+        before time index n (negative n counts from the end as usual). For
+        sampled waveforms n is the index of the sample.
+        """
+        if self.kSample is not None:
+            n = self.kSample[n]
+        n = min(n%self.space.nT if n < 0 else n, self.space.nT-1)
+        return max(np.searchsorted(self.mec.kSnap, n, side="right") - 1, 0)
+
+    def dimless_key(self): # See dimless_key
+        eps = Lazy_array(lambda k: self.potential(self.wf.E[k]), self.space.nT) # Only a block is kept
+        return dimless_key(eps, self.wf.t, self.space, self.mec,
+                           getattr(self, "theta", None), self.kSample, self.steady)
+
+    def solution(self):
+        """
+        Returns the dimensionless solution of fd (normalised current and
+        stored profiles), that rescale applies to runs with the same
+        dimless_key.
+        """
+        return dict(I=self.I, CRs=self.mec.CRs, COs=self.mec.COs, nDone=self.nDone,
+                    kSteady=self.kSteady, tSteady=self.tSteady)
+
+    def rescale(self, solution):
+        """
+        Takes the solution of another run with the same dimless_key instead
+        of running fd, only denorm is done. The arrays are shared, not copied.
+        """
+        self.I = solution["I"]
+        self.mec.CRs = solution["CRs"]
+        self.mec.COs = solution["COs"]
+        # The working rows are not needed (this also frees a full history):
+        self.CR = self.mec.CR = self.mec.CRs
+        self.CO = self.mec.CO = self.mec.COs
+        self.nDone = solution["nDone"]
+        self.kSteady = solution["kSteady"]
+        self.tSteady = solution["tSteady"]
+        self.aborted = False
+        self.sink = None
+        self.denorm()
+
+    def denorm(self): # Denormalisation
+        """
+        Scales the normalised current to i and sets t, E and x (at kSample
+        for sampled waveforms). Only O(nT) work is done here, cR and cO are
+        scaled the first time they are read.
+        """
+        i = self.scale_current(self.I)
+        x = self.space.X*self.mec.delta
 
-    def denorm(self): # Denormalisation, I believe this can be optimised
+        if self.kSample is None:
+            self.E = self.wf.E
+            self.t = self.wf.t
+        else:
+            self.E = self.wf.E[self.kSample]
+            self.t = self.wf.t[self.kSample]
+        self.i = i
+        self.x = x
+        self.tSnap = self.wf.t[self.mec.kSnap] # s, times of cR and cO rows
+        # Discard previously scaled concentrations:
+        self._cR = None
+        self._cO = None
 
+    def scale_current(self, I): # A, for the normalised current I
         if self.mec.cRb:
-            I = -self.CR[:,2] + 4*self.CR[:,1] - 3*self.CR[:,0]
             D = self.mec.DR
             c = self.mec.cRb
-            cR = self.CR*self.mec.cRb
-            if self.mec.cOb:
-                cO = self.CO*self.mec.cOb
-            else: # In case only R present in solution
-                cO = (1-self.CR)*self.mec.cRb
         else: # In case only O present in solution
-            I = self.CO[:,2] - 4*self.CO[:,1] + 3*self.CO[:,0]
             D = self.mec.DO
             c = self.mec.cOb
-            cO = self.CO*self.mec.cOb
-            cR = (1-self.CO)*self.mec.cOb
-        i = self.mec.n*F*self.Ageo*D*c*I/(2*self.space.dX*self.mec.delta)
-        x = self.space.X*self.mec.delta
+        return self.mec.n*F*self.Ageo*D*c*I/(2*self.space.dX*self.mec.delta)
+
+    def concentrations(self, CR, CO):
+        """
+        Returns cR and cO in mol cm^-3 for normalised profiles CR and CO.
+        """
+        mec = self.mec
+        if mec.cRb:
+            cR = CR*mec.cRb
+            if mec.cOb:
+                cO = CO*mec.cOb
+            else: # In case only R present in solution
+                cO = (1-CR)*mec.cRb
+        else: # In case only O present in solution
+            cR = (1-CO)*mec.cOb
+            cO = CO*mec.cOb
+        return cR, cO
+
+    @property
+    def cR(self): # mol cm^-3, stored profiles scaled only when needed
+        if self._cR is None:
+            self._cR, self._cO = self.concentrations(self.mec.CRs, self.mec.COs)
+        return self._cR
+
+    @property
+    def cO(self): # mol cm^-3, stored profiles scaled only when needed
+        if self._cO is None:
+            self._cR, self._cO = self.concentrations(self.mec.CRs, self.mec.COs)
+        return self._cO
+
+    def reference(self, snap="last"):
+        """
+        Returns a new float64 simulation of the same problem, not run yet,
+        storing the profiles at snap.
+        """
+        mec = self.mec
+        params = [mec.E0, mec.n, mec.DO, mec.DR, mec.cOb, mec.cRb, mec.ks, mec.alpha, mec.BV]
+        refMec = E_mec(self.wf, self.space, params, snap)
+        if self.explicit:
+            return Simulate(self.wf, self.space, refMec, self.Ageo, self.backend)
+        return type(self)(self.wf, self.space, refMec, self.Ageo, self.theta)
+
+    def deviation(self, reference=None):
+        """
+        Returns the largest deviations of this run from a float64 run of
+        the same problem, for float32 runs: i relative to the largest |i|
+        or, if larger, the diffusion-limited current scale n*F*A*D*c/delta
+        (runs with almost no current are not divided by their noise), and
+        the last stored profiles of cR and cO relative to the largest
+        bulk concentration. reference is the finished float64 run, run
+        here (storing only the last profile) if None.
+        """
+        if reference is None:
+            reference = self.reference()
+            reference.fd()
+        n = min(self.nDone, reference.nDone)
+        if self.kSample is not None:
+            n = np.searchsorted(self.kSample, n)
+        iMax = max(np.max(np.abs(reference.i[:n])), abs(reference.scale_current(2*self.space.dX)))
+        mec = self.mec
+        c = mec.cRef if isinstance(mec, Multi_mec) else max(mec.cOb, mec.cRb)
+        return dict(i=float(np.max(np.abs(self.i[:n] - reference.i[:n]))/iMax),
+                    cR=float(np.max(np.abs(self.cR[-1] - reference.cR[-1]))/c),
+                    cO=float(np.max(np.abs(self.cO[-1] - reference.cO[-1]))/c))
+
+
+class Tridiag:
+    """
 
-        self.E = self.wf.E
-        self.t = self.wf.t
-        self.i = i
-        self.cR = cR
-        self.cO = cO
-        self.x = x
+    LU factorisation of a tridiagonal matrix, solves A x = b in O(n).
+    Uses LAPACK (gttrf/gttrs) when scipy is available and the Thomas
+    algorithm otherwise.
+
+    Parameters
+    ----------
+    dl:     sub-diagonal, size n-1
+    d:      diagonal, size n
+    du:     super-diagonal, size n-1
+
+    Examples
+    --------
+    >>> A = Tridiag(-np.ones(n-1), 3*np.ones(n), -np.ones(n-1))
+    >>> x = A.solve(b) # b is n or n x m
+    """
+
+    def __init__(self, dl, d, du):
+        try: # LAPACK tridiagonal solver, optional
+            from scipy.linalg.lapack import dgttrf, dgttrs
+            self.lu = dgttrf(dl, d, du)[:5]
+            self.gttrs = dgttrs
+        except ImportError: # Falls back to the Thomas algorithm
+            self.gttrs = None # Thomas algorithm, no pivoting (diagonally dominant matrices)
+            n = np.size(d)
+            self.l = np.zeros(n)
+            self.m = np.array(d, dtype=float)
+            self.du = np.asarray(du, dtype=float)
+            for i in range(1, n):
+                self.l[i] = dl[i-1]/self.m[i-1]
+                self.m[i] -= self.l[i]*du[i-1]
+
+    def solve(self, b):
+        if self.gttrs is not None:
+            x, info = self.gttrs(*self.lu, b.reshape(np.shape(b)[0], -1), overwrite_b=1)
+            return x.reshape(np.shape(b))
+        x = np.array(b, dtype=float)
+        n = np.shape(x)[0]
+        for i in range(1, n): # Forward substitution
+            x[i] -= self.l[i]*x[i-1]
+        x[-1] /= self.m[-1]
+        for i in range(n-2, -1, -1): # Back substitution
+            x[i] = (x[i] - self.du[i]*x[i+1])/self.m[i]
+        return x
+
+
+
+class Simulate_implicit(Simulate):
+    """
+
+    Theta-method finite differences, unconditionally stable for any lamb.
+    Each time step solves a tridiagonal system for the interior nodes of
+    both species, the Butler-Volmer boundary (Simulate.bc) is folded into
+    the first row by superposition, C[1:-1] = U + C[0]*v.
+
+    Parameters
+    ----------
+    wf:     waveform object
+    space:  spacing object
+    mec:    mechanism object
+    Ageo:   cm2, geometrical area
+    theta:  1 for fully implicit, 0.5 for Crank-Nicolson
+    verbose: if False, the mechanism is not printed
+
+    Examples
+    --------
+    >>> space = sp.Equal_spc(wf, lamb=5)
+    >>> sim = sp.Simulate_implicit(wf, space, mec, theta=1)
+    >>> sim.fd()
+    """
+
+    explicit = False
+
+    def __init__(self, wf, space, mec, Ageo=1, theta=0.5, verbose=True):
+        super(Simulate_implicit, self).__init__(wf, space, mec, Ageo, verbose=verbose)
+        self.theta = theta
+
+        # dT/dX^2 towards the electrode and towards bulk:
+        M = space.nX - 2
+        if space.uniform:
+            self.lambL = np.ones(M)*mec.lamb
+            self.lambR = np.ones(M)*mec.lamb
+        else:
+            self.lambL = space.lambL
+            self.lambR = space.lambR
+
+        self.factor(1)
+        self.rhs = np.zeros([M,2], order="F") # Columns for R and O
+
+    def factor(self, rk): # LU factorisation for a time step of rk*dT
+        self.rk = rk
+        tL = self.theta*rk*self.lambL
+        tR = self.theta*rk*self.lambR
+        # Implicit part of the interior nodes, the last node is kept at bulk:
+        self.A = Tridiag(-tL[1:], 1 + tL + tR, -tR[:-1])
+        # Response of the interior nodes to a unit concentration at x = 0:
+        e1 = np.zeros([np.size(tL),1])
+        e1[0] = tL[0]
+        self.v = self.A.solve(e1)[:,0]
+
+    def step(self, a, b, k): # Theta-method time step from row a to row b
+        CR = self.CR
+        CO = self.CO
+        theta = self.theta
+        if self.r is not None and self.r[k] != self.rk: # New time step
+            self.factor(self.r[k])
+        lambL = self.rk*self.lambL
+        lambR = self.rk*self.lambR
+
+        # Right hand side, explicit part and bulk node:
+        D = self.rhs
+        D[:,0] = CR[a,1:-1]
+        D[:,1] = CO[a,1:-1]
+        if theta < 1:
+            D[:,0] += (1-theta)*(lambL*(CR[a,:-2] - CR[a,1:-1]) + lambR*(CR[a,2:] - CR[a,1:-1]))
+            D[:,1] += (1-theta)*(lambL*(CO[a,:-2] - CO[a,1:-1]) + lambR*(CO[a,2:] - CO[a,1:-1]))
+        D[-1,0] += theta*lambR[-1]*CR[a,-1]
+        D[-1,1] += theta*lambR[-1]*CO[a,-1]
+        U = self.A.solve(D)
+
+        # Butler-Volmer is linear in the concentrations at node 1,
+        # [CR0, CO0] = P [CR1, CO1]:
+        pRR, pOR = self.bc(1, 0, self.eps[k-self.kOff])
+        pRO, pOO = self.bc(0, 1, self.eps[k-self.kOff])
+        # Node 1 with C1 = U1 + C0*v1:
+        v1 = self.v[0]
+        a11 = 1 - v1*pRR
+        a12 = -v1*pRO
+        a21 = -v1*pOR
+        a22 = 1 - v1*pOO
+        det = a11*a22 - a12*a21
+        CR1 = (a22*U[0,0] - a12*U[0,1])/det
+        CO1 = (a11*U[0,1] - a21*U[0,0])/det
+        CR[b,0] = pRR*CR1 + pRO*CO1
+        CO[b,0] = pOR*CR1 + pOO*CO1
+
+        CR[b,1:-1] = U[:,0] + CR[b,0]*self.v
+        CO[b,1:-1] = U[:,1] + CO[b,0]*self.v
+
+
+class Simulate_multi(Simulate):
+    """
+
+    Explicit finite differences for a Multi_mec. Each time step updates all
+    the species at once on the stacked array: homogeneous reactions,
+    diffusion with the diffusion ratio of each species and the Butler-Volmer
+    boundary of all the electron transfers (a small linear system for the
+    concentrations at x = 0). The number of NumPy operations per time step
+    does not grow with the number of species or reactions.
+
+    Parameters
+    ----------
+    wf:     waveform object
+    space:  spacing object
+    mec:    Multi_mec
+    Ageo:   cm2, geometrical area
+
+    After fd, t, E, i, x and tSnap are as in Simulate, cR and cO are the red
+    and ox species of the first electron transfer and concentration(name)
+    returns the profiles of any species.
+
+    Examples
+    --------
+    >>> mec = sp.make_mec(wf, space, [0, 1, 1e-5, 1e-5, 1e-6, 0, 1e8, 0.5, 1e7, 1e-5, "EC'"])
+    >>> sim = sp.Simulate_multi(wf, space, mec)
+    >>> sim.fd()
+    >>> cZ = sim.concentration("Z")
+    """
+
+    def __init__(self, wf, space, mec, Ageo=1):
+        # Waveform, current, time steps, precision and options as in
+        # Simulate, eps is F*E/RT here. No compiled kernel:
+        super(Simulate_multi, self).__init__(wf, space, mec, Ageo, backend="numpy")
+        check_reaction_layer(space, mec)
+
+        # Diffusion, (species x 1) or (species x interior nodes), the
+        # stencil of Simulate scaled by the normalised D of each species:
+        d = mec.d[:,None].astype(self.dtype)
+        if space.uniform:
+            self.lamb = d*self.lamb
+        else:
+            self.lambL = d*self.lambL
+            self.lambR = d*self.lambR
+        self.dT = self.dtype.type(space.dT)
+
+        # Reactions, rates = kf*C[F1]*(sF*C[F2] + 1-sF) - kb*C[B1]*(sB*C[B2] + 1-sB),
+        # the four operands are gathered at once:
+        self.S = mec.S.astype(self.dtype)
+        self.gather = np.concatenate([mec.F1, mec.F2, mec.B1, mec.B2])
+        self.kf, self.kb, self.sF, self.sB = (a[:,None].astype(self.dtype)
+                                              for a in (mec.kf, mec.kb, mec.sF, mec.sB))
+        self.second = bool(np.any(mec.sF) or np.any(mec.sB))
+
+        # Boundary, see bc:
+        self.e0 = mec.E0*FRT
+        self.redOn = np.array([bv != "RO" for bv in mec.BV], dtype=float)
+        self.oxOn = np.array([bv != "OR" for bv in mec.BV], dtype=float)
+        # Current, electrons of each transfer from the species fluxes
+        # (A^T g = n). Species without homogeneous reactions are preferred
+        # (weighted least norm), their profiles are smooth at the electrode:
+        W = np.where(np.any(mec.S != 0, axis=1), 1e-3, 1)[:,None]*mec.A
+        self.h = W @ np.linalg.solve(mec.A.T @ W, mec.n)*mec.d
+
+    def attach(self, mec):
+        self.C = mec.C
+        self.BV = mec.name
+
+    def rate_max(self):
+        return np.max(self.mec.kf + self.mec.kb, initial=0)
+
+    def potential(self, E): # F*E/RT, each transfer uses its own n and E0
+        return E*FRT
+
+    def bc(self, eps):
+        """
+        Returns the boundary operators of the time steps at potentials eps
+        (steps x species x species), the concentrations at x = 0 are
+        B[k] @ C1 for the concentrations C1 at node 1. The flux of each
+        species (two point) is the net reduction rate of the transfers it
+        takes part in, diag(d)*C0 + dX*A*G*C0 = diag(d)*C1 with the
+        Butler-Volmer rate constants in G. B only depends on the potential,
+        so a whole block is solved at once.
+        """
+        mec = self.mec
+        eta = mec.n*(np.asarray(eps)[:,None] - self.e0) # steps x transfers
+        jj = np.arange(np.size(mec.n))
+        G = np.zeros([len(eta), np.size(mec.n), mec.nS])
+        G[:, jj, mec.ox] = mec.K0*np.exp(-mec.alpha*eta)*self.redOn
+        G[:, jj, mec.red] = -mec.K0*np.exp((1-mec.alpha)*eta)*self.oxOn
+        d = np.diag(mec.d)
+        return np.linalg.solve(d + mec.dX*mec.A @ G, d)
+
+    def step(self, a, b, k): # Explicit time step from row a to row b
+        C = self.C
+        Ca = C[a]
+        inner = Ca[:,1:-1]
+        if self.space.uniform:
+            lamb = self.lamb if self.r is None else self.lamb*self.r[k]
+            dC = lamb*(Ca[:,2:] - 2*inner + Ca[:,:-2])
+        else: # Expanding grid
+            lambL = self.lambL
+            lambR = self.lambR
+            if self.r is not None:
+                lambL = lambL*self.r[k]
+                lambR = lambR*self.r[k]
+            dC = lambL*(Ca[:,:-2] - inner) + lambR*(Ca[:,2:] - inner)
+        if self.S.shape[1]: # Homogeneous reactions
+            F1, F2, B1, B2 = inner[self.gather].reshape(4, self.S.shape[1], -1)
+            if self.second:
+                F1 = F1*(self.sF*F2 + (1 - self.sF))
+                B1 = B1*(self.sB*B2 + (1 - self.sB))
+            dT = self.dT if self.r is None else self.dT*self.r[k]
+            dC += dT*(self.S @ (self.kf*F1 - self.kb*B1))
+        C[b,:,1:-1] = inner + dC
+        C[b,:,0] = self.B[k-self.kB] @ Ca[:,1]
+
+    def current(self, b): # Normalised current of working row b
+        C = self.C[b]
+        w0, w1, w2 = self.w
+        return self.h @ (w2*C[:,2] + w1*C[:,1] + w0*C[:,0])
+
+    def full_history(self):
+        return self.C is self.mec.Cs
+
+    def surface(self, b):
+        return self.C[b,:,0].astype(float)
+
+    def working(self):
+        return (self.C,)
+
+    def advance(self, k0, k1): # Time steps k0 <= k < k1
+        nRows = self.mec.nRows
+        for kB in range(k0, k1, 1024): # Boundary operators by blocks, see bc
+            kEnd = min(kB + 1024, k1)
+            self.B = self.bc(self.eps[kB-self.kOff:kEnd-self.kOff])
+            self.kB = kB
+            for k in range(kB, kEnd):
+                a = (k-1)%nRows
+                b = k%nRows
+                self.step(a, b, k)
+                self.Ik[k-self.kOff] = self.current(b)
+
+    def snapshot(self, j, b): # Copies working row b to stored profile j
+        if self.sink is not None: # Only the first transfer is written
+            self.sink.write(j, *self.couple(self.C[b]))
+            return
+        self.mec.Cs[j] = self.C[b]
+
+    def scale_current(self, I): # A, for the normalised current I
+        mec = self.mec
+        return F*self.Ageo*mec.Dref*mec.cRef*I/(2*self.space.dX*mec.delta)
+
+    def couple(self, C): # cR and cO (mol cm^-3) of the first transfer in C (..., species, nodes)
+        mec = self.mec
+        return C[...,mec.red[0],:]*mec.cRef, C[...,mec.ox[0],:]*mec.cRef
+
+    def concentration(self, name):
+        """
+        Returns the stored profiles of species name in mol cm^-3 (profile x
+        node).
+        """
+        return self.mec.Cs[:,self.mec.species.index(name)]*self.mec.cRef
+
+    @property
+    def cR(self):
+        if self._cR is None:
+            self._cR, self._cO = self.couple(self.mec.Cs)
+        return self._cR
+
+    @property
+    def cO(self):
+        if self._cO is None:
+            self._cR, self._cO = self.couple(self.mec.Cs)
+        return self._cO
+
+    def solution(self): # See Simulate.solution
+        return dict(I=self.I, Cs=self.mec.Cs, nDone=self.nDone, kSteady=self.kSteady,
+                    tSteady=self.tSteady)
+
+    def rescale(self, solution): # See Simulate.rescale
+        self.I = solution["I"]
+        self.mec.Cs = self.C = self.mec.C = solution["Cs"]
+        self.nDone = solution["nDone"]
+        self.kSteady = solution["kSteady"]
+        self.tSteady = solution["tSteady"]
+        self.aborted = False
+        self.sink = None
+        self.denorm()
+
+    def reference(self, snap="last"): # See Simulate.reference
+        mec = self.mec
+        refMec = Multi_mec(self.wf, self.space, mec.species, mec.D, mec.c, mec.transfers,
+                           mec.reactions, snap, name=mec.name)
+        return Simulate_multi(self.wf, self.space, refMec, self.Ageo)
+
+def make_wf(params, tgrid="lin"):
+    """
+    Returns Step for waveform parameters ending in "CA", Pulse for "DPV",
+    Square_wave for "SWV" and Sweep otherwise.
+    """
+    if params[-1] == "CA":
+        return Step(params, tgrid)
+    elif params[-1] == "DPV":
+        return Pulse(params)
+    elif params[-1] == "SWV":
+        return Square_wave(params)
+    return Sweep(params)
+
+def make_sim(wf_params, mech_params, Ageo=1, solver="Explicit", lamb=0.45,
+             grid="Equal", tgrid="lin", snap=None, backend="auto", dtype="float64",
+             steady=None):
+    """
+
+    Returns the simulation object for a run described as in the GUI.
+
+    Parameters
+    ----------
+    wf_params:      [Eini, Efin, sr, dE, ns, "CV"] or [Es, ttot, dt, "CA"]
+    mech_params:    [E0, n, DO, DR, cOb, cRb, ks, alpha, BV], or the parameters
+                    of an EC, CE, ECE or EC' mechanism (see make_mec, explicit
+                    solver only)
+    Ageo:           cm2, geometrical area
+    solver:         "Explicit", "Implicit" or "CN"
+    lamb:           dT/dX^2
+    grid:           "Equal" for Equal_spc, "Exp" for Exp_spc
+    tgrid:          "lin" or "log", time spacing of Step
+    snap:           snapshot schedule, see snapshot_steps (the samples for DPV
+                    and SWV, None stores every time step of other waveforms)
+    backend:        "auto", "numba" or "numpy", for the explicit solver
+    dtype:          "float64" or "float32", precision of the profiles, see E_mec
+    steady:         tolerance of a Steady_state that stops the run once it
+                    is stationary, None runs all the time steps
+
+    Examples
+    --------
+    >>> sim = sp.make_sim([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params, solver="CN")
+    >>> sim.fd()
+    """
+    wf = make_wf(wf_params, tgrid)
+    if grid == "Exp":
+        space = Exp_spc(wf, lamb)
+    else:
+        space = Equal_spc(wf, lamb)
+    if mech_params[-1] in mechanisms: # Homogeneous chemistry, see make_mec
+        if solver != "Explicit":
+            raise ValueError("Mechanisms with homogeneous reactions only run with the explicit solver")
+        sim = Simulate_multi(wf, space, make_mec(wf, space, mech_params, snap, dtype), Ageo)
+    else:
+        mec = E_mec(wf, space, mech_params, snap, dtype)
+        if solver == "Implicit":
+            sim = Simulate_implicit(wf, space, mec, Ageo, theta=1)
+        elif solver == "CN":
+            sim = Simulate_implicit(wf, space, mec, Ageo, theta=0.5)
+        else:
+            sim = Simulate(wf, space, mec, Ageo, backend)
+    # Run description, saved with the results (see save_results):
+    sim.params = dict(wf_params=list(wf_params), mech_params=list(mech_params),
+                      Ageo=Ageo, solver=solver, lamb=lamb, grid=grid, tgrid=tgrid,
+                      snap=snap, backend=backend, dtype=str(np.dtype(dtype)), steady=steady)
+    if steady is not None:
+        sim.steady = Steady_state(steady)
+    return sim
+
+def available_memory():
+    """
+    Returns the memory available for new allocations in bytes
+    (MemAvailable on Linux, psutil elsewhere), None if it is not known.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().available
+
+calibration = {} # (solver, backend, grid): s per time step, per node-step and per stored node
+
+def calibrate(solver="Explicit", backend="auto", grid="Equal"):
+    """
+    Returns the wall time of fd per time step, per node and time step and
+    per node of a stored concentration profile, fitted to short runs
+    (about a second) on this machine. They are measured once per solver,
+    backend and grid and kept in calibration.
+    """
+    if solver == "Explicit":
+        backend = explicit_backend(backend, np.inf, 0)
+    else:
+        backend = "numpy"
+    key = (solver, backend, grid)
+    if key in calibration:
+        return calibration[key]
+
+    mech = [0, 1, 1e-5, 1e-5, 0, 1e-6, 1e8, 0.5, "QR"]
+    # Implicit steps are slower, fewer of them are enough:
+    dE = 0.0005 if solver == "Explicit" else 0.002
+
+    def run(lamb, grid, snap): # s, best of two runs (the first one compiles Numba)
+        wf = make_wf([-0.5, 0.5, 1, dE, 1, "CV"])
+        space = Exp_spc(wf, lamb) if grid == "Exp" else Equal_spc(wf, lamb)
+        mec = E_mec(wf, space, mech, snap)
+        best = np.inf
+        for repeat in range(2):
+            if solver == "Explicit":
+                sim = Simulate(wf, space, mec, backend=backend, verbose=False)
+            else:
+                sim = Simulate_implicit(wf, space, mec, theta=1 if solver == "Implicit" else 0.5,
+                                        verbose=False)
+            t0 = time.perf_counter()
+            sim.fd()
+            best = min(best, time.perf_counter() - t0)
+        return space.nT, space.nX, best
+
+    if grid == "Exp": # Few nodes, only the cost per time step differs
+        perNode, perStored = calibrate(solver, backend)[1:]
+        nT, nX, t = run(0.45, grid, "last")
+        perStep = max(t/nT - perNode*nX, 0)
+    else: # nX = 6*lamb*nT on the equal grid
+        nT, nX1, t1 = run(0.05, grid, "last")
+        nT, nX2, t2 = run(0.45, grid, "last")
+        perNode = max((t2 - t1)/(nT*(nX2 - nX1)), 0)
+        perStep = max(t1/nT - perNode*nX1, 0)
+        nT, nX1, t3 = run(0.05, grid, None) # Every profile stored and scaled
+        perStored = max((t3 - t1)/(nT*nX1), 0)
+    calibration[key] = (perStep, perNode, perStored)
+    return calibration[key]
+
+def format_bytes(n):
+    for unit in ("B", "kB", "MB", "GB"):
+        if n < 1000:
+            return "%.3g %s" %(n, unit)
+        n /= 1000
+    return "%.3g TB" %n
+
+class Estimate:
+    """
+
+    Predicts the size, peak memory and run time of a run described as in
+    make_sim, without building its arrays.
+
+    Parameters
+    ----------
+    As make_sim, and
+    timed:      if True, estimate the run time with calibrate (runs a few
+                short simulations the first time), None only uses an
+                existing calibration, otherwise time is None
+
+    The time and memory of runs with steady are for all the time steps, an
+    early stop only makes them shorter.
+
+    Returns
+    -------
+    nT:         number of time steps
+    nX:         number of distance nodes
+    nSnap:      number of stored concentration profiles
+    memory:     bytes, peak of the arrays of the waveform, fd, denorm and
+                the scaled profiles (cR, cO), with their temporaries
+    time:       s, expected wall time of fd, within about 50 % for E_mec runs
+                (mechanisms with homogeneous reactions take longer)
+    calibration_key: (solver, backend, grid) of the calibrate run that
+                times it
+
+    Examples
+    --------
+    >>> est = sp.Estimate([-0.5, 0.5, 1, 1e-4, 2, "CV"], mech_params)
+    >>> est.summary()
+    '20000 x 54000 grid, 34.6 GB, about 2 s'
+    >>> est.snap_for(sp.available_memory()) # every Nth profile that fits
+    """
+
+    def __init__(self, wf_params, mech_params=None, Ageo=1, solver="Explicit", lamb=0.45,
+                 grid="Equal", tgrid="lin", snap=None, backend="auto", dtype="float64",
+                 steady=None, timed=True):
+        # Time steps, as the waveforms:
+        technique = wf_params[-1]
+        nStore = None # Values of t and E kept per time step
+        nCurrent = None # Values of the current kept
+        nWf = 0 # Other values kept by the waveform
+        if technique in ("DPV", "SWV"): # Lazy and sampled
+            wf = make_wf(wf_params)
+            nT = wf.nT
+            dT = 1/nT
+            nStore = 0
+            nCurrent = np.size(wf.kSample)
+            nWf = 3*nCurrent + wf.nP + 2**14 # kSample, sampled t and E, base potentials, block of I
+        elif technique == "CA":
+            wf = Step(wf_params, tgrid, lazy=True)
+            nT = wf.nT
+            dT = min(1/nT, wf.dt/wf.ttot) if tgrid == "log" else 1/nT
+        else: # Sweep
+            Eini, Efin, sr, dE, ns = wf_params[:5]
+            nT = int(abs(Efin - Eini)/dE)*ns
+            dT = 1/nT
+            nWf = 2*nT//max(ns, 1) # Forward and backward branches
+        nT = max(int(nT), 2)
+        if nStore is None:
+            nStore = 3 if tgrid == "log" and technique == "CA" else 2 # t, E (and r)
+            nCurrent = nT
+
+        # Distance nodes, as Equal_spc and Exp_spc:
+        dX = np.sqrt(dT/lamb)
+        if grid == "Exp":
+            gamma, Xmax = 1.1, 6
+            nX = int(np.ceil(np.log(1 + Xmax*(gamma-1)/dX)/np.log(gamma))) + 1
+        else:
+            nX = int(6*np.sqrt(nT*lamb)/dX)
+
+        # Stored profiles, as snapshot_steps:
+        if snap is None and technique in ("DPV", "SWV"):
+            snap = "samples"
+        if snap is None:
+            nSnap = nT
+        elif isinstance(snap, str):
+            nSnap = nCurrent if snap == "samples" else 1
+        elif np.ndim(snap) == 0:
+            every = snap_every(snap)
+            nSnap = -(-nT//every) + ((nT-1)%every != 0)
+        else:
+            nSnap = len(snap)
+
+        self.nT = nT
+        self.nX = nX
+        self.nSnap = nSnap
+        self.snap = snap
+        # Species, two (O and R) but for make_mec mechanisms:
+        self.nS = 2 if mech_params is None else mechanisms.get(mech_params[-1], 2)
+        self.itemsize = np.dtype(dtype).itemsize
+        if solver == "Explicit" and self.nS == 2:
+            backend = explicit_backend(backend, nT, nX)
+        else:
+            backend = "numpy"
+        # Arrays kept for the whole run: per time step (t, E and r), the
+        # current (I and i), the waveform's own, the potential of a block
+        # of time steps (eps, see Simulate.march), the boundary operators
+        # of a block (Simulate_multi.bc) and the grid (X and x):
+        nB = min(nT, 1024)*self.nS**2 if self.nS > 2 else 0
+        self.fixed = 8.0*(nStore*nT + 2*nCurrent + nWf + min(nT, 2**14) + nB + 2*nX)
+        # Largest temporary arrays on top of them: building t and E,
+        # reading them in blocks (iter_chunks), the solver's working rows
+        # (temporaries of the numpy step, LU factors), solving the boundary
+        # operators, scaling i and the profiles (NumPy reuses the
+        # temporaries above 256 KiB):
+        if self.nS > 2:
+            rows = 10
+        else:
+            rows = 2 if backend == "numba" else 4 if solver == "Explicit" else 18
+        self.transient = max(8.0*max(5*nStore*nT//2, 5*min(nT, 2**16), rows*self.nS*nX//2,
+                                     3*nB, nCurrent), min(float(self.itemsize)*nSnap*nX, 2**18))
+        self.memory = self.profiles(nSnap) + self.fixed + self.transient
+        self.time = None
+        self.calibration_key = (solver, backend, grid)
+        if timed or timed is None and self.calibration_key in calibration:
+            perStep, perNode, perStored = calibrate(*self.calibration_key)
+            self.time = nT*(perStep + perNode*nX) + perStored*nSnap*nX
+
+    def profiles(self, nSnap): # bytes of the species (and scaled cR, cO) for nSnap profiles
+        rows = 0 if self.snap is None and nSnap == self.nT else 2*self.nS # Working rows
+        return float(self.itemsize)*self.nX*(rows + (self.nS + 2)*nSnap)
+
+    def snap_for(self, budget):
+        """
+        Returns the snapshot schedule (every Nth profile, or "last") with
+        the most profiles that fits in budget bytes, None if none does.
+        """
+        row = (self.nS + 2.0)*self.itemsize*self.nX # Species, cR and cO
+        nSnap = int((budget - self.fixed - self.transient
+                     - 2.0*self.nS*self.itemsize*self.nX)//row)
+        if nSnap >= 2:
+            return max(int(np.ceil((self.nT - 1)/(nSnap - 1))), 1)
+        if nSnap == 1:
+            return "last"
+        return None
+
+    def summary(self):
+        """
+        Returns e.g. "20000 x 54000 grid, 34.6 GB, about 2 s".
+        """
+        text = "%d x %d grid, %s" %(self.nT, self.nX, format_bytes(self.memory))
+        if self.time is not None:
+            t = self.time
+            if t < 1:
+                text += ", under 1 s"
+            elif t < 90:
+                text += ", about %.0f s" %t
+            elif t < 5400:
+                text += ", about %.0f min" %(t/60)
+            else:
+                text += ", about %.0f h" %(t/3600)
+        return text
+
+def broadcast_params(wf_params, mech_params):
+    """
+    Returns lists of waveform and mechanism parameters of the same length,
+    a single parameter set is repeated for all the runs.
+    """
+    if np.ndim(wf_params[0]) == 0:
+        wf_params = [wf_params]
+    if np.ndim(mech_params[0]) == 0:
+        mech_params = [mech_params]
+    nB = max(len(wf_params), len(mech_params))
+    if len(wf_params) == 1:
+        wf_params = list(wf_params)*nB
+    if len(mech_params) == 1:
+        mech_params = list(mech_params)*nB
+    if len(wf_params) != len(mech_params):
+        raise ValueError("Got %d waveforms and %d mechanisms" %(len(wf_params), len(mech_params)))
+    return wf_params, mech_params
+
+class Simulate_batch:
+    """
+
+    Simulates many parameter sets in one vectorised pass. All the runs are
+    advanced together on (batch x nX) arrays, so the Python overhead of
+    each time step is paid once for the whole batch. The runs must share
+    the number of time steps (same Ewin/dE and ns, or ttot/dt), everything
+    else (scan rate, E0, n, D, concentrations, ks, alpha, BV, Ageo) can
+    differ. Runs with the same dimensionless problem (see dimless_key), e.g.
+    area or concentration series, are solved once and rescaled.
+
+    Parameters
+    ----------
+    wf_params:      list of waveform parameters, one per run, or a single
+                    one for all. Step if the last element is "CA", Sweep
+                    otherwise
+    mech_params:    list of mechanism parameters, one per run, or a single
+                    one for all
+    Ageo:           cm2, geometrical area, scalar or one per run
+    lamb:           dT/dX^2
+    spacing:        spacing class, Equal_spc or Exp_spc
+    theta:          None for explicit, 1 for implicit, 0.5 for Crank-Nicolson
+    snap:           snapshot schedule shared by all runs, see snapshot_steps
+
+    Returns
+    -------
+    t, E, i:    s, V, A, (batch x nT)
+    x:          cm, (batch x nX)
+    cR, cO:     mol cm^-3, (batch x nSnap x nX)
+
+    Examples
+    --------
+    >>> sr = [0.01, 0.1, 1, 10]
+    >>> wf_params = [[-0.5, 0.5, v, 0.01, 2] for v in sr]
+    >>> sim = sp.Simulate_batch(wf_params, [0, 1, 1e-5, 1e-5, 0, 1e-6, 1e8, 0.5, "QR"])
+    >>> sim.fd()
+    >>> iPk = np.max(sim.i, axis=1)
+    """
+
+    def __init__(self, wf_params, mech_params, Ageo=1, lamb=0.45,
+                 spacing=Equal_spc, theta=None, snap="last"):
+        wf_params, mech_params = broadcast_params(wf_params, mech_params)
+        nB = len(wf_params)
+        self.Ageo = np.ones(nB)*Ageo
+
+        self.wfs = []
+        self.mecs = []
+        for wf_p, mech_p in zip(wf_params, mech_params):
+            wf = make_wf(wf_p)
+            self.wfs.append(wf)
+            # Rolling storage, every step is snap = 1 rather than the full history:
+            self.mecs.append(E_mec(wf, spacing(wf, lamb), mech_p, 1 if snap is None else snap))
+        if any(getattr(wf, "kSample", None) is not None for wf in self.wfs):
+            raise ValueError("Simulate_batch keeps the current of every time step, "
+                             "use Simulate_pool for pulse waveforms")
+        nTs = set(len(wf.t) for wf in self.wfs)
+        if len(nTs) > 1:
+            raise ValueError("All the runs of a batch need the same number of "
+                             "time steps, got nT = %s" %sorted(nTs))
+
+        # Normalised problem shared by all the runs:
+        wf = self.wfs[0]
+        self.space = spacing(wf, lamb)
+        self.theta = theta
+        self.w = current_weights(self.space)
+        self.r = step_ratio(wf.t, self.space.dT)
+        for wf in self.wfs[1:]:
+            if (self.r is None) != (step_ratio(wf.t, self.space.dT) is None):
+                raise ValueError("All the runs of a batch need the same time grid")
+        if theta is None:
+            check_stability(self.space, self.r)
+        self.kSnap = self.mecs[0].kSnap
+
+        # Parameters stacked as (batch,) arrays:
+        def stack(name, mecs=self.mecs):
+            return np.array([getattr(mec, name) for mec in mecs])
+        self.n = stack("n")
+        self.DO = stack("DO")
+        self.DR = stack("DR")
+        self.cOb = stack("cOb")
+        self.cRb = stack("cRb")
+        self.delta = stack("delta")
+        eps = [chunked(lambda E: (E - mec.E0)*mec.n*FRT, wf.E) for wf, mec in zip(self.wfs, self.mecs)]
+
+        # Runs with the same dimensionless problem (e.g. area or concentration
+        # series) are solved once, runs[b] is the solved run used by run b:
+        keys = [dimless_key(eps[b], self.wfs[b].t, self.space, self.mecs[b], theta)
+                for b in range(nB)]
+        solved = {}
+        self.runs = np.array([solved.setdefault(key, len(solved)) for key in keys])
+        mecs = [self.mecs[keys.index(key)] for key in solved]
+        nB = len(mecs)
+        self.nB = nB
+        self.K0 = stack("K0", mecs)
+        self.alpha = stack("alpha", mecs)
+        self.DOR = stack("DOR", mecs)
+        self.useR = stack("cRb", mecs) != 0 # Current from R, or from O if only O present
+        self.eps = np.array([eps[keys.index(key)] for key in solved])
+        # Runs grouped by kinetics, a slice when all are the same:
+        BV = stack("BV", mecs)
+        self.kinetics = []
+        for kind in set(BV):
+            j = np.nonzero(BV == kind)[0]
+            self.kinetics.append((kind, slice(None) if np.size(j) == nB else j))
+
+        # Working rows (2 x batch x nX) and stored profiles (nSnap x batch x nX):
+        nX = self.space.nX
+        self.CR = np.array([mec.CR[:2] for mec in mecs]).transpose(1, 0, 2).copy()
+        self.CO = np.array([mec.CO[:2] for mec in mecs]).transpose(1, 0, 2).copy()
+        self.CRs = np.zeros([np.size(self.kSnap), nB, nX])
+        self.COs = np.zeros([np.size(self.kSnap), nB, nX])
+        self.I = np.zeros([nB, self.space.nT])
+        for mec in self.mecs: # Only the parameters are needed from now on
+            mec.CR = mec.CO = mec.CRs = mec.COs = None
+
+        if theta is not None:
+            M = nX - 2
+            if self.space.uniform:
+                self.lambL = np.ones(M)*lamb
+                self.lambR = np.ones(M)*lamb
+            else:
+                self.lambL = self.space.lambL
+                self.lambR = self.space.lambR
+            self.factor(1)
+            self.rhs = np.zeros([2*nB, M]) # Rows for R and O of each run
+
+    def bc(self, CR1kb, CO1kb, eps): # Simulate.bc for (batch,) arrays
+        CR = np.empty(self.nB)
+        CO = np.empty(self.nB)
+        dX = self.space.dX
+        for kind, j in self.kinetics:
+            K0 = self.K0[j]
+            alpha = self.alpha[j]
+            DOR = self.DOR[j]
+            e = eps[j]
+            R1 = CR1kb[j]
+            O1 = CO1kb[j]
+            if kind == "QR": # O <-> R
+                CR[j] = (R1 + dX*K0*np.exp(-alpha*e)*(O1 + R1/DOR))/(
+                         1 + dX*K0*(np.exp((1-alpha)*e) + np.exp(-alpha*e)/DOR))
+                CO[j] = O1 + (R1 - CR[j])/DOR
+            elif kind == "RO": # R -> O
+                CR[j] = R1/(1 + dX*K0*np.exp((1-alpha)*e))
+                CO[j] = O1 + (R1 - CR[j])/DOR
+            else: # O -> R
+                CO[j] = O1/(1 + dX*K0*np.exp((-alpha)*e))
+                CR[j] = R1 + (O1 - CO[j])/DOR
+        return CR, CO
+
+    factor = Simulate_implicit.factor # A and v are shared by all the runs
+
+    def fd(self, progress=None): # Finite Differences for all the runs, see Simulate.fd
+        progress = as_progress(progress)
+        useR = self.useR
+        w0, w1, w2 = self.w
+        self.I[:,0] = 0
+        kSnap = self.kSnap
+        nSnap = np.size(kSnap)
+        j = 0
+        if kSnap[0] == 0:
+            self.CRs[0] = self.CR[0]
+            self.COs[0] = self.CO[0]
+            j = 1
+        kNext = kSnap[j] if j < nSnap else -1
+
+        nT = self.space.nT
+        if progress:
+            progress.start(nT)
+        self.aborted = False
+        for k in range(1, nT):
+            a = (k-1)%2
+            b = k%2
+
+            if progress and k%progress.every == 0 and progress.update(k):
+                self.aborted = True
+                break
+
+            if self.theta is None:
+                self.step(a, b, k)
+            else:
+                self.step_implicit(a, b, k)
+
+            CR = self.CR[b]
+            CO = self.CO[b]
+            self.I[:,k] = np.where(useR, -(w2*CR[:,2] + w1*CR[:,1] + w0*CR[:,0]),
+                                   w2*CO[:,2] + w1*CO[:,1] + w0*CO[:,0])
+
+            if k == kNext: # Store the profiles
+                self.CRs[j] = CR
+                self.COs[j] = CO
+                j += 1
+                kNext = kSnap[j] if j < nSnap else -1
+        else:
+            k = nT
+            if progress:
+                progress.update(nT, force=True)
+
+        self.nDone = k # Time steps calculated, nT unless aborted
+        self.denorm()
+
+    def step(self, a, b, k): # Explicit time step from row a to row b
+        CR = self.CR
+        CO = self.CO
+        CR[b,:,0], CO[b,:,0] = self.bc(CR[a,:,1], CO[a,:,1], self.eps[:,k])
+        if self.space.uniform:
+            lamb = self.space.lamb if self.r is None else self.space.lamb*self.r[k]
+            CR[b,:,1:-1] = CR[a,:,1:-1] + lamb*(CR[a,:,2:] - 2*CR[a,:,1:-1] + CR[a,:,:-2])
+            CO[b,:,1:-1] = CO[a,:,1:-1] + lamb*(CO[a,:,2:] - 2*CO[a,:,1:-1] + CO[a,:,:-2])
+        else: # Expanding grid
+            lambL = self.space.lambL
+            lambR = self.space.lambR
+            if self.r is not None:
+                lambL = lambL*self.r[k]
+                lambR = lambR*self.r[k]
+            CR[b,:,1:-1] = CR[a,:,1:-1] + lambL*(CR[a,:,:-2] - CR[a,:,1:-1])\
+                         + lambR*(CR[a,:,2:] - CR[a,:,1:-1])
+            CO[b,:,1:-1] = CO[a,:,1:-1] + lambL*(CO[a,:,:-2] - CO[a,:,1:-1])\
+                         + lambR*(CO[a,:,2:] - CO[a,:,1:-1])
+
+    def step_implicit(self, a, b, k): # Simulate_implicit.step for all the runs
+        CR = self.CR
+        CO = self.CO
+        nB = self.nB
+        theta = self.theta
+        if self.r is not None and self.r[k] != self.rk: # New time step
+            self.factor(self.r[k])
+        lambL = self.rk*self.lambL
+        lambR = self.rk*self.lambR
+
+        # Right hand side, explicit part and bulk node. Rows of D are the
+        # columns of the (M x 2*nB) system solved by LAPACK:
+        D = self.rhs
+        D[:nB] = CR[a,:,1:-1]
+        D[nB:] = CO[a,:,1:-1]
+        if theta < 1:
+            D[:nB] += (1-theta)*(lambL*(CR[a,:,:-2] - CR[a,:,1:-1]) + lambR*(CR[a,:,2:] - CR[a,:,1:-1]))
+            D[nB:] += (1-theta)*(lambL*(CO[a,:,:-2] - CO[a,:,1:-1]) + lambR*(CO[a,:,2:] - CO[a,:,1:-1]))
+        D[:nB,-1] += theta*lambR[-1]*CR[a,:,-1]
+        D[nB:,-1] += theta*lambR[-1]*CO[a,:,-1]
+        U = self.A.solve(D.T).T
+        UR = U[:nB]
+        UO = U[nB:]
+
+        # Butler-Volmer, [CR0, CO0] = P [CR1, CO1] for each run:
+        ones = np.ones(nB)
+        zeros = np.zeros(nB)
+        pRR, pOR = self.bc(ones, zeros, self.eps[:,k])
+        pRO, pOO = self.bc(zeros, ones, self.eps[:,k])
+        v1 = self.v[0]
+        a11 = 1 - v1*pRR
+        a12 = -v1*pRO
+        a21 = -v1*pOR
+        a22 = 1 - v1*pOO
+        det = a11*a22 - a12*a21
+        CR1 = (a22*UR[:,0] - a12*UO[:,0])/det
+        CO1 = (a11*UO[:,0] - a21*UR[:,0])/det
+        CR[b,:,0] = pRR*CR1 + pRO*CO1
+        CO[b,:,0] = pOR*CR1 + pOO*CO1
+
+        CR[b,:,1:-1] = UR + CR[b,:,:1]*self.v
+        CO[b,:,1:-1] = UO + CO[b,:,:1]*self.v
+
+    def denorm(self): # Denormalisation of all the runs
+        D = np.where(self.cRb != 0, self.DR, self.DO)
+        c = np.where(self.cRb != 0, self.cRb, self.cOb)
+        scale = self.n*F*self.Ageo*D*c/(2*self.space.dX*self.delta)
+        self.i = scale[:,None]*self.I[self.runs]
+        self.x = self.space.X*self.delta[:,None]
+        self.t = np.array([wf.t for wf in self.wfs])
+        self.E = np.array([wf.E for wf in self.wfs])
+        self.tSnap = self.t[:,self.kSnap]
+
+        # Scaled as in Simulate.cR and Simulate.cO, as (batch x nSnap x nX):
+        CRs = self.CRs.transpose(1, 0, 2)[self.runs]
+        COs = self.COs.transpose(1, 0, 2)[self.runs]
+        onlyO = (self.cRb == 0)[:,None,None]
+        onlyR = ((self.cRb != 0) & (self.cOb == 0))[:,None,None]
+        cRb = self.cRb[:,None,None]
+        cOb = self.cOb[:,None,None]
+        self.cR = np.where(onlyO, (1-COs)*cOb, CRs*cRb)
+        self.cO = np.where(onlyO, COs*cOb, np.where(onlyR, (1-CRs)*cRb, COs*cOb))
+
+
+########## Parallel runs:
+
+class Result:
+    """
+    Results of a single run of Simulate_pool or read by load_results: t, E,
+    i, x, cR, cO and tSnap as in Simulate, and error, None unless the run
+    failed or timed out.
+    """
+
+    def __init__(self, **kwargs):
+        self.error = None
+        self.__dict__.update(kwargs)
+
+    def profile(self, n): # See Simulate.profile
+        nT = np.size(self.t)
+        n = min(n%nT if n < 0 else n, nT-1)
+        return max(np.searchsorted(self.tSnap, self.t[n], side="right") - 1, 0)
+
+
+def result_layout(wf_p, lamb, spacing, snap):
+    """
+    Returns the shapes of t, E, i, x, cR and cO for one run, in the order
+    they are packed in its shared memory block.
+    """
+    wf = make_wf(wf_p)
+    nT = len(wf.t) if getattr(wf, "kSample", None) is None else np.size(wf.kSample)
+    nX = spacing(wf, lamb).nX
+    nSnap = np.size(snapshot_steps(wf.t, snap, getattr(wf, "kSample", None)))
+    return [("t", (nT,)), ("E", (nT,)), ("i", (nT,)), ("tSnap", (nSnap,)),
+            ("x", (nX,)), ("cR", (nSnap, nX)), ("cO", (nSnap, nX))]
+
+
+def unpack(buf, layout):
+    """
+    Returns a dictionary of arrays viewing buf with the given layout.
+    """
+    arrays = {}
+    offset = 0
+    for name, shape in layout:
+        size = int(np.prod(shape))
+        arrays[name] = np.ndarray(shape, dtype=np.float64, buffer=buf, offset=8*offset)
+        offset += size
+    return arrays
+
+
+def run_chunk(jobs, lamb, spacing, theta, snap, timeout, backend="auto"):
+    """
+    Runs a chunk of Simulate_pool jobs in a worker process. The results are
+    written to the shared memory block of each job, only the job index and
+    error message (or None) are sent back.
+    """
+    from multiprocessing import shared_memory
+
+    out = []
+    for j, wf_p, mech_p, Ageo, name, layout in jobs:
+        try:
+            wf = make_wf(wf_p)
+            space = spacing(wf, lamb)
+            mec = E_mec(wf, space, mech_p, snap)
+            if theta is None:
+                sim = Simulate(wf, space, mec, Ageo, backend)
+            else:
+                sim = Simulate_implicit(wf, space, mec, Ageo, theta)
+            if timeout: # Stops the run once timeout seconds have passed
+                sim.fd(Progress(lambda k, nT, elapsed, eta: elapsed > timeout, interval=0))
+            else:
+                sim.fd()
+            if sim.aborted:
+                raise TimeoutError("Run did not finish in %g s" %timeout)
+
+            shm = shared_memory.SharedMemory(name) # Created by the parent
+            arrays = unpack(shm.buf, layout)
+            for key in arrays:
+                arrays[key][...] = getattr(sim, key)
+            del arrays
+            shm.close()
+            out.append((j, None))
+        except Exception as e:
+            out.append((j, "%s: %s" %(type(e).__name__, e)))
+    return out
+
+
+class Simulate_pool:
+    """
+
+    Runs independent simulations on a pool of processes, for parameter
+    sets that can't share a grid in Simulate_batch (e.g. different dE or
+    ns). Results come back through shared memory rather than pickles.
+
+    Parameters
+    ----------
+    wf_params:      list of waveform parameters, one per run, or a single
+                    one for all. Step if the last element is "CA", Sweep
+                    otherwise
+    mech_params:    list of mechanism parameters, one per run, or a single
+                    one for all
+    Ageo:           cm2, geometrical area, scalar or one per run
+    lamb:           dT/dX^2
+    spacing:        spacing class, Equal_spc or Exp_spc
+    theta:          None for explicit, 1 for implicit, 0.5 for Crank-Nicolson
+    snap:           snapshot schedule, see snapshot_steps
+    workers:        number of processes, os.cpu_count() by default
+    chunksize:      number of runs sent to a worker at a time
+    timeout:        s, runs taking longer are stopped and flagged. fd checks
+                    it cooperatively through a Progress callback, so the
+                    worker is not killed and a stop lands between blocks
+                    of time steps
+    backend:        "auto", "numba" or "numpy", for the explicit solver
+
+    Returns
+    -------
+    results:    list of Result, in the same order as the parameters
+
+    Examples
+    --------
+    >>> wf_params = [[-0.5, 0.5, 1, dE, 2] for dE in [0.01, 0.005, 0.001]]
+    >>> pool = sp.Simulate_pool(wf_params, mech_params, timeout=600)
+    >>> results = pool.run()
+    >>> iPk = [np.max(res.i) for res in results if res.error is None]
+    """
+
+    def __init__(self, wf_params, mech_params, Ageo=1, lamb=0.45, spacing=Equal_spc,
+                 theta=None, snap="last", workers=None, chunksize=1, timeout=None,
+                 backend="auto"):
+        self.wf_params, self.mech_params = broadcast_params(wf_params, mech_params)
+        self.Ageo = np.ones(len(self.wf_params))*Ageo
+        self.lamb = lamb
+        self.spacing = spacing
+        self.theta = theta
+        self.snap = snap
+        self.workers = workers or os.cpu_count()
+        self.chunksize = chunksize
+        self.timeout = timeout
+        self.backend = backend
+
+    def run(self):
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import shared_memory
+
+        nJobs = len(self.wf_params)
+        layouts = [result_layout(wf_p, self.lamb, self.spacing, self.snap)
+                   for wf_p in self.wf_params]
+        blocks = [shared_memory.SharedMemory(create=True,
+                  size=8*max(1, sum(int(np.prod(shape)) for name, shape in layout)))
+                  for layout in layouts]
+        jobs = [(j, self.wf_params[j], self.mech_params[j], self.Ageo[j],
+                 blocks[j].name, layouts[j]) for j in range(nJobs)]
+        chunks = [jobs[j:j+self.chunksize] for j in range(0, nJobs, self.chunksize)]
+
+        errors = [None]*nJobs
+        try:
+            with ProcessPoolExecutor(self.workers) as pool:
+                futures = [pool.submit(run_chunk, chunk, self.lamb, self.spacing,
+                                       self.theta, self.snap, self.timeout, self.backend)
+                           for chunk in chunks]
+                for chunk, future in zip(chunks, futures):
+                    try:
+                        for j, error in future.result():
+                            errors[j] = error
+                    except Exception as e: # e.g. the worker died
+                        for job in chunk:
+                            errors[job[0]] = "%s: %s" %(type(e).__name__, e)
+
+            self.results = []
+            for j in range(nJobs):
+                if errors[j] is None:
+                    arrays = unpack(blocks[j].buf, layouts[j])
+                    res = Result(**dict((key, arrays[key].copy()) for key in arrays))
+                    del arrays
+                else:
+                    res = Result(error=errors[j])
+                self.results.append(res)
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+        return self.results
+
+
+
+########## Results files:
+
+def run_params(sim):
+    """
+    Returns the run description of sim: the arguments of make_sim, or the
+    mechanism parameters and area for simulations built by hand.
+    """
+    params = getattr(sim, "params", None)
+    if params is None and isinstance(getattr(sim, "mec", None), Multi_mec):
+        mec = sim.mec
+        params = dict(species=mec.species, D=mec.D, c=mec.c, transfers=mec.transfers,
+                      reactions=mec.reactions, Ageo=sim.Ageo)
+    elif params is None and hasattr(sim, "mec"):
+        mec = sim.mec
+        params = dict(mech_params=[mec.E0, mec.n, mec.DO, mec.DR, mec.cOb,
+                                   mec.cRb, mec.ks, mec.alpha, mec.BV],
+                      Ageo=sim.Ageo)
+    params = params or {}
+    if getattr(sim, "tSteady", None) is not None: # Stopped early, see Steady_state
+        params = dict(params, tSteady=sim.tSteady)
+    return params
+
+def save_results(sim, fileName, params=None, compress=True):
+    """
+
+    Saves t, E, i, x, tSnap, cR, cO and the run parameters in a single
+    binary file, that load_results reads back without loading cR and cO.
+
+    Parameters
+    ----------
+    sim:        finished simulation, or a Result
+    fileName:   .h5 (or .hdf5) for HDF5, needs h5py, otherwise .npz
+    params:     run description stored as JSON, run_params(sim) by default
+    compress:   HDF5: gzip in chunks of about 1 MB of profiles.
+                npz: deflate, the arrays can then no longer be memory-mapped.
+
+    Examples
+    --------
+    >>> sp.save_results(sim, "run.h5")
+    >>> res = sp.load_results("run.h5")
+    >>> res.cR[-1] # only the last profile is read
+    """
+    import json
+
+    if params is None:
+        params = run_params(sim)
+    params = json.dumps(params, default=lambda o: o.tolist())
+    arrays = dict(t=sim.t, E=sim.E, i=sim.i, x=sim.x, tSnap=sim.tSnap,
+                  cR=sim.cR, cO=sim.cO)
+
+    if is_h5(fileName):
+        import h5py
+        with h5py.File(fileName, "w") as f:
+            f.attrs["params"] = params
+            for name, data in arrays.items():
+                data = np.asarray(data)
+                h5_dataset(f, name, data.shape, compress, data)
+    else:
+        save = np.savez_compressed if compress else np.savez
+        save(fileName, params=np.array(params), **arrays)
+
+def is_h5(fileName):
+    return os.path.splitext(fileName)[1] in (".h5", ".hdf5")
+
+def chunk_rows(nX): # Whole profiles per chunk, about 1 MB
+    return max(1, 2**17//max(1, nX))
+
+def h5_dataset(f, name, shape, compress=True, data=None):
+    """
+    Creates a float64 dataset in the h5py.File f, compressed with gzip in
+    chunks of whole profiles.
+    """
+    chunks = None
+    if compress:
+        chunks = shape
+        if len(shape) == 2:
+            chunks = (min(shape[0], chunk_rows(shape[1])), shape[1])
+        chunks = tuple(max(1, n) for n in chunks)
+    return f.create_dataset(name, shape, "f8", data, chunks=chunks,
+                            compression="gzip" if compress else None,
+                            shuffle=compress)
+
+def npz_members(fileName):
+    """
+    Returns the arrays of an .npz file by name, stored members as read-only
+    memory maps and deflated ones as None.
+    """
+    import struct
+    import zipfile
+
+    members = {}
+    with zipfile.ZipFile(fileName) as z, open(fileName, "rb") as f:
+        for info in z.infolist():
+            name = info.filename[:-4] # Without .npy
+            if info.compress_type != zipfile.ZIP_STORED:
+                members[name] = None
+                continue
+            # The data follow the local file header and the .npy header:
+            f.seek(info.header_offset)
+            nName, nExtra = struct.unpack("<HH", f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + nName + nExtra)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject or 0 in shape:
+                members[name] = None
+            else:
+                members[name] = np.memmap(fileName, dtype, "r", f.tell(), shape,
+                                          "F" if fortran else "C")
+    return members
+
+class Npz_rows:
+    """
+
+    Read-only 2-D member of an .npz file stored deflated, whose rows are
+    only decompressed when indexed: the member is read from its start up
+    to the last row asked for, keeping just those rows in memory.
+    load_results returns cR and cO of compressed .npz files as Npz_rows.
+    """
+
+    ndim = 2
+
+    def __init__(self, fileName, name):
+        import zipfile
+
+        self.fileName = fileName
+        self.member = name + ".npy"
+        with zipfile.ZipFile(fileName) as z, z.open(self.member) as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            self.offset = f.tell()
+        if len(shape) != 2 or fortran:
+            raise ValueError("%s is not a C-ordered matrix" %self.member)
+        self.shape = shape
+        self.dtype = dtype
+        self.size = shape[0]*shape[1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        import zipfile
+
+        rows, rest = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        index = np.arange(self.shape[0])[rows]
+        flat = np.atleast_1d(index)
+        out = np.empty([flat.size, self.shape[1]], self.dtype)
+        rowBytes = self.shape[1]*self.dtype.itemsize
+        with zipfile.ZipFile(self.fileName) as z, z.open(self.member) as f:
+            for i in np.argsort(flat, kind="stable"): # Forward seeks only
+                f.seek(self.offset + int(flat[i])*rowBytes)
+                out[i] = np.frombuffer(f.read(rowBytes), self.dtype)
+        if np.ndim(index) == 0:
+            return out[0][rest] if rest else out[0]
+        return out[(slice(None),) + rest] if rest else out
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype)
+
+def load_results(fileName):
+    """
+
+    Reads a file written by save_results (or sp_cli.py -f npz).
+
+    Returns
+    -------
+    Result with t, E, i, x and tSnap as arrays, params (dict, empty for
+    files without it) and cR and cO that are only read when sliced:
+
+    .h5:    h5py datasets, res.file is the open h5py.File
+    .npz:   memory maps when saved with compress=False, otherwise Npz_rows
+            that decompress the profiles when sliced
+
+    Examples
+    --------
+    >>> res = sp.load_results("run.npz")
+    >>> plt.plot(res.x, res.cO[res.profile(1000)])
+    """
+    import json
+
+    if is_h5(fileName):
+        import h5py
+        f = h5py.File(fileName, "r")
+        res = Result(file=f, cR=f["cR"], cO=f["cO"],
+                     params=json.loads(f.attrs.get("params", "{}")))
+        for name in ("t", "E", "i", "x", "tSnap"):
+            setattr(res, name, f[name][()])
+        return res
+
+    members = npz_members(fileName)
+    arrays = {}
+    with np.load(fileName) as npz: # Closed, only the memory maps keep the file open
+        for name, data in members.items():
+            if data is not None or name == "params":
+                arrays[name] = data
+            elif name in ("cR", "cO"): # Never decompressed as a whole
+                arrays[name] = Npz_rows(fileName, name)
+            else:
+                arrays[name] = npz[name]
+        arrays.pop("params", None)
+        params = json.loads(str(npz["params"])) if "params" in members else {}
+    return Result(params=params, **arrays)
+
+class Profile_sink:
+    """
+
+    Writes the concentration profiles to a results file while Simulate.fd
+    runs, so only a few of them are in memory at any time and runs whose
+    profiles do not fit in memory can be saved. The simulation needs a
+    snapshot schedule (snap=1 stores every time step), the profiles are
+    written as they are reached and the rest of the file when fd finishes.
+
+    Parameters
+    ----------
+    fileName:   .h5 (or .hdf5) for HDF5, needs h5py, otherwise .npz
+    params:     run description stored as JSON, run_params(sim) by default
+    compress:   HDF5 as save_results. In .npz files only t, E, i, x and
+                tSnap are deflated, the profiles are always stored so they
+                can be memory-mapped.
+
+    After fd, sim.cR and sim.cO (and sink.cR, sink.cO) are the datasets of
+    the file opened again for reading, or memory maps of the .npz.
+
+    Examples
+    --------
+    >>> sim = sp.make_sim(wf_params, mech_params, snap=1)
+    >>> sim.fd(sink=sp.Profile_sink("run.h5"))
+    >>> sim.cO[1000] # read from run.h5
+    """
+
+    def __init__(self, fileName, params=None, compress=True):
+        self.fileName = fileName
+        self.params = params
+        self.compress = compress
+
+    def open(self, sim):
+        self.nSnap = np.size(sim.mec.kSnap)
+        self.nX = sim.space.nX
+        rows = min(self.nSnap, chunk_rows(self.nX))
+        self.bufR = np.zeros([rows, self.nX])
+        self.bufO = np.zeros([rows, self.nX])
+        self.nBuf = 0
+        self.j = 0 # Profiles written
+        if is_h5(self.fileName):
+            import h5py
+            self.file = h5py.File(self.fileName, "w")
+            self.out = [h5_dataset(self.file, name, (self.nSnap, self.nX), self.compress)
+                        for name in ("cR", "cO")]
+        else: # .npy files, added to the .npz by close
+            self.out = []
+            for name in ("cR", "cO"):
+                f = open(self.fileName + "." + name + ".npy", "wb")
+                np.lib.format.write_array_header_2_0(f, {"descr": "<f8",
+                        "fortran_order": False, "shape": (self.nSnap, self.nX)})
+                self.out.append(f)
+
+    def write(self, j, cR, cO): # Profile j, mol cm^-3
+        if j != self.j + self.nBuf:
+            raise ValueError("Profiles must be written in order")
+        self.bufR[self.nBuf] = cR
+        self.bufO[self.nBuf] = cO
+        self.nBuf += 1
+        if self.nBuf == len(self.bufR):
+            self.flush()
+
+    def flush(self):
+        n = self.nBuf
+        for out, buf in zip(self.out, (self.bufR, self.bufO)):
+            if is_h5(self.fileName):
+                out[self.j:self.j+n] = buf[:n]
+            else:
+                out.write(buf[:n].tobytes())
+        self.j += n
+        self.nBuf = 0
+
+    def close(self, sim):
+        """
+        Writes the remaining profiles (zeros for an aborted run), t, E, i,
+        x, tSnap and the parameters, and closes the file.
+        """
+        import json
+
+        self.flush()
+        params = run_params(sim) if self.params is None else self.params
+        params = json.dumps(params, default=lambda o: o.tolist())
+        arrays = dict(t=sim.t, E=sim.E, i=sim.i, x=sim.x, tSnap=sim.tSnap)
+        if is_h5(self.fileName):
+            self.file.attrs["params"] = params
+            for name, data in arrays.items():
+                h5_dataset(self.file, name, np.shape(data), self.compress, data)
+            self.file.close()
+            import h5py
+            self.file = h5py.File(self.fileName, "r")
+            self.cR = self.file["cR"]
+            self.cO = self.file["cO"]
+            return
+
+        import io
+        import zipfile
+        zeros = np.zeros(self.nX).tobytes()
+        for f in self.out:
+            for j in range(self.j, self.nSnap):
+                f.write(zeros)
+            f.close()
+        method = zipfile.ZIP_DEFLATED if self.compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(self.fileName, "w", method, allowZip64=True) as z:
+            for name, data in dict(params=np.array(params), **arrays).items():
+                buf = io.BytesIO()
+                np.lib.format.write_array(buf, np.asarray(data))
+                z.writestr(name + ".npy", buf.getvalue())
+            for f in self.out: # Copied in blocks, stored to be memory-mapped
+                z.write(f.name, os.path.basename(f.name)[len(os.path.basename(self.fileName))+1:],
+                        zipfile.ZIP_STORED)
+                os.remove(f.name)
+        members = npz_members(self.fileName)
+        self.cR = members["cR"]
+        self.cO = members["cO"]
+
+
+
+########## Cache:
+
+def run_key(wf_params, mech_params, Ageo=1, solver="Explicit", lamb=0.45,
+            grid="Equal", tgrid="lin", snap=None, backend="auto", dtype="float64",
+            steady=None):
+    """
+    Returns a hash of the arguments of make_sim that identifies the results
+    of a run. Numbers are compared as floats (1 and 1.0 give the same key),
+    the backend does not change the results and is ignored.
+    """
+    import hashlib
+    import json
+
+    def canonical(p):
+        if isinstance(p, str) or p is None:
+            return p
+        if np.ndim(p) == 0:
+            return repr(float(p))
+        return [canonical(q) for q in p]
+
+    desc = dict(wf_params=canonical(wf_params), mech_params=canonical(mech_params),
+                Ageo=canonical(Ageo), solver=solver, lamb=canonical(lamb),
+                grid=grid, tgrid=tgrid, snap=canonical(snap))
+    if np.dtype(dtype) != np.float64: # Keys of float64 runs are unchanged
+        desc["dtype"] = str(np.dtype(dtype))
+    if steady is not None:
+        desc["steady"] = canonical(steady)
+    return hashlib.sha256(json.dumps(desc, sort_keys=True).encode()).hexdigest()
+
+def held_bytes(*objs):
+    """
+    Returns the bytes of the arrays held by the attributes of objs (e.g. a
+    simulation and its mechanism) or by the values of dicts. Arrays sharing
+    memory are counted once, memory-mapped files not at all.
+    """
+    seen = set()
+    total = 0
+    for obj in objs:
+        for a in (obj.values() if isinstance(obj, dict) else vars(obj).values()):
+            if not isinstance(a, np.ndarray):
+                continue
+            while isinstance(a.base, np.ndarray): # Views count as their array
+                a = a.base
+            if isinstance(a, np.memmap) or id(a) in seen:
+                continue
+            seen.add(id(a))
+            total += a.nbytes
+    return total
+
+class Sim_cache:
+    """
+
+    Cache of finished simulations keyed by run_key, so runs repeated with
+    the same parameters are not solved again.
+
+    Parameters
+    ----------
+    maxsize:    number of simulations kept in memory, least recently used
+                ones are dropped first
+    memory_budget: bytes, total size of the arrays kept in memory
+                (profiles, their scaled copies and the solutions, see
+                held_bytes), the least recently used runs are dropped
+                beyond it
+    path:       folder for the on-disk tier (None for memory only). Results
+                are saved there as uncompressed .npz files and memory-mapped
+                when read back
+    budget:     bytes, total size of the files in path, the least recently
+                used ones are deleted beyond it
+
+    Examples
+    --------
+    >>> cache = sp.Sim_cache(path="sp_cache")
+    >>> sim = cache.run(wf_params, mech_params, solver="CN") # solved
+    >>> sim = cache.run(wf_params, mech_params, solver="CN") # from the cache
+    >>> sim = cache.run(wf_params, mech_params, 2, solver="CN") # rescaled to 2 cm2
+
+    The cached objects are returned as they are and should not be modified.
+    Results read from disk are Result objects, with t, E, i, x, cR, cO and
+    tSnap as Simulate.
+    """
+
+    def __init__(self, maxsize=8, path=None, budget=2**30, memory_budget=2**30):
+        from collections import OrderedDict
+        self.maxsize = maxsize
+        self.path = path
+        self.budget = budget
+        self.memory_budget = memory_budget
+        self.memory = OrderedDict()
+        self.solutions = OrderedDict() # Dimensionless solutions by dimless_key
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def fileName(self, key):
+        return os.path.join(self.path, key + ".npz")
+
+    def get(self, key):
+        """
+        Returns the results stored under key, or None.
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.path is not None and os.path.exists(self.fileName(key)):
+            os.utime(self.fileName(key)) # Most recently used
+            sim = load_results(self.fileName(key))
+            self.remember(key, sim)
+            return sim
+        return None
+
+    def put(self, key, sim):
+        """
+        Stores a finished simulation under key, aborted runs are ignored.
+        """
+        if getattr(sim, "aborted", False):
+            return
+        self.remember(key, sim)
+        if hasattr(sim, "solution"): # Not for Results
+            dimless = sim.dimless_key() # Hashes the waveform, O(nT)
+            self.solutions[dimless] = sim.solution()
+            self.solutions.move_to_end(dimless)
+            self.trim()
+        if self.path is not None and not os.path.exists(self.fileName(key)):
+            tmp = os.path.join(self.path, key + ".tmp.npz")
+            save_results(sim, tmp, compress=False)
+            os.replace(tmp, self.fileName(key)) # Never leaves a partial file
+            self.evict()
+
+    def remember(self, key, sim):
+        self.memory[key] = sim
+        self.memory.move_to_end(key)
+        self.trim()
+
+    def held(self): # bytes of the arrays kept in memory
+        return held_bytes(*[obj for sim in self.memory.values()
+                            for obj in (sim, getattr(sim, "mec", {}))],
+                          *self.solutions.values())
+
+    def trim(self): # Drops the least recently used runs beyond maxsize and memory_budget
+        for entries in (self.memory, self.solutions):
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        # A run and its solution share their arrays, so both are dropped.
+        # The newest ones are kept even if over budget:
+        while self.held() > self.memory_budget and max(len(self.memory), len(self.solutions)) > 1:
+            for entries in (self.memory, self.solutions):
+                if len(entries) > 1:
+                    entries.popitem(last=False)
+
+    def evict(self): # Deletes the least recently used files beyond budget
+        files = [os.path.join(self.path, f) for f in os.listdir(self.path)
+                 if f.endswith(".npz") and not f.endswith(".tmp.npz")]
+        files.sort(key=os.path.getmtime)
+        size = sum(os.path.getsize(f) for f in files)
+        for f in files[:-1]: # The newest file is kept even if over budget
+            if size <= self.budget:
+                break
+            fileSize = os.path.getsize(f)
+            # Results read back memory-map their file, which can only be
+            # deleted once they are dropped (Windows):
+            self.memory.pop(os.path.basename(f)[:-len(".npz")], None)
+            try:
+                os.remove(f)
+            except PermissionError: # Still mapped by a result in use, deleted later
+                continue
+            size -= fileSize
+
+    def clear(self):
+        self.memory.clear()
+        self.solutions.clear()
+        if self.path is not None:
+            for f in os.listdir(self.path):
+                if f.endswith(".npz"):
+                    os.remove(os.path.join(self.path, f))
+
+    def run(self, *args, progress=None, **kwargs):
+        """
+        Returns the results for the arguments of make_sim, from the cache,
+        rescaled from a run with the same dimensionless problem (e.g. other
+        area or concentration), or by running fd(progress).
+        """
+        key = run_key(*args, **kwargs)
+        sim = self.get(key)
+        if sim is None:
+            sim = make_sim(*args, **kwargs)
+            if not self.rescale(sim):
+                sim.fd(progress)
+            self.put(key, sim)
+        return sim
+
+    def rescale(self, sim):
+        """
+        Rescales a new simulation from a stored solution of the same
+        dimensionless problem. Returns False if there is none.
+        """
+        dimless = sim.dimless_key()
+        solution = self.solutions.get(dimless)
+        if solution is None:
+            return False
+        self.solutions.move_to_end(dimless)
+        sim.rescale(solution)
+        return True
+
+########## Validation:
+
+def randles_sevcik(n, Ageo, D, c, sr):
+    """
+    Returns the peak current (A) of a reversible CV,
+    0.4463*n*F*Ageo*c*sqrt(n*F*sr*D/(R*T)) (2.69e5*n^1.5*Ageo*c*sqrt(D*sr)
+    at 25 C), with D in cm2/s, c in mol/cm3 and sr in V/s.
+    """
+    return 0.4463*n*F*Ageo*c*np.sqrt(n*FRT*sr*D)
+
+def irreversible_peak(n, Ageo, D, c, sr, alpha):
+    """
+    Returns the peak current (A) of a totally irreversible CV,
+    0.4958*n*F*Ageo*c*sqrt(alpha*n*F*sr*D/(R*T)), alpha is the transfer
+    coefficient in the direction of the sweep.
+    """
+    return 0.4958*n*F*Ageo*c*np.sqrt(alpha*n*FRT*sr*D)
+
+def cottrell(t, n, Ageo, D, c):
+    """
+    Returns the current (A) at t (s) after a diffusion limited potential
+    step, n*F*Ageo*c*sqrt(D/(pi*t)).
+    """
+    return n*F*Ageo*c*np.sqrt(D/(np.pi*np.asarray(t)))
+
+def refinements(wf_params, solver="Explicit"):
+    """
+    Returns the default candidate discretisations of Convergence: dE (CV)
+    or dt (CA) from coarse to fine, lamb 0.45 and 0.2 (explicit) or 2 and
+    0.45 (implicit solvers) and both grids.
+    """
+    if wf_params[-1] == "CA":
+        steps = [("dt", wf_params[1]/n) for n in (100, 300, 1000, 3000, 10000, 30000)]
+    else:
+        steps = [("dE", dE) for dE in (0.01, 0.005, 0.002, 0.001, 5e-4, 2e-4)]
+    lambs = (0.45, 0.2) if solver == "Explicit" else (2, 0.45)
+    return [{key: value, "lamb": lamb, "grid": grid}
+            for key, value in steps for lamb in lambs for grid in ("Exp", "Equal")]
+
+class Convergence:
+    """
+
+    Runs a CV or a CA at progressively finer discretisations and compares
+    each run with its analytical limit, to find the cheapest discretisation
+    that meets a tolerance:
+
+    CV:     Randles-Sevcik peak if reversible (Matsuda-Ayabe Lambda >= 15),
+            irreversible peak for RO and OR kinetics or
+            Lambda <= 10^(-2(1+alpha)), on the first sweep
+    CA:     Cottrell (with the Nernst term for QR kinetics), largest error
+            for t >= ttot/10. The step must not be limited by the kinetics.
+
+    Only one of O and R can be in solution.
+
+    Parameters
+    ----------
+    wf_params:      [Eini, Efin, sr, dE, ns, "CV"] or [Es, ttot, dt, "CA"],
+                    dE or dt are replaced by those of the settings
+    mech_params:    [E0, n, DO, DR, cOb, cRb, ks, alpha, BV], or the parameters
+                    of an EC, CE, ECE or EC' mechanism (see make_mec, explicit
+                    solver only)
+    Ageo:           cm2, geometrical area
+    solver:         "Explicit", "Implicit" or "CN"
+    tol:            maximum relative error (0.01)
+    settings:       candidate discretisations, dicts with "dE" (CV) or "dt"
+                    (CA), "lamb" and "grid", see refinements (default)
+    backend:        "auto", "numba" or "numpy", for the explicit solver
+
+    Returns
+    -------
+    reference:  name of the analytical limit
+    rows:       after run, one dict per run with the setting, nT, nX, cost
+                (nT*nX), error and wall time (s)
+    best:       cheapest setting with an error <= tol, None if there is none
+
+    Examples
+    --------
+    >>> study = sp.Convergence([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params, tol=0.01)
+    >>> best = study.run()
+    >>> sim = sp.make_sim(**study.params(best))
+    """
+
+    def __init__(self, wf_params, mech_params, Ageo=1, solver="Explicit", tol=0.01,
+                 settings=None, backend="auto"):
+        if wf_params[-1] not in ("CV", "CA"):
+            raise ValueError("Convergence is only available for CV and CA")
+        self.wf_params = list(wf_params)
+        self.mech_params = list(mech_params)
+        self.Ageo = Ageo
+        self.solver = solver
+        self.tol = tol
+        self.backend = backend
+        self.rows = []
+        self.best = None
+
+        if mech_params[-1] in mechanisms:
+            raise ValueError("The analytical limits are only available for a single electron transfer")
+        E0, n, DO, DR, cOb, cRb, ks, alpha, BV = mech_params
+        if bool(cOb) == bool(cRb):
+            raise ValueError("The analytical limits need either O or R in solution, not both")
+        if cRb: # Oxidation of R
+            D, c, a, sgn = DR, cRb, 1 - alpha, 1
+        else: # Reduction of O
+            D, c, a, sgn = DO, cOb, alpha, -1
+        if (BV == "RO" and not cRb) or (BV == "OR" and not cOb):
+            raise ValueError("%s kinetics give no current with this species" %BV)
+
+        if wf_params[-1] == "CV":
+            sr = wf_params[2]
+            Lambda = ks/np.sqrt(D*n*FRT*sr)
+            if BV == "QR" and Lambda >= 15:
+                self.reference = "Randles-Sevcik"
+                self.expected = randles_sevcik(n, Ageo, D, c, sr)
+            elif BV != "QR" or Lambda <= 10**(-2*(1 + alpha)):
+                self.reference = "irreversible peak"
+                self.expected = irreversible_peak(n, Ageo, D, c, sr, a)
+            else:
+                raise ValueError("Quasi-reversible CV (Lambda = %.3g), there is "
+                                 "no analytical peak current" %Lambda)
+        else:
+            Es, ttot = wf_params[0], wf_params[1]
+            # Rate constant at Es in the direction of the step:
+            kf = ks*np.exp(a*n*FRT*sgn*(Es - E0))
+            if kf*np.sqrt(ttot/10/D) < 100:
+                raise ValueError("The step at %g V is limited by the kinetics, "
+                                 "there is no analytical current" %Es)
+            self.reference = "Cottrell"
+            nernst = 1
+            if BV == "QR": # Reversible, both directions
+                Dother = DO if cRb else DR
+                nernst = 1 + np.sqrt(D/Dother)*np.exp(-sgn*n*FRT*(Es - E0))
+            self.expected = lambda t: cottrell(t, n, Ageo, D, c)/nernst
+
+        # Cheapest first:
+        self.settings = settings if settings is not None else refinements(wf_params, solver)
+        self.costs = [self.cost(s) for s in self.settings]
+        order = np.argsort(self.costs, kind="stable")
+        self.settings = [self.settings[j] for j in order]
+        self.costs = [self.costs[j] for j in order]
+
+    def params(self, setting):
+        """
+        Returns the arguments of make_sim for a setting.
+        """
+        wf_params = list(self.wf_params)
+        if "dE" in setting:
+            wf_params[3] = setting["dE"]
+        if "dt" in setting:
+            wf_params[2] = setting["dt"]
+        return dict(wf_params=wf_params, mech_params=self.mech_params, Ageo=self.Ageo,
+                    solver=self.solver, lamb=setting.get("lamb", 0.45),
+                    grid=setting.get("grid", "Equal"), backend=self.backend)
+
+    def cost(self, setting): # nT*nX, without running
+        p = self.params(setting)
+        wf = make_wf(p["wf_params"])
+        space = (Exp_spc if p["grid"] == "Exp" else Equal_spc)(wf, p["lamb"])
+        return space.nT*space.nX
+
+    def error(self, sim):
+        """
+        Returns the relative error of a finished run against the reference.
+        """
+        if self.reference == "Cottrell":
+            k = np.nonzero(sim.t >= sim.t[-1]/10)[0]
+            expected = self.expected(sim.t[k])
+            return np.max(np.abs(np.abs(sim.i[k]) - expected)/expected)
+        peak = np.max(np.abs(sim.i[:sim.wf.nt])) # First sweep
+        return abs(peak - self.expected)/self.expected
+
+    def run(self, report=None, full=False):
+        """
+        Runs the settings from the cheapest until one meets tol (all of them
+        if full) and returns the best one. report(row) is called after each
+        run, returning True stops the study.
+        """
+        self.rows = []
+        self.best = None
+        for setting, cost in zip(self.settings, self.costs):
+            t0 = time.time()
+            sim = make_sim(snap="last", **self.params(setting))
+            sim.fd()
+            row = dict(setting=setting, nT=sim.space.nT, nX=sim.space.nX, cost=cost,
+                       error=float(self.error(sim)), time=time.time() - t0)
+            self.rows.append(row)
+            if row["error"] <= self.tol and self.best is None:
+                self.best = setting
+            if report is not None and report(row):
+                break
+            if self.best is not None and not full:
+                break
+        return self.best
 
 ########## Plots:
 
 class Plot_all:
 
     def __init__(self, sim):
+        import matplotlib.pyplot as plt
         plt.subplot(221)
         Plot(sim.t, sim.E, "$t$ / s", "$E$ / V")
         plt.subplot(222)
@@ -295,12 +3438,14 @@ class Plot_all:
 
 class Plot:
     def __init__(self, x, y, xlab, ylab, mark="-"):
+        import matplotlib.pyplot as plt
         plt.plot(x, y, mark)
         plt.xlabel(xlab, fontsize=18)
         plt.ylabel(ylab, fontsize=18)
         Plot_format()
 class Plot2:
     def __init__(self, x1, y1, x2, y2, xlab, ylab, lab1, lab2, mark1="-", mark2="-"):
+        import matplotlib.pyplot as plt
         plt.plot(x1, y1, mark1, label=lab1)
         plt.plot(x2, y2, mark2, label=lab2)
         plt.xlabel(xlab, fontsize=18)
@@ -310,6 +3455,7 @@ class Plot2:
 
 class Plot_format:
     def __init__(self):
+        import matplotlib.pyplot as plt
         plt.xticks(fontsize=14)
         plt.yticks(fontsize=14)
         plt.grid()
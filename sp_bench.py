@@ -0,0 +1,278 @@
+#!/usr/bin/python
+"""
+Benchmarks of the Soft Potato hot paths, compared against stored baselines.
+
+Each case times one operation of sp.py (waveform construction, Simulate.fd
+for the three kinetics and several grid sizes, denorm and the export paths)
+and records the best wall time of several repetitions and the peak memory
+allocated while building and running it (tracemalloc, which also counts
+NumPy arrays). The results are compared against an entry of
+bench_baseline.json, one entry per release, and cases slower or larger than
+the tolerances are flagged as regressions (exit status 1).
+
+Wall times are noisy, a case is only flagged as slower when the increase is
+beyond the tolerance and beyond the spread of the repetitions (slowest over
+best) of both the run and the baseline. The export cases, which depend on
+the disk, have a larger tolerance, and with fewer than 3 repetitions only
+the memory is compared.
+
+Baselines are only meaningful on the machine (and with the backend) they
+were recorded on, record one with --save before comparing.
+
+Usage:
+    python3 sp_bench.py [-k NAME] [-r REPEAT] [--save LABEL] [--against LABEL]
+                        [--baseline FILE] [--tolerance 0.25] [--mem-tolerance 0.1]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import sp
+import sp_kernels
+
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+mech_params = {
+    "QR": [0, 1, 1e-5, 1e-5, 0, 1e-6, 1e8, 0.5, "QR"],
+    "RO": [0, 1, 1e-5, 1e-5, 0, 1e-6, 1e-2, 0.5, "RO"],
+    "OR": [0, 1, 1e-5, 1e-5, 1e-6, 0, 1e-2, 0.5, "OR"],
+}
+
+# Registered cases, name: function that builds the inputs and returns the
+# function to time (setup is not timed but counts for the peak memory), and
+# the cases with their own time tolerance:
+cases = {}
+tolerances = {}
+
+def case(name, tolerance=None):
+    def register(fun):
+        cases[name] = fun
+        if tolerance is not None:
+            tolerances[name] = tolerance
+        return fun
+    return register
+
+
+########## Waveforms
+
+@case("wf_sweep")
+def wf_sweep(): # 20 cycles, 400 000 points
+    return lambda: sp.Sweep([-0.5, 0.5, 1, 1e-4, 40])
+
+@case("wf_step")
+def wf_step():
+    return lambda: sp.Step([0.5, 10, 1e-5])
+
+@case("wf_construct")
+def wf_construct():
+    def run():
+        wfs = [sp.Sweep([-0.5, 0.5, 1, 1e-4, 2]), sp.Step([0.5, 1, 1e-5]),
+               sp.Sweep([0.5, -0.5, 0.1, 1e-4, 2])]
+        return sp.Construct_wf(wfs)
+    return run
+
+
+########## Finite differences
+
+def fd_case(BV, dE, solver="Explicit", grid="Equal", backend="numba"):
+    def setup():
+        sim = sp.make_sim([-0.5, 0.5, 1, dE, 2, "CV"], mech_params[BV], solver=solver,
+                          grid=grid, snap="last", backend=backend)
+        return sim.fd
+    return setup
+
+for BV in ("QR", "RO", "OR"):
+    for nT in (1000, 4000, 16000):
+        case("fd_%s_%d" %(BV, nT))(fd_case(BV, 2/nT))
+case("fd_numpy_4000")(fd_case("QR", 2/4000, backend="numpy"))
+case("fd_CN_Exp_16000")(fd_case("QR", 2/16000, "CN", "Exp"))
+
+
+########## Denormalisation and export
+
+def finished(snap=20):
+    sim = sp.make_sim([-0.5, 0.5, 1, 1e-3, 2, "CV"], mech_params["QR"], snap=snap)
+    sim.fd()
+    return sim
+
+@case("denorm")
+def denorm(): # Including the first read of the scaled profiles
+    sim = finished(snap=1) # Every profile
+    def run():
+        sim.denorm()
+        return sim.cR, sim.cO
+    return run
+
+def export_case(fmt):
+    def setup():
+        import sp_cli
+        sim = finished()
+        folder = tempfile.mkdtemp()
+        def run():
+            try:
+                sp_cli.save(sim, os.path.join(folder, "bench"), fmt)
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+                os.makedirs(folder, exist_ok=True)
+        return run
+    return setup
+
+io_tolerance = 1.0 # Writing files depends on the disk and its cache
+
+case("export_txt", io_tolerance)(export_case("txt"))
+case("export_npz", io_tolerance)(export_case("npz"))
+try:
+    import h5py
+    case("export_h5", io_tolerance)(export_case("h5"))
+except ImportError:
+    pass
+
+
+########## Running and comparing
+
+def measure(setup, repeat=5):
+    """
+    Returns the best wall time (s) of repeat runs, their spread (slowest
+    over best, minus 1) and the peak memory (bytes) of setup and one run. A
+    first run, not timed, compiles the Numba kernels.
+    """
+    with contextlib.redirect_stdout(io.StringIO()): # E_mec prints the mechanism
+        return measure_quiet(setup, repeat)
+
+def measure_quiet(setup, repeat):
+    setup()()
+    times = []
+    for r in range(repeat):
+        run = setup()
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        setup()()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), max(times)/min(times) - 1, peak
+
+def environment():
+    return dict(date=time.strftime("%Y-%m-%d"), machine=platform.node(),
+                processor=platform.machine(), python=platform.python_version(),
+                numpy=np.__version__, backend=sp_kernels.select_backend("auto"))
+
+def load_baselines(fileName):
+    if not os.path.exists(fileName):
+        return {}
+    with open(fileName) as f:
+        return json.load(f)
+
+def compare(result, base, tolerance=0.25, memTolerance=0.1, floor=2e-3):
+    """
+    Returns the regression flags of a case: "time" if it is slower than the
+    baseline by more than tolerance, than the spread of the repetitions of
+    either (when known) and than floor s, "memory" if its peak is more than
+    memTolerance larger. Without a spread (fewer than 3 repetitions) the
+    time is not compared.
+    """
+    flags = []
+    if base is None:
+        return flags
+    spread = result.get("spread")
+    if spread is not None:
+        allowed = max(tolerance, spread, base.get("spread", 0))
+        if result["time"] > base["time"]*(1 + allowed) and result["time"] - base["time"] > floor:
+            flags.append("time")
+    if result["peak"] > base["peak"]*(1 + memTolerance):
+        flags.append("memory")
+    return flags
+
+def report(name, result, base, flags):
+    line = "%-16s %10.4f s %9.1f MB" %(name, result["time"], result["peak"]/2**20)
+    if base is not None:
+        line += "   %5.2fx time %5.2fx memory" %(result["time"]/base["time"],
+                                               result["peak"]/max(base["peak"], 1))
+    if flags:
+        line += "   REGRESSION (" + ", ".join(flags) + ")"
+    print(line)
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="sp_bench.py",
+            description="Benchmarks Soft Potato and compares against stored baselines.")
+    parser.add_argument("-k", "--select", help="only the cases whose name contains this")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+            help="timed repetitions of each case, the best one is kept (5)")
+    parser.add_argument("--baseline", default=baseline_file,
+            help="baselines file (bench_baseline.json)")
+    parser.add_argument("--against", help="baseline label to compare against, "
+            "defaults to the last one saved")
+    parser.add_argument("--save", metavar="LABEL", help="store the results as "
+            "the baseline LABEL (e.g. the release), replacing it if it exists")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+            help="allowed relative increase of the wall time (0.25, %g for the "
+                 "export cases)" %io_tolerance)
+    parser.add_argument("--mem-tolerance", type=float, default=0.1,
+            help="allowed relative increase of the peak memory (0.1)")
+    parser.add_argument("-l", "--list", action="store_true", help="list the cases")
+    args = parser.parse_args(argv)
+
+    names = [name for name in cases if not args.select or args.select in name]
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    baselines = load_baselines(args.baseline)
+    label = args.against or (list(baselines)[-1] if baselines else None)
+    if label is not None and label not in baselines:
+        parser.error("no baseline %s in %s" %(label, args.baseline))
+    baseline = baselines.get(label, {"cases": {}})
+    env = environment()
+    if label is not None:
+        print("Comparing against %s (%s, %s)" %(label, baseline.get("date"), baseline.get("machine")))
+        if baseline.get("machine") != env["machine"] or baseline.get("backend") != env["backend"]:
+            print("Warning: the baseline was recorded on %s with the %s backend"
+                  %(baseline.get("machine"), baseline.get("backend")))
+
+    if label is not None and args.repeat < 3:
+        print("Fewer than 3 repetitions, only the memory is compared")
+
+    results = {}
+    regressions = []
+    for name in names:
+        t, spread, peak = measure(cases[name], args.repeat)
+        results[name] = dict(time=t, peak=peak)
+        if args.repeat >= 3:
+            results[name]["spread"] = spread
+        base = baseline["cases"].get(name)
+        flags = compare(results[name], base, tolerances.get(name, args.tolerance),
+                        args.mem_tolerance)
+        report(name, results[name], base, flags)
+        if flags:
+            regressions.append(name)
+
+    if args.save:
+        baselines[args.save] = dict(env, cases=dict(baseline["cases"] if args.save == label
+                                                    else {}, **results))
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=1)
+        print("Saved as %s in %s" %(args.save, args.baseline))
+    if regressions:
+        print("%d regressions: %s" %(len(regressions), ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
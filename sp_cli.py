@@ -0,0 +1,199 @@
+#!/usr/bin/python
+"""
+Headless command line interface for Soft Potato.
+
+Runs the simulations described in JSON or TOML files and saves the results,
+without importing Qt or matplotlib. A run description has the same fields
+as the GUI, all of them optional:
+
+    {
+        "wf_params": [-0.5, 0.5, 1, 0.01, 2, "CV"],
+        "mech_params": [0, 1, 1e-5, 1e-5, 0, 1e-6, 1e8, 0.5, "QR"],
+        "Ageo": 1,
+        "solver": "Explicit",
+        "lamb": 0.45,
+        "grid": "Exp",
+        "tgrid": "lin",
+        "snap": "last",
+        "backend": "auto",
+        "dtype": "float64",
+        "steady": null,
+        "output": "results"
+    }
+
+Usage:
+    python3 sp_cli.py run.json [run2.toml ...] [-o OUTPUT] [-f {txt,npz,h5}] [-p] [-s] [-c TOL] [-t] [-T] [-n] [-d]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+import numpy as np
+
+import sp
+
+header_save = "# Data simulated with Soft Potato 2.0, for more information visit https://oliverrdz.xyz/soft-potato\n"
+
+# Defaults of the GUI:
+defaults = {
+    "wf_params": [-0.5, 0.5, 1, 0.01, 2, "CV"],
+    "mech_params": [0, 1, 1e-5, 1e-5, 0, 1e-6, 1e8, 0.5, "QR"],
+    "Ageo": 1,
+    "solver": "Explicit",
+    "lamb": 0.45,
+    "grid": "Exp",
+    "tgrid": "lin",
+    "snap": None,
+    "backend": "auto",
+    "dtype": "float64",
+    "steady": None,
+}
+
+
+def load(fileName):
+    """
+    Returns the run description in fileName (.toml or JSON) with the missing
+    fields set to their defaults.
+    """
+    if fileName.endswith(".toml"):
+        import tomllib # Python >= 3.11
+        with open(fileName, "rb") as f:
+            run = tomllib.load(f)
+    else:
+        with open(fileName) as f:
+            run = json.load(f)
+    unknown = set(run) - set(defaults) - {"output"}
+    if unknown:
+        raise ValueError("Unknown fields in %s: %s" %(fileName, ", ".join(sorted(unknown))))
+    return dict(defaults, **run)
+
+
+def save(sim, fileName, fmt="txt"):
+    """
+    Saves the results as the Save all dialog of the GUI (fileName_tEi.txt,
+    fileName_[O].txt, fileName_[R].txt and fileName_x.txt) or as a single
+    fileName.npz or fileName.h5, see sp.save_results.
+    """
+    if fmt in ("npz", "h5"):
+        sp.save_results(sim, fileName + "." + fmt)
+        return
+
+    header = header_save + "# t/s, E/V, i/A"
+    if getattr(sim, "tSteady", None) is not None:
+        header += "\n# Steady state at t = %g s, the later values are held" %sim.tSteady
+    data = np.array([sim.t, sim.E, sim.i]).T
+    np.savetxt(fileName + "_tEi.txt", data, delimiter=",", header=header)
+
+    header = header_save + "# [O] / mol cm^-3"
+    np.savetxt(fileName + "_[O].txt", sim.cO.T, delimiter=",", header=header)
+
+    header = header_save + "# [R] / mol cm^-3"
+    np.savetxt(fileName + "_[R].txt", sim.cR.T, delimiter=",", header=header)
+
+    header = header_save + "# x / cm"
+    np.savetxt(fileName + "_x.txt", sim.x, delimiter=",", header=header)
+
+
+def report(k, nT, elapsed, eta):
+    sys.stderr.write("%d/%d time steps, %.1f s elapsed, %.1f s left\n" %(k, nT, elapsed, eta))
+
+
+def converge(run, tol, backend="auto"):
+    """
+    Returns run with the coarsest dE (or dt), lamb and grid within tol of the
+    analytical limit, see sp.Convergence. Raises ValueError if none is.
+    """
+    study = sp.Convergence(run["wf_params"], run["mech_params"], run["Ageo"],
+                           run["solver"], tol, backend=backend)
+    def report(row):
+        sys.stderr.write("%s: %.2f %% error against %s (%d x %d)\n" %(row["setting"],
+                         100*row["error"], study.reference, row["nT"], row["nX"]))
+    best = study.run(report)
+    if best is None:
+        raise ValueError("No discretisation is within %g of %s" %(tol, study.reference))
+    params = study.params(best)
+    return dict(run, wf_params=params["wf_params"], lamb=params["lamb"], grid=params["grid"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="sp_cli.py",
+            description="Runs Soft Potato simulations without a display.")
+    parser.add_argument("runs", nargs="+", help="run descriptions, .json or .toml")
+    parser.add_argument("-o", "--output", help="output file name (without "
+            "extension), only for a single run. Defaults to the output field "
+            "of the run or the name of the run file")
+    parser.add_argument("-f", "--format", choices=["txt", "npz", "h5"], default="txt",
+            help="text files as the GUI (default) or a single compressed "
+            ".npz or .h5 (needs h5py) file with the run parameters")
+    parser.add_argument("-p", "--progress", action="store_true",
+            help="report the progress on stderr every second")
+    parser.add_argument("-s", "--stream", action="store_true",
+            help="write the profiles to the .npz or .h5 file during the run, "
+            "for runs that do not fit in memory (every time step unless snap is set)")
+    parser.add_argument("-c", "--converge", type=float, metavar="TOL",
+            help="run with the coarsest dE (dt for CA), lamb and grid whose "
+            "current is within TOL (relative) of the analytical limit")
+    parser.add_argument("-t", "--timings", action="store_true",
+            help="print the time spent in each phase of the run on stderr")
+    parser.add_argument("-T", "--trace", action="store_true",
+            help="save the phases as a Chrome trace, OUTPUT_trace.json "
+            "(chrome://tracing or https://ui.perfetto.dev)")
+    parser.add_argument("-n", "--estimate", action="store_true",
+            help="only print the grid size, peak memory and run time of each "
+            "run, without running it")
+    parser.add_argument("-d", "--deviation", action="store_true",
+            help="for float32 runs, run the float64 reference and print the "
+            "deviation of the current and last profiles")
+    args = parser.parse_args(argv)
+
+    if args.output and len(args.runs) > 1:
+        parser.error("--output can only be used with a single run")
+    if args.stream and args.format == "txt":
+        parser.error("--stream needs --format npz or h5")
+
+    for fileName in args.runs:
+        run = load(fileName)
+        output = args.output or run.get("output") or os.path.splitext(fileName)[0]
+        if args.converge:
+            run = converge(run, args.converge, run["backend"])
+        if args.stream and run["snap"] is None and run["wf_params"][-1] not in ("DPV", "SWV"):
+            run["snap"] = 1 # Rolling storage, sampled waveforms store their samples
+        if args.estimate:
+            est = sp.Estimate(run["wf_params"], run["mech_params"], run["Ageo"],
+                              run["solver"], run["lamb"], run["grid"], run["tgrid"],
+                              run["snap"], run["backend"], run["dtype"], run["steady"])
+            available = sp.available_memory()
+            print("%s: %s%s" %(fileName, est.summary(), "" if available is None
+                  else " (%s available)" %sp.format_bytes(available)))
+            continue
+        sim = sp.make_sim(run["wf_params"], run["mech_params"], run["Ageo"],
+                          run["solver"], run["lamb"], run["grid"], run["tgrid"],
+                          run["snap"], run["backend"], run["dtype"], run["steady"])
+        if args.timings or args.trace:
+            sim.timings = sp.Timings(trace=args.trace)
+        progress = sp.Progress(report, interval=1) if args.progress else None
+        if args.stream:
+            sim.fd(progress, sp.Profile_sink(output + "." + args.format))
+        else:
+            sim.fd(progress)
+            with sim.timings.phase("export") if sim.timings else contextlib.nullcontext():
+                save(sim, output, args.format)
+        if sim.tSteady is not None:
+            sys.stderr.write("%s: steady state at %g s, the rest of the run is held\n"
+                             %(fileName, sim.tSteady))
+        if args.deviation and sim.mec.dtype != np.float64:
+            dev = sim.deviation()
+            sys.stderr.write("%s: deviation from float64, i %.2g, cR %.2g, cO %.2g\n"
+                             %(fileName, dev["i"], dev["cR"], dev["cO"]))
+        if args.timings:
+            sys.stderr.write(sim.timings.table() + "\n")
+        if args.trace:
+            sim.timings.save_trace(output + "_trace.json")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+"""
+Compiled finite-difference kernels for sp.Simulate.
+
+The kernels are plain Python loops compiled with Numba when it is
+installed. Simulate only uses them through select_backend, which falls back
+to the NumPy implementation in sp.py when Numba is missing.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Kinetics codes used by the kernels:
+kinetics = {"QR": 0, "RO": 1, "OR": 2}
+
+
+def explicit_block(CR, CO, I, eps, kOff, k0, k1, nRows, uniform, lamb, lambL, lambR,
+                   r, kind, dX, K0, alpha, DOR, w0, w1, w2, sgn, useR):
+    """
+    Runs the explicit time steps k0 <= k < k1 of Simulate.fd in place: the
+    Butler-Volmer boundary (Simulate.bc), the interior stencil of both
+    species and the normalised current I[k-kOff] (eps[k-kOff] is the
+    potential of step k). Row k is k % nRows of CR and CO, r is the time
+    step ratio (empty for equally spaced time). The stencil runs in the
+    precision of lamb, lambL, lambR and r, which should be that of CR and CO.
+    """
+    nX = CR.shape[1]
+    varying = r.shape[0] > 0
+    for k in range(k0, k1):
+        a = (k-1)%nRows
+        b = k%nRows
+
+        # Boundary condition, Butler-Volmer:
+        e = eps[k-kOff]
+        R1 = CR[a,1]
+        O1 = CO[a,1]
+        if kind == 0: # O <-> R
+            R0 = (R1 + dX*K0*np.exp(-alpha*e)*(O1 + R1/DOR))/(
+                  1 + dX*K0*(np.exp((1-alpha)*e) + np.exp(-alpha*e)/DOR))
+            O0 = O1 + (R1 - R0)/DOR
+        elif kind == 1: # R -> O
+            R0 = R1/(1 + dX*K0*np.exp((1-alpha)*e))
+            O0 = O1 + (R1 - R0)/DOR
+        else: # O -> R
+            O0 = O1/(1 + dX*K0*np.exp((-alpha)*e))
+            R0 = R1 + (O1 - O0)/DOR
+        CR[b,0] = R0
+        CO[b,0] = O0
+
+        # Interior nodes:
+        if uniform:
+            l = lamb*r[k] if varying else lamb
+            for i in range(1, nX-1):
+                CR[b,i] = CR[a,i] + l*(CR[a,i+1] - 2*CR[a,i] + CR[a,i-1])
+                CO[b,i] = CO[a,i] + l*(CO[a,i+1] - 2*CO[a,i] + CO[a,i-1])
+        else:
+            for i in range(1, nX-1):
+                lL = lambL[i-1]*r[k] if varying else lambL[i-1]
+                lR = lambR[i-1]*r[k] if varying else lambR[i-1]
+                CR[b,i] = CR[a,i] + lL*(CR[a,i-1] - CR[a,i]) + lR*(CR[a,i+1] - CR[a,i])
+                CO[b,i] = CO[a,i] + lL*(CO[a,i-1] - CO[a,i]) + lR*(CO[a,i+1] - CO[a,i])
+
+        # Normalised current:
+        if useR:
+            I[k-kOff] = sgn*(w2*CR[b,2] + w1*CR[b,1] + w0*CR[b,0])
+        else:
+            I[k-kOff] = sgn*(w2*CO[b,2] + w1*CO[b,1] + w0*CO[b,0])
+
+
+if numba is not None:
+    explicit_block = numba.njit(cache=True)(explicit_block)
+
+
+def select_backend(backend="auto"):
+    """
+    Returns the backend actually used for the requested one: "numba" if it
+    was requested (or "auto") and Numba is installed, "numpy" otherwise.
+    """
+    if backend not in ("auto", "numba", "numpy"):
+        raise ValueError("Unknown backend: " + str(backend))
+    if backend == "numpy" or numba is None:
+        if backend == "numba":
+            import warnings
+            warnings.warn("Numba is not installed, using the numpy backend")
+        return "numpy"
+    return "numba"
@@ -0,0 +1,518 @@
+import sys
+
+import numpy as np
+import pytest
+
+import sp
+
+# Reversible, only R in solution (the GUI defaults):
+mech_params = [0, 1, 1e-5, 1e-5, 0, 1e-6, 1e8, 0.5, "QR"]
+
+
+@pytest.mark.parametrize("solver", ["Explicit", "CN"])
+def test_randles_sevcik(solver):
+    sim = sp.make_sim([-0.5, 0.5, 1, 0.001, 1, "CV"], mech_params, solver=solver,
+                      grid="Exp", snap="last")
+    sim.fd()
+    expected = sp.randles_sevcik(1, 1, 1e-5, 1e-6, 1)
+    assert abs(np.max(sim.i) - expected)/expected < 0.0015
+
+
+@pytest.mark.parametrize("solver, tgrid", [("Explicit", "lin"), ("CN", "log")])
+def test_cottrell(solver, tgrid):
+    wf_params = [0.5, 1, 1e-4, "CA"]
+    sim = sp.make_sim(wf_params, mech_params, solver=solver, grid="Exp", tgrid=tgrid,
+                      snap="last")
+    sim.fd()
+    study = sp.Convergence(wf_params, mech_params, solver=solver)
+    assert study.reference == "Cottrell"
+    assert study.error(sim) < 0.004 # For t >= ttot/10
+
+
+@pytest.mark.parametrize("solver, theta", [("Explicit", None), ("CN", 0.5)])
+def test_batch_matches_single(solver, theta):
+    wf_params = [[-0.5, 0.5, sr, 0.01, 2, "CV"] for sr in (0.1, 1)]
+    batch = sp.Simulate_batch(wf_params, mech_params, theta=theta)
+    batch.fd()
+    for b, wf_p in enumerate(wf_params):
+        sim = sp.make_sim(wf_p, mech_params, solver=solver, snap="last")
+        sim.fd()
+        assert np.allclose(batch.i[b], sim.i, rtol=1e-12, atol=1e-12*np.max(np.abs(sim.i)))
+
+
+def test_pool_matches_single():
+    wf_params = [[-0.5, 0.5, 1, dE, 2, "CV"] for dE in (0.01, 0.005)]
+    results = sp.Simulate_pool(wf_params, mech_params, workers=1).run()
+    for res, wf_p in zip(results, wf_params):
+        assert res.error is None
+        sim = sp.make_sim(wf_p, mech_params, snap="last")
+        sim.fd()
+        assert np.array_equal(res.i, sim.i)
+        assert np.array_equal(res.cR, sim.cR)
+
+
+def test_thomas_matches_lapack(monkeypatch):
+    pytest.importorskip("scipy")
+    rng = np.random.default_rng(0)
+    n = 50
+    dl, du = -rng.random(n-1), -rng.random(n-1)
+    d = 3 + rng.random(n) # Diagonally dominant, as the solvers' matrices
+    b = rng.random([n, 2])
+    lapack = sp.Tridiag(dl, d, du)
+    monkeypatch.setitem(sys.modules, "scipy.linalg.lapack", None) # ImportError
+    thomas = sp.Tridiag(dl, d, du)
+    assert lapack.gttrs is not None and thomas.gttrs is None
+    A = np.diag(d) + np.diag(dl, -1) + np.diag(du, 1)
+    for rhs in (b, b[:,0]):
+        assert np.allclose(thomas.solve(rhs), lapack.solve(rhs), rtol=1e-13, atol=1e-15)
+        assert np.allclose(thomas.solve(rhs), np.linalg.solve(A, rhs), rtol=1e-13, atol=1e-15)
+
+
+def test_exp_spc():
+    wf = sp.make_wf([-0.5, 0.5, 1, 0.001, 1, "CV"])
+    space = sp.Exp_spc(wf, lamb=0.45, gamma=1.1)
+    h = np.diff(space.X)
+    assert not space.uniform
+    assert space.X[0] == 0 and np.isclose(h[0], np.sqrt(1/space.nT/0.45))
+    assert np.allclose(h[1:]/h[:-1], 1.1)
+    assert space.X[-2] < 6 <= space.X[-1]
+    assert space.nX < sp.Equal_spc(wf, 0.45).nX/50
+
+
+def test_convergence_cv():
+    study = sp.Convergence([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params, tol=0.01)
+    assert study.reference == "Randles-Sevcik"
+    assert study.costs == sorted(study.costs)
+    best = study.run()
+    # The default CV meets 1 % on the expanding grid:
+    assert best == {"dE": 0.01, "lamb": 0.45, "grid": "Exp"}
+    assert study.rows[-1]["error"] <= 0.01
+
+
+def test_convergence_needs_one_species():
+    with pytest.raises(ValueError):
+        sp.Convergence([-0.5, 0.5, 1, 0.01, 2, "CV"], [0, 1, 1e-5, 1e-5, 1e-6, 1e-6, 1e8, 0.5, "QR"])
+
+
+def test_snapshot_steps():
+    t = np.linspace(0, 1, 11)
+    assert list(sp.snapshot_steps(t)) == list(range(11))
+    assert list(sp.snapshot_steps(t, 4)) == [0, 4, 8, 10]
+    assert list(sp.snapshot_steps(t, "last")) == [10]
+    assert list(sp.snapshot_steps(t, [0.52, 0.1, 0.5])) == [1, 5]
+    for snap in (0, -2, 1.5):
+        with pytest.raises(ValueError):
+            sp.snapshot_steps(t, snap)
+    with pytest.raises(ValueError):
+        sp.make_sim([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params, snap=0)
+    with pytest.raises(ValueError):
+        sp.Estimate([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params, snap=0, timed=False)
+
+
+def test_rolling_storage_matches_full_history():
+    wf_params = [-0.5, 0.5, 1, 0.01, 2, "CV"]
+    full = sp.make_sim(wf_params, mech_params)
+    full.fd()
+    for snap in (7, "last", [0.1, 0.5]):
+        sim = sp.make_sim(wf_params, mech_params, snap=snap)
+        sim.fd()
+        kSnap = sp.snapshot_steps(sim.wf.t, snap)
+        assert np.array_equal(sim.i, full.i)
+        assert np.array_equal(sim.tSnap, full.t[kSnap])
+        assert np.array_equal(sim.cR, full.cR[kSnap])
+        assert np.array_equal(sim.cO, full.cO[kSnap])
+
+
+def test_current_from_profiles():
+    sim = sp.make_sim([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params)
+    sim.fd()
+    assert sim._cR is None # Scaled on first access
+    CR = sim.mec.CRs # Full history, normalised
+    I = -(3*CR[:,0] - 4*CR[:,1] + CR[:,2])
+    assert np.allclose(sim.i, sim.scale_current(I), rtol=0, atol=1e-12*np.max(np.abs(sim.i)))
+    assert np.allclose(sim.cR, CR*1e-6, rtol=1e-12, atol=0)
+
+
+def test_log_time_grid():
+    wf = sp.Step([0.5, 100, 1e-6, "CA"], tgrid="log")
+    dt = np.diff(wf.t)
+    assert wf.t[0] == 0 and wf.t[-1] == 100 and wf.nT < 400
+    assert np.isclose(dt[0], 1e-6) and np.allclose(dt[1:-1]/dt[:-2], 1.05)
+    # The growing steps are only stable with the implicit solvers:
+    with pytest.raises(ValueError):
+        sp.make_sim([0.5, 1, 1e-4, "CA"], mech_params, tgrid="log")
+
+
+def test_cli(tmp_path):
+    import json
+    import sp_cli
+    run = dict(wf_params=[-0.5, 0.5, 1, 0.01, 2, "CV"], grid="Equal", snap="last")
+    fileName = str(tmp_path/"run.json")
+    with open(fileName, "w") as f:
+        json.dump(run, f)
+    assert sp_cli.main([fileName, "-f", "npz"]) == 0
+    assert sp_cli.main([fileName, "-o", str(tmp_path/"text")]) == 0
+    res = sp.load_results(str(tmp_path/"run.npz"))
+    sim = sp.make_sim(run["wf_params"], mech_params, snap="last")
+    sim.fd()
+    assert np.array_equal(res.i, sim.i) and np.array_equal(res.cR, sim.cR)
+    tEi = np.loadtxt(str(tmp_path/"text_tEi.txt"), delimiter=",")
+    assert np.allclose(tEi[:,2], sim.i, rtol=1e-15, atol=0)
+    with open(fileName, "w") as f:
+        json.dump(dict(run, scanrate=1), f)
+    with pytest.raises(ValueError):
+        sp_cli.main([fileName])
+
+
+def test_explicit_backend():
+    assert sp.explicit_backend("auto", 1000, 100) == "numpy"
+    assert sp.explicit_backend("numpy", 10**9, 10**5) == "numpy"
+    with pytest.raises(ValueError):
+        sp.explicit_backend("cuda", 1000, 100)
+
+
+@pytest.mark.parametrize("grid, snap, dtype, tol", [("Equal", None, "float64", 1e-13),
+                                                    ("Exp", 5, "float64", 1e-13),
+                                                    ("Equal", "last", "float32", 1e-5)])
+def test_numba_matches_numpy(grid, snap, dtype, tol):
+    # Same to rounding, relative to the peak current and bulk concentration
+    pytest.importorskip("numba")
+    results = []
+    for backend in ("numba", "numpy"):
+        sim = sp.make_sim([-0.5, 0.5, 1, 0.005, 2, "CV"], mech_params, grid=grid, snap=snap,
+                          backend=backend, dtype=dtype)
+        sim.fd()
+        assert sim.backend == backend
+        results.append(sim)
+    numba, numpy = results
+    assert np.max(np.abs(numba.i - numpy.i)) <= tol*np.max(np.abs(numpy.i))
+    assert np.max(np.abs(numba.cR - numpy.cR)) <= tol*1e-6
+    assert np.max(np.abs(numba.cO - numpy.cO)) <= tol*1e-6
+
+
+def main_window(monkeypatch): # Offscreen GUI with an empty cache
+    pytest.importorskip("pyqtgraph")
+    QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+    import os
+    monkeypatch.setenv("QT_QPA_PLATFORM", "offscreen")
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__))) # The .ui files
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    import SoftPotato
+    monkeypatch.setattr(SoftPotato, "cache", sp.Sim_cache())
+    return app, SoftPotato, SoftPotato.MainWindow()
+
+
+def test_gui_queue(monkeypatch):
+    # Runs queued while one is running start in turn, the last one is shown
+    import time
+    app, SoftPotato, window = main_window(monkeypatch)
+    for dE in (0.002, 0.004, 0.005):
+        monkeypatch.setattr(SoftPotato, "wf_params", [-0.5, 0.5, 1, dE, 2, "CV"])
+        window.simulate()
+    assert len(window.queue) == 2
+    t0 = time.perf_counter()
+    while (window.queue or window.thread.isRunning()) and time.perf_counter() - t0 < 60:
+        app.processEvents()
+        time.sleep(0.01)
+    app.processEvents()
+    assert window.sim.params["wf_params"][3] == 0.005
+    assert len(window.sim.i) == 400 and len(SoftPotato.cache.memory) == 3
+    window.close()
+
+
+def test_progress_abort():
+    wf_params = [-0.5, 0.5, 1, 0.005, 2, "CV"]
+    full = sp.make_sim(wf_params, mech_params, snap=10)
+    full.fd()
+    calls = []
+    def report(k, nT, elapsed, eta):
+        calls.append(k)
+        return k >= nT//2
+    sim = sp.make_sim(wf_params, mech_params, snap=10)
+    sim.fd(sp.Progress(report, interval=0, every=50))
+    n = sim.nDone
+    assert sim.aborted and n == calls[-1] and n < sim.space.nT
+    # The steps done are those of the full run, the rest is left empty:
+    assert np.array_equal(sim.i[:n], full.i[:n]) and not np.any(sim.i[n:])
+    m = np.searchsorted(sim.tSnap, sim.t[n-1], side="right")
+    assert np.array_equal(sim.cR[:m], full.cR[:m])
+
+
+def test_gui_scrub(monkeypatch):
+    # Moving the slider updates the same curves with the data up to n
+    app, SoftPotato, window = main_window(monkeypatch)
+    sim = sp.make_sim([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params, snap=10)
+    sim.fd()
+    window.finished(sim)
+    curves = (window.curve_tE, window.curve_Ei, window.curve_ti, window.curve_R)
+    for n in (37, 150):
+        window.plot(sim, n)
+        assert curves == (window.curve_tE, window.curve_Ei, window.curve_ti, window.curve_R)
+        x, y = window.curve_Ei.getData()
+        assert np.array_equal(x, sim.E[:n]) and np.array_equal(y, sim.i[:n])
+        assert np.array_equal(window.curve_R.getData()[1], sim.cR[sim.profile(n)])
+        assert sim.tSnap[sim.profile(n)] <= sim.t[n] < sim.tSnap[sim.profile(n)] + 10*sim.wf.t[1]
+    window.close()
+
+
+def finished_run(**kwargs): # A short CV, as make_sim
+    sim = sp.make_sim([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params, **kwargs)
+    sim.fd()
+    return sim
+
+
+def same_results(res, sim):
+    for name in ("t", "E", "i", "x", "tSnap", "cR", "cO"):
+        assert np.array_equal(np.asarray(getattr(res, name)), np.asarray(getattr(sim, name))), name
+
+
+@pytest.mark.parametrize("fileName, compress", [("run.npz", True), ("run.npz", False),
+                                                ("run.h5", True)])
+def test_results_round_trip(tmp_path, fileName, compress):
+    if fileName.endswith(".h5"):
+        pytest.importorskip("h5py")
+    sim = finished_run(snap=5, solver="CN")
+    fileName = str(tmp_path/fileName)
+    sp.save_results(sim, fileName, compress=compress)
+    res = sp.load_results(fileName)
+    same_results(res, sim)
+    assert res.params["solver"] == "CN" and res.params["snap"] == 5
+    assert res.profile(-1) == sim.profile(-1)
+    if fileName.endswith(".npz") and not compress:
+        assert isinstance(res.cR, np.memmap)
+
+
+@pytest.mark.parametrize("fileName", ["run.npz", "run.h5"])
+def test_profile_sink(tmp_path, fileName):
+    if fileName.endswith(".h5"):
+        pytest.importorskip("h5py")
+    sim = finished_run(snap=3)
+    streamed = sp.make_sim([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params, snap=3)
+    fileName = str(tmp_path/fileName)
+    streamed.fd(sink=sp.Profile_sink(fileName))
+    same_results(streamed, sim) # Read from the file
+    same_results(sp.load_results(fileName), sim)
+    assert not isinstance(streamed.cR, np.ndarray) or isinstance(streamed.cR, np.memmap)
+    with pytest.raises(ValueError): # The full history has no schedule to stream
+        finished_run().fd(sink=sp.Profile_sink(str(tmp_path/"full.npz")))
+
+
+def test_npz_rows(tmp_path):
+    # Deflated profiles are read a few rows at a time
+    sim = finished_run(snap=3)
+    fileName = str(tmp_path/"run.npz")
+    sp.save_results(sim, fileName, compress=True)
+    res = sp.load_results(fileName)
+    assert isinstance(res.cR, sp.Npz_rows) and len(res.cR) == len(sim.cR)
+    for key in (-1, 5, slice(2, 9, 3), (slice(None), 0)):
+        assert np.array_equal(res.cR[key], sim.cR[key])
+
+
+def test_cache(tmp_path):
+    cache = sp.Sim_cache(path=str(tmp_path))
+    wf_params = [-0.5, 0.5, 1, 0.01, 2, "CV"]
+    sim = cache.run(wf_params, mech_params, snap=5)
+    assert cache.run(wf_params, mech_params, snap=5) is sim # Memory tier
+    cache.memory.clear()
+    res = cache.run(wf_params, mech_params, snap=5) # Disk tier
+    assert isinstance(res, sp.Result) and isinstance(res.cR, np.memmap)
+    same_results(res, sim)
+    assert cache.run(wf_params, mech_params, snap="last") is not res # Other key
+
+
+def test_cache_budgets(tmp_path):
+    sims = [finished_run(snap=1) for i in range(3)]
+    cache = sp.Sim_cache(memory_budget=2.5*sp.held_bytes(sims[0], sims[0].mec))
+    for j, sim in enumerate(sims):
+        cache.put(str(j), sim)
+    assert list(cache.memory) == ["1", "2"] and cache.held() <= cache.memory_budget
+    cache = sp.Sim_cache(path=str(tmp_path), budget=1) # Only the newest file is kept
+    old = sp.run_key([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params)
+    cache.run([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params)
+    cache.memory.clear()
+    assert isinstance(cache.get(old).cR, np.memmap)
+    key = sp.run_key([-0.5, 0.5, 1, 0.02, 2, "CV"], mech_params)
+    cache.run([-0.5, 0.5, 1, 0.02, 2, "CV"], mech_params)
+    # The memory-mapped result is dropped with its file:
+    assert old not in cache.memory
+    assert [f.name for f in tmp_path.iterdir()] == [key + ".npz"]
+
+
+def test_rescale_matches_direct_run():
+    cache = sp.Sim_cache()
+    wf_params = [-0.5, 0.5, 1, 0.01, 2, "CV"]
+    cache.run(wf_params, mech_params, snap=5)
+    # Other area, concentration and D at the same normalised ks:
+    other = [0, 1, 2e-5, 2e-5, 0, 3e-6, np.sqrt(2)*1e8, 0.5, "QR"]
+    sim = sp.make_sim(wf_params, other, 2, snap=5)
+    assert cache.rescale(sim)
+    direct = sp.make_sim(wf_params, other, 2, snap=5)
+    direct.fd()
+    assert direct.dimless_key() == sim.dimless_key()
+    for name in ("i", "x", "cR", "cO"):
+        a, b = getattr(sim, name), getattr(direct, name)
+        assert np.allclose(a, b, rtol=1e-12, atol=1e-12*np.max(np.abs(b))), name
+    changed = sp.make_sim(wf_params, [0, 1, 2e-5, 2e-5, 0, 3e-6, 1e-3, 0.5, "QR"], snap=5)
+    assert changed.dimless_key() != sim.dimless_key() and not cache.rescale(changed)
+
+
+def test_lazy_waveforms():
+    pieces = lambda lazy: [sp.Sweep([-0.5, 0.5, 1, 0.01, 2], lazy=lazy),
+                           sp.Step([0.2, 0.3, 1e-3], "log", lazy=lazy)]
+    for lazy, eager in zip(pieces(True) + [sp.Construct_wf(pieces(True), lazy=True)],
+                           pieces(False) + [sp.Construct_wf(pieces(False))]):
+        assert isinstance(lazy.t, sp.Lazy_array) and len(lazy.E) == len(eager.E)
+        assert np.array_equal(np.asarray(lazy.t), eager.t)
+        assert np.array_equal(np.asarray(lazy.E), eager.E)
+        for k in (0, -1, slice(3, 50, 7), np.array([1, 4, 2])):
+            assert np.array_equal(lazy.E[k], eager.E[k])
+        with pytest.raises(IndexError):
+            lazy.E[len(eager.E)]
+    # A run reads the lazy waveform in blocks:
+    runs = []
+    for wf in (sp.Sweep([-0.5, 0.5, 1, 0.01, 2], lazy=True), sp.Sweep([-0.5, 0.5, 1, 0.01, 2])):
+        space = sp.Equal_spc(wf)
+        sim = sp.Simulate(wf, space, sp.E_mec(wf, space, mech_params, "last"), verbose=False)
+        sim.fd()
+        runs.append(sim)
+    assert np.array_equal(runs[0].i, runs[1].i) and np.array_equal(runs[0].cR, runs[1].cR)
+
+
+@pytest.mark.parametrize("wf_params", [[-0.2, 0.2, 0.01, 0.05, 0.01, 0.05, 1e-3, "DPV"],
+                                       [-0.2, 0.2, 0.01, 0.025, 10, 1e-3, "SWV"]])
+def test_sampled_current(wf_params):
+    sim = sp.make_sim(wf_params, mech_params, grid="Exp")
+    sim.fd()
+    # The same run keeping the current of every time step:
+    wf = sp.make_wf(wf_params)
+    kSample = wf.kSample
+    wf.kSample = None
+    space = sp.Exp_spc(wf)
+    full = sp.Simulate(wf, space, sp.E_mec(wf, space, mech_params, "last"), verbose=False)
+    full.fd()
+    assert np.array_equal(sim.i, full.i[kSample])
+    assert np.array_equal(sim.t, full.t[kSample]) and np.array_equal(sim.tSnap, sim.t)
+    assert np.array_equal(sim.cR[-1], full.cR[-1]) # Profiles stored at the samples
+    Eb, di = sim.wf.net(sim.i)
+    assert len(Eb) == len(di) == len(kSample)//2
+
+
+def test_gui_pulse_grid(monkeypatch):
+    # Pulse runs use the expanding grid without changing the CV/CA setting
+    app, SoftPotato, window = main_window(monkeypatch)
+    monkeypatch.setattr(SoftPotato, "grid", "Equal")
+    monkeypatch.setattr(SoftPotato, "wf_params", SoftPotato.wf_params)
+    dialog = SoftPotato.DPV_dialog()
+    dialog.fun_ok()
+    assert SoftPotato.wf_params[-1] == "DPV" and SoftPotato.grid == "Equal"
+    assert SoftPotato.run_grid(SoftPotato.wf_params) == "Exp"
+    assert SoftPotato.run_grid([-0.5, 0.5, 1, 0.01, 2, "CV"]) == "Equal"
+    window.close()
+
+
+def test_bench_compare():
+    import sp_bench
+    base = {"time": 1.0, "peak": 100, "spread": 0.05}
+    assert sp_bench.compare({"time": 1.2, "peak": 105, "spread": 0.1}, base) == []
+    assert sp_bench.compare({"time": 1.5, "peak": 120, "spread": 0.1}, base) == ["time", "memory"]
+    assert sp_bench.compare({"time": 1.5, "peak": 100, "spread": 0.6}, base) == [] # Noisy run
+    assert sp_bench.compare({"time": 3.0, "peak": 100}, base) == [] # No spread, -r 1
+    assert sp_bench.compare({"time": 1.5, "peak": 100, "spread": 0}, base,
+                            sp_bench.tolerances["export_npz"]) == []
+
+
+def test_timings(tmp_path):
+    import json
+    sim = sp.make_sim([-0.5, 0.5, 1, 0.01, 2, "CV"], mech_params, snap=20, backend="numpy")
+    sim.timings = sp.Timings(trace=True)
+    sim.fd()
+    phases = sim.timings.phases
+    assert {"fd", "advance", "bc", "interior", "snapshot", "denorm"} <= set(phases)
+    assert phases["fd"][1] == 1 and phases["interior"][1] == sim.wf.nT - 1
+    assert "%" in sim.timings.summary() and len(sim.timings.table().splitlines()) == len(phases) + 1
+    assert not {"bc", "step", "advance"} & set(vars(sim)) # Unwrapped after fd
+    same = finished_run(snap=20, backend="numpy")
+    assert np.array_equal(sim.i, same.i) and np.array_equal(sim.cR, same.cR)
+    sim.timings.save_trace(tmp_path/"trace.json")
+    trace = json.load(open(tmp_path/"trace.json"))
+    names = {event["name"] for event in trace["traceEvents"]}
+    assert "fd" in names and "bc" not in names # Per step phases are only totals
+    assert trace["otherData"]["interior"]["calls"] == sim.wf.nT - 1
+
+
+@pytest.mark.parametrize("wf_params, mech, kwargs", [
+    ([-0.5, 0.5, 1, 0.001, 2, "CV"], mech_params, dict(snap="last")),
+    ([-0.5, 0.5, 1, 0.002, 2, "CV"], mech_params, dict(snap=100, dtype="float32")),
+    ([0.5, 1, 1e-3, "CA"], mech_params, dict(snap="last", tgrid="log", solver="CN")),
+    ([-0.2, 0.2, 0.001, 0.05, 0.01, 0.05, 1e-4, "DPV"], mech_params, dict(grid="Exp")),
+    ([-0.5, 0.5, 1, 0.002, 2, "CV"], [0, 1, 1e-5, 1e-5, 1e-6, 0, 1e8, 0.5, 1e3, 1e-4, "EC'"],
+     dict(snap="last"))])
+def test_estimate_memory(wf_params, mech, kwargs):
+    import tracemalloc
+    est = sp.Estimate(wf_params, mech, timed=False, **kwargs)
+    sp.make_sim(wf_params, mech, **kwargs).fd() # Imports and caches outside the peak
+    tracemalloc.start()
+    try:
+        sim = sp.make_sim(wf_params, mech, **kwargs)
+        sim.fd()
+        sim.cR, sim.cO
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak <= est.memory < 2*peak
+
+
+@pytest.mark.parametrize("wf_params", [[-0.5, 0.5, 1, 0.01, 2, "CV"],
+                                       [-0.5, 1, 1e-3, "CA"]]) # No current, only R in solution
+def test_float32_deviation(wf_params):
+    sim = sp.make_sim(wf_params, mech_params, snap="last", dtype="float32")
+    sim.fd()
+    assert sim.cR.dtype == np.float32
+    dev = sim.deviation()
+    assert max(dev.values()) < 1e-4
+    reference = sp.make_sim(wf_params, mech_params, snap="last")
+    reference.fd()
+    assert sim.deviation(reference) == dev
+
+
+def test_multi_without_chemistry():
+    # EC with kf = kb = 0 and DO = DR is E_mec's QR
+    wf_params = [0.5, -0.5, 1, 0.01, 2, "CV"]
+    sim = sp.make_sim(wf_params, [0, 1, 1e-5, 1e-5, 1e-6, 0, 1e8, 0.5, 0, 0, "EC"])
+    sim.fd()
+    plain = sp.make_sim(wf_params, [0, 1, 1e-5, 1e-5, 1e-6, 0, 1e8, 0.5, "QR"])
+    plain.fd()
+    assert np.allclose(sim.i, plain.i, rtol=0, atol=1e-5*np.max(np.abs(plain.i)))
+    assert np.allclose(sim.cO, plain.cO, rtol=0, atol=1e-5*1e-6)
+    assert not np.any(sim.concentration("Z"))
+
+def test_catalytic_plateau():
+    k, cZ = 1e4, 1e-2 # Z in 1e4 excess, pseudo first order
+    ttot = 20/(k*cZ)
+    mech = [0, 1, 1e-5, 1e-5, 1e-6, 0, 1e8, 0.5, k, cZ, "EC'"]
+    sim = sp.make_sim([-0.5, ttot, ttot/1e4, "CA"], mech, grid="Exp", snap="last")
+    sim.fd()
+    plateau = 96485.33212*1e-6*np.sqrt(1e-5*k*cZ)
+    assert abs(abs(sim.i[-1])/plateau - 1) < 1e-3
+    with pytest.warns(RuntimeWarning, match="reaction layer"): # 4.7 dX, 1.2 % low
+        sp.make_sim([-0.5, ttot, ttot/1e3, "CA"], mech, grid="Exp", snap="last")
+    with pytest.raises(ValueError, match="reaction layer"): # Stable but under 1 dX
+        sp.make_sim([-0.5, ttot, ttot/100, "CA"], mech, lamb=0.1, grid="Exp", snap="last")
+
+
+def test_steady_state():
+    mech = [0, 1, 1e-5, 1e-5, 1e-6, 0, 1e8, 0.5, 1e4, 1e-2, "EC'"] # Catalytic plateau
+    wf_params = [-0.5, 1, 1e-4, "CA"]
+    sim = sp.make_sim(wf_params, mech, grid="Exp", snap=1000, steady=1e-4)
+    sim.fd()
+    full = sp.make_sim(wf_params, mech, grid="Exp", snap=1000)
+    full.fd()
+    k = sim.kSteady
+    assert k is not None and sim.tSteady == sim.t[k] < 1 and full.kSteady is None
+    assert np.array_equal(sim.i[:k+1], full.i[:k+1]) and np.all(sim.i[k:] == sim.i[k])
+    assert np.max(np.abs(sim.i - full.i)) < 1e-4*abs(full.i[-1])
+    assert np.max(np.abs(sim.cO - full.cO)) < 1e-4*1e-6
+    pulse = sp.make_sim([-0.2, 0.2, 0.01, 0.05, 0.01, 0.05, 1e-3, "DPV"], mech_params,
+                        grid="Exp", steady=1e-4)
+    with pytest.raises(ValueError, match="sampled waveform"):
+        pulse.fd()